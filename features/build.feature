@@ -33,3 +33,12 @@ Feature: build resolution
     Then running "mcodex build story --pipeline=noop" fails with "must be a path"
     When I run "mcodex build {REPO_ROOT}/text_story --pipeline=noop"
     Then a file "{REPO_ROOT}/artifacts/story_worktree.pdf" exists
+
+  Scenario: Build all texts in the repository
+    Given an empty mcodex config
+    When I run "mcodex author add celestian \"Jan\" \"Novák\" jan.novak@example.com"
+    And I run "mcodex create \"Story\" --author=celestian"
+    And I run "mcodex create \"Other\" --author=celestian"
+    And I run "mcodex build --all -j 2 --pipeline=noop"
+    Then a file "artifacts/story_worktree.pdf" exists
+    And a file "artifacts/other_worktree.pdf" exists
@@ -15,3 +15,13 @@ Feature: git snapshots
     And I run "mcodex create \"Text\" --author=celestian"
     And I cd into "text_text"
     Then running "mcodex snapshot draft-1" fails with "Git repository not found"
+
+  Scenario: Several texts are snapshotted in one commit
+    Given an empty mcodex config
+    When I run "mcodex author add celestian \"Jan\" \"Novák\" jan.novak@example.com"
+    And I run "mcodex create \"Alpha\" --author=celestian"
+    And I run "mcodex create \"Beta\" --author=celestian"
+    And I run "mcodex snapshot --all rc --note \"issue 12\""
+    Then git tag "mcodex/alpha/rc-1" exists
+    And git tag "mcodex/beta/rc-1" exists
+    And a directory "text_beta/.snapshot/rc-1" exists
@@ -34,3 +34,12 @@ Feature: snapshots
     Then snapshot "draft-1" exists
     When I run "mcodex snapshot draft"
     Then snapshot "draft-2" exists
+
+  Scenario: Snapshots of the current text can be listed
+    Given an empty mcodex config
+    When I run "mcodex author add celestian \"Jan\" \"Novák\" jan.novak@example.com"
+    And I run "mcodex create \"Text\" --author=celestian"
+    And I cd into "text_text"
+    When I run "mcodex snapshot draft"
+    And I run "mcodex snapshot list"
+    Then the output contains "draft-1"
@@ -142,3 +142,9 @@ def step_run_fails_with(context, command: str, message: str) -> None:
     )
     combined = (completed.stdout or "") + (completed.stderr or "")
     assert message in combined, combined
+
+
+@then('the output contains "{text}"')
+def step_output_contains(context, text: str) -> None:
+    out = context.last.stdout
+    assert text in out, f"Expected {text!r} in output:\n{out}"
@@ -1,20 +1,37 @@
 from __future__ import annotations
 
+import os
 import sys
 from pathlib import Path
+from typing import Any
 
 from docopt import docopt
 
+from mcodex import trace
 from mcodex.cli_utils import locate_text_dir_for_build, locate_text_dir_for_snapshot
+from mcodex.config import find_repo_root
 from mcodex.errors import McodexError
+from mcodex.services.artifacts import artifacts_list
+from mcodex.services.artifacts_gc import artifacts_gc, parse_size
 from mcodex.services.author import author_add, author_list, author_remove
-from mcodex.services.build import build
+from mcodex.services.build import build_pipeline_results, resolve_pipeline_names
+from mcodex.services.build_batch import build_all, build_refs, format_build_reports
+from mcodex.services.build_server import request_build, serve
 from mcodex.services.create_text import create_text
+from mcodex.services.doctor import doctor
 from mcodex.services.init_repo import init_repo
+from mcodex.services.pipeline import PipelineResult
 from mcodex.services.pipeline_list import pipeline_list
-from mcodex.services.snapshot import snapshot_create, snapshot_list
+from mcodex.services.snapshot import (
+    snapshot_create,
+    snapshot_create_many,
+    snapshot_list,
+)
 from mcodex.services.status import show_status
 from mcodex.services.text_authors import text_author_add, text_author_remove
+from mcodex.services.texts import discover_text_dirs
+from mcodex.services.timings import format_timings, write_timings_json
+from mcodex.services.watch import watch
 
 __version__ = "0.1.0"
 
@@ -30,12 +47,20 @@ Usage:
   mcodex text author add <text_dir> <nickname>
   mcodex text author remove <text_dir> <nickname>
   mcodex pipeline list
-  mcodex build [<text>] [<ref>] [--pipeline=<name>]
-  mcodex snapshot <label> [--note=<note>]
-  mcodex snapshot <text> <label> [--note=<note>]
+  mcodex build [<text>] [<ref>] [options]
+  mcodex build --all [<ref>] [options]
+  mcodex watch [<text>] [<ref>] [options]
+  mcodex serve --socket=<path> [options]
   mcodex snapshot list
   mcodex snapshot list <text>
+  mcodex snapshot <label> [--note=<note>]
+  mcodex snapshot <text> <label> [--note=<note>]
+  mcodex snapshot --all <label> [--note=<note>]
+  mcodex snapshot --texts=<texts> <label> [--note=<note>]
   mcodex status [<text_dir>]
+  mcodex doctor [--refresh]
+  mcodex artifacts list [--json]
+  mcodex artifacts gc --max-size=<bytes> [--keep-latest-per-text=<n>]
   mcodex (-h | --help)
   mcodex --version
 
@@ -46,10 +71,33 @@ Options:
   --force        Overwrite existing template files when running `init`.
   --author=<nickname>  Author nickname (repeatable).
   --note=<note>  Optional note stored with the snapshot.
-  --pipeline=<name>  Build pipeline to use. [default: pdf]
+  --texts=<texts>  Comma-separated texts to snapshot together.
+  --refresh      Re-probe every tool instead of trusting the manifest.
+  --json         Print the artifact list as JSON.
+  --max-size=<bytes>  Size budget of `artifacts gc`, e.g. 2G or 500M.
+  --keep-latest-per-text=<n>  Never evict the <n> most recently used versions
+                 of each text. [default: 0]
+  --trace=<file>  Write a Chrome trace of the command to <file>; works with
+                 every command, as does MCODEX_TRACE=<file>.
   -h --help      Show this screen.
   --version      Show version.
 
+Build options:
+  --pipeline=<name>  Build pipeline(s) to use: a name, a comma-separated list,
+                 or "all". [default: pdf]
+  --no-cache     Rebuild even if a cached artifact matches all build inputs.
+  --persistent   Keep the latexmk working directory between builds.
+  --keep-scratch  Do not delete the temporary build directory; its path is
+                 printed for debugging.
+  --refs=<refs>  Build several refs of one text in parallel: comma-separated
+                 labels, stage names or globs (e.g. "draft-*,rc").
+  -j <n>, --jobs=<n>  Number of builds run in parallel with --all or --refs
+                 (default: CPU count).
+  --log          Print where the output of the pipeline tools was logged.
+  --timings      Print wall time, CPU time and peak memory of every step.
+  --timings-json=<file>  Write the same per-step timings as JSON.
+  --server=<path>  Send the build to a running `mcodex serve` at this socket.
+
 Build:
   <ref> is '.' for worktree, or a snapshot label.
 
@@ -63,14 +111,256 @@ Build:
     - Outside a repo:
         mcodex build <path> [<ref>]
 
+  Inside a repo, artifacts are cached in .mcodex/cache/builds/ and reused
+  while the sources, pipeline, templates and tools are unchanged.
+  Several pipelines (--pipeline=pdf,docx or --pipeline=all) are built in
+  parallel worker processes.
+  With --all, every text in the repo (directories named <text_prefix>*) is
+  built in parallel worker processes and a summary table is printed; a
+  failing text does not stop the others.
+  With --refs, several snapshots of one text are built the same way, e.g.
+  `mcodex build story --refs=draft-*,rc` (<text> is optional inside a text
+  directory).
+  With --persistent, latexmk reuses its .aux/.toc files from earlier builds
+  of the same text, ref and pipeline (kept in .mcodex/cache/work/).
+  Temporary build files go to the system temp directory, to build.scratch_dir
+  from .mcodex/config.yaml, or to $MCODEX_SCRATCH_DIR (e.g. /dev/shm).
+  The output of every tool run is written to
+  <artifacts>/logs/<slug>_<ref>/<pipeline>/<step>-<kind>.log; a failure
+  shows only its errors and last lines.
+  CPU time and peak memory shown by --timings are measured over the child
+  processes of each step; cached steps only report the time to restore them.
+
+Serve:
+  Keeps a warm process that runs builds requested over the Unix socket
+  <path> (usable by the current user only), at most --jobs at a time.
+  Identical concurrent requests (same text, ref, pipelines, options and
+  source digest) are built once and the result is sent to every client.
+  `mcodex build --server=<path>` prints the same output as a local build.
+
+Watch:
+  Builds once, then rebuilds whenever text.md, metadata.yaml or
+  .mcodex/templates/ change. Takes the same <text>/<ref> arguments and build
+  options as `build`; a change during a build cancels it and starts over.
+
+Doctor:
+  Lists the executables the configured pipelines run, with their resolved
+  path and version. They are kept in .mcodex/cache/toolchain.json and
+  probed again when PATH or a binary changes. Exits with 2 if any is missing.
+
+Artifacts:
+  Every build appends a line per artifact to <artifacts>/manifest.jsonl
+  (text, ref, pipeline, source digest, tool versions, build time).
+  `artifacts list` prints the latest entry of each artifact from it.
+  `artifacts gc` evicts the least recently used artifacts (all outputs and
+  logs of one text version at a time) and build-cache entries (including
+  the latexmk directories of --persistent builds) until both fit in
+  the --max-size budget, and prints the bytes reclaimed. Snapshots at or
+  past gc.protect_stage from .mcodex/config.yaml (default: final) and anything
+  used in the last 10 minutes are never evicted, so it is safe to run while
+  builds are running.
+
 Snapshot:
   <text> is optional when run inside a text directory.
   In a mcodex repo, <text> is the logical slug (without the text_ prefix).
   Outside a repo, <text> must be a path.
+  With --all (every text in the repo) or --texts=a,b,c, all texts are
+  snapshotted in one commit: the copies run in parallel, then the commit and
+  every mcodex/<slug>/<label> tag are created together. A stage as <label>
+  gives each text its next number. If any text fails, no snapshot, commit
+  or tag is left behind.
 """
 
 
+def _parse_jobs(raw: str | None) -> int | None:
+    if raw is None:
+        return None
+    try:
+        jobs = int(raw)
+    except ValueError:
+        raise ValueError(f"Invalid --jobs value: {raw}") from None
+    if jobs < 1:
+        raise ValueError(f"Invalid --jobs value: {raw}")
+    return jobs
+
+
+def _parse_keep_latest(raw: str) -> int:
+    try:
+        keep = int(raw)
+    except ValueError:
+        raise ValueError(f"Invalid --keep-latest-per-text value: {raw}") from None
+    if keep < 0:
+        raise ValueError(f"Invalid --keep-latest-per-text value: {raw}")
+    return keep
+
+
+def _log_dirs(results: list[PipelineResult]) -> list[str]:
+    return [str(r.log_dir) for r in results if r.log_dir is not None]
+
+
+def _report_logs(args: dict[str, Any], log_dirs: list[str]) -> None:
+    if args["--log"]:
+        for log_dir in log_dirs:
+            print(f"Logs: {log_dir}")
+
+
+def _report_scratch(results: list[PipelineResult]) -> None:
+    for r in results:
+        if r.scratch_dir is not None:
+            print(f"Kept scratch directory: {r.scratch_dir}", file=sys.stderr)
+
+
+def _print_error(e: Exception) -> None:
+    # Notes carry e.g. the scratch directory kept by --keep-scratch.
+    print("\n".join([str(e), *getattr(e, "__notes__", [])]), file=sys.stderr)
+
+
+def _report_timings(args: dict[str, Any], results: list[PipelineResult]) -> None:
+    if args["--timings"]:
+        print(format_timings(results))
+    if args["--timings-json"]:
+        write_timings_json(Path(args["--timings-json"]), results)
+
+
+def _build_all(args: dict[str, Any]) -> int:
+    try:
+        reports = build_all(
+            repo_root=find_repo_root(),
+            ref=args["<ref>"] or ".",
+            pipeline=args["--pipeline"],
+            jobs=_parse_jobs(args["--jobs"]),
+            use_cache=not args["--no-cache"],
+            persistent=bool(args["--persistent"]),
+            keep_scratch=bool(args["--keep-scratch"]),
+        )
+    except McodexError as e:
+        _print_error(e)
+        return 2
+    except (FileNotFoundError, NotADirectoryError, RuntimeError) as e:
+        _print_error(e)
+        return 2
+
+    if not reports:
+        print("No texts found.")
+        return 0
+
+    print(format_build_reports(reports))
+    _report_logs(args, _log_dirs([res for r in reports for res in r.results]))
+    _report_scratch([res for r in reports for res in r.results])
+    _report_timings(args, [res for r in reports for res in r.results])
+    return 0 if all(r.ok for r in reports) else 2
+
+
+def _build_refs(args: dict[str, Any]) -> int:
+    try:
+        if args["<ref>"] is not None:
+            raise ValueError("Use either <ref> or --refs, not both.")
+        text_dir = locate_text_dir_for_snapshot(text=args["<text>"])
+        reports = build_refs(
+            text_dir=text_dir,
+            refs=args["--refs"],
+            pipeline=args["--pipeline"],
+            jobs=_parse_jobs(args["--jobs"]),
+            use_cache=not args["--no-cache"],
+            persistent=bool(args["--persistent"]),
+            keep_scratch=bool(args["--keep-scratch"]),
+        )
+    except McodexError as e:
+        _print_error(e)
+        return 2
+    except (FileNotFoundError, NotADirectoryError, RuntimeError) as e:
+        _print_error(e)
+        return 2
+
+    print(format_build_reports(reports))
+    _report_logs(args, _log_dirs([res for r in reports for res in r.results]))
+    _report_scratch([res for r in reports for res in r.results])
+    _report_timings(args, [res for r in reports for res in r.results])
+    return 0 if all(r.ok for r in reports) else 2
+
+
+def _snapshot_many(args: dict[str, Any]) -> int:
+    if args["--all"]:
+        text_dirs = discover_text_dirs(repo_root=find_repo_root())
+    else:
+        names = [t.strip() for t in args["--texts"].split(",") if t.strip()]
+        if not names:
+            raise ValueError("--texts needs at least one text.")
+        text_dirs = [locate_text_dir_for_snapshot(text=name) for name in names]
+    if not text_dirs:
+        print("No texts found.")
+        return 0
+
+    snap_dirs = snapshot_create_many(
+        text_dirs=text_dirs, label=args["<label>"], note=args["--note"]
+    )
+    for snap_dir in snap_dirs:
+        print(f"Snapshot created: {snap_dir.parent.parent.name}/{snap_dir.name}")
+    return 0
+
+
+def _build_on_server(args: dict[str, Any]) -> int:
+    try:
+        if args["--all"] or args["--refs"]:
+            raise ValueError("--server cannot be combined with --all or --refs.")
+        if args["--timings"] or args["--timings-json"] or args["--keep-scratch"]:
+            raise ValueError(
+                "--timings, --timings-json and --keep-scratch are not "
+                "available with --server."
+            )
+        text_dir, resolved_ref = locate_text_dir_for_build(
+            text=args["<text>"], ref=args["<ref>"]
+        )
+        done = request_build(
+            socket_path=Path(args["--server"]),
+            text_dir=text_dir,
+            ref=resolved_ref,
+            pipeline=args["--pipeline"],
+            use_cache=not args["--no-cache"],
+            persistent=bool(args["--persistent"]),
+        )
+    except (FileNotFoundError, NotADirectoryError, RuntimeError, ValueError) as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    unchanged = set(done.get("unchanged") or [])
+    for out in done.get("outputs") or []:
+        print(f"{out} (unchanged)" if out in unchanged else out)
+    _report_logs(args, list(done.get("logs") or []))
+    return 0
+
+
+def _pop_trace_option(argv: list[str]) -> str | None:
+    """Remove `--trace=<file>` / `--trace <file>` from `argv`, any command."""
+
+    for i, arg in enumerate(argv):
+        if arg == "--":
+            break
+        if arg.startswith("--trace="):
+            del argv[i]
+            return arg.split("=", 1)[1]
+        if arg == "--trace" and i + 1 < len(argv):
+            value = argv[i + 1]
+            del argv[i : i + 2]
+            return value
+    return None
+
+
 def main(argv: list[str] | None = None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    trace_file = _pop_trace_option(argv) or os.environ.get(trace.ENV_VAR)
+    if not trace_file:
+        return _main(argv)
+
+    trace.start(Path(trace_file))
+    try:
+        with trace.span("mcodex " + " ".join(argv), "cli"):
+            return _main(argv)
+    finally:
+        trace.finish()
+
+
+def _main(argv: list[str]) -> int:
     args = docopt(_DOC, argv=argv, version=f"mcodex {__version__}")
 
     if args.get("init"):
@@ -123,6 +413,26 @@ def main(argv: list[str] | None = None) -> int:
         author_list()
         return 0
 
+    if args["serve"]:
+        try:
+            serve(
+                socket_path=Path(args["--socket"]),
+                jobs=_parse_jobs(args["--jobs"]),
+            )
+        except (OSError, RuntimeError, ValueError) as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        return 0
+
+    if args["build"] and args["--server"]:
+        return _build_on_server(args)
+
+    if args["build"] and args["--all"]:
+        return _build_all(args)
+
+    if args["build"] and args["--refs"]:
+        return _build_refs(args)
+
     if args["build"]:
         text = args["<text>"]
         ref = args["<ref>"]
@@ -130,17 +440,52 @@ def main(argv: list[str] | None = None) -> int:
 
         try:
             text_dir, resolved_ref = locate_text_dir_for_build(text=text, ref=ref)
-            out = build(text_dir=text_dir, ref=resolved_ref, pipeline=pipeline)
+            results = build_pipeline_results(
+                text_dir=text_dir,
+                ref=resolved_ref,
+                pipelines=resolve_pipeline_names(pipeline, text_dir=text_dir),
+                use_cache=not args["--no-cache"],
+                persistent=bool(args["--persistent"]),
+                keep_scratch=bool(args["--keep-scratch"]),
+            )
+        except McodexError as e:
+            _print_error(e)
+            return 2
+        except (FileNotFoundError, NotADirectoryError, RuntimeError) as e:
+            _print_error(e)
+            return 2
+
+        for result in results:
+            for out in result.outputs:
+                print(f"{out} (unchanged)" if out in result.unchanged else out)
+        _report_logs(args, _log_dirs(results))
+        _report_scratch(results)
+        _report_timings(args, results)
+        return 0
+
+    if args["watch"]:
+        try:
+            text_dir, resolved_ref = locate_text_dir_for_build(
+                text=args["<text>"], ref=args["<ref>"]
+            )
+            watch(
+                text_dir=text_dir,
+                ref=resolved_ref,
+                pipelines=resolve_pipeline_names(args["--pipeline"], text_dir=text_dir),
+                use_cache=not args["--no-cache"],
+                persistent=bool(args["--persistent"]),
+            )
         except McodexError as e:
             print(str(e), file=sys.stderr)
             return 2
         except (FileNotFoundError, NotADirectoryError, RuntimeError) as e:
             print(str(e), file=sys.stderr)
             return 2
-
-        print(out)
         return 0
 
+    if args["snapshot"] and (args["--all"] or args["--texts"]):
+        return _snapshot_many(args)
+
     if args["snapshot"] and not args["list"]:
         text_dir = locate_text_dir_for_snapshot(text=args["<text>"])
         snap_dir = snapshot_create(
@@ -156,6 +501,25 @@ def main(argv: list[str] | None = None) -> int:
         snapshot_list(text_dir=text_dir)
         return 0
 
+    if args["doctor"]:
+        try:
+            ok = doctor(refresh=bool(args["--refresh"]))
+        except McodexError as e:
+            print(str(e), file=sys.stderr)
+            return 2
+        return 0 if ok else 2
+
+    if args["artifacts"] and args["list"]:
+        artifacts_list(as_json=bool(args["--json"]))
+        return 0
+
+    if args["artifacts"] and args["gc"]:
+        artifacts_gc(
+            max_size=parse_size(args["--max-size"]),
+            keep_latest_per_text=_parse_keep_latest(args["--keep-latest-per-text"]),
+        )
+        return 0
+
     if args["status"]:
         from mcodex.cli_utils import resolve_text_dir
 
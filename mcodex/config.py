@@ -1,12 +1,14 @@
 from __future__ import annotations
 
+import os
 from collections.abc import Iterable
-from dataclasses import asdict
+from dataclasses import asdict, dataclass
 from pathlib import Path
 from typing import Any
 
 import yaml
 
+from mcodex import trace
 from mcodex.errors import PipelineConfigError, PipelineNotFoundError
 from mcodex.models import Author
 
@@ -18,6 +20,9 @@ class RepoConfigNotFoundError(FileNotFoundError):
 DEFAULT_ARTIFACTS_DIR = "artifacts"
 DEFAULT_SNAPSHOT_COMMIT_TEMPLATE = "Snapshot: {slug} / {label} — {note}"
 DEFAULT_TEXT_PREFIX = "text_"
+SCRATCH_DIR_ENV_VAR = "MCODEX_SCRATCH_DIR"
+DEFAULT_GC_PROTECT_STAGE = "final"
+SNAPSHOT_MODES = ("copy", "lazy")
 
 
 DEFAULT_PIPELINES: dict[str, Any] = {
@@ -51,10 +56,27 @@ DEFAULT_PIPELINES: dict[str, Any] = {
 }
 
 
+# Input name under which pipeline steps see the text's `text.md`.
+SOURCE_INPUT = "source"
+
+
+@dataclass(frozen=True)
+class StepIO:
+    """Named files a pipeline step reads and writes."""
+
+    inputs: tuple[str, ...]
+    outputs: tuple[str, ...]
+
+
 def repo_config_path(repo_root: Path) -> Path:
     return repo_root.expanduser().resolve() / ".mcodex" / "config.yaml"
 
 
+def repo_cache_path(repo_root: Path) -> Path:
+    return repo_root.expanduser().resolve() / ".mcodex" / "cache"
+
+
+@trace.traced("find_repo_root", "config")
 def find_repo_root(start: Path | None = None) -> Path:
     """Find repo root by searching for `.mcodex/config.yaml` upwards.
 
@@ -78,6 +100,7 @@ def find_repo_root(start: Path | None = None) -> Path:
     )
 
 
+@trace.traced("load_config", "config")
 def load_config(
     *,
     start: Path | None = None,
@@ -184,7 +207,7 @@ def validate_pipelines(pipelines: dict[str, Any]) -> None:
                 raise PipelineConfigError(
                     f"Invalid config: pipeline '{name}' step {i} missing kind."
                 )
-            if kind not in {"pandoc", "vlna", "latexmk"}:
+            if kind not in {"pandoc", "vlna", "nbsp", "latexmk"}:
                 raise PipelineConfigError(
                     f"Invalid config: pipeline '{name}' step {i} unknown kind: {kind}"
                 )
@@ -192,14 +215,119 @@ def validate_pipelines(pipelines: dict[str, Any]) -> None:
             if kind == "pandoc":
                 _require_non_empty_str(step, "from", name, i)
                 _require_non_empty_str(step, "to", name, i)
-            if kind == "vlna":
+            if kind in {"vlna", "nbsp"}:
                 _require_non_empty_str(step, "input", name, i)
                 _require_non_empty_str(step, "output", name, i)
+            if kind == "nbsp" and step.get("letters") is not None:
+                _require_non_empty_str(step, "letters", name, i)
             if kind == "latexmk":
                 engine = step.get("engine")
                 if engine is not None:
                     _require_non_empty_str(step, "engine", name, i)
                 _require_non_empty_str(step, "main", name, i)
+            for field in ("input", "output"):
+                if step.get(field) is not None:
+                    _require_non_empty_str(step, field, name, i)
+            timeout = step.get("timeout")
+            if timeout is not None and (
+                isinstance(timeout, bool)
+                or not isinstance(timeout, int | float)
+                or timeout <= 0
+            ):
+                raise PipelineConfigError(
+                    f"Invalid config: pipeline '{name}' step {i} timeout must be "
+                    "a positive number of seconds."
+                )
+
+        _validate_step_graph(name, pipeline_step_io(steps))
+
+
+def _default_latex_input(previous: list[tuple[str, StepIO]]) -> str | None:
+    # Without an explicit `input`, latexmk typesets the latest vlna/nbsp
+    # output, or the latest pandoc output if there is none.
+    for wanted in ({"vlna", "nbsp"}, {"pandoc"}):
+        for kind, io in reversed(previous):
+            if kind in wanted and io.outputs:
+                return io.outputs[0]
+    return None
+
+
+def pipeline_step_io(steps: list[dict[str, Any]]) -> list[StepIO]:
+    """Resolve the named inputs and outputs of each step.
+
+    Names refer to files in the build directory, except `SOURCE_INPUT`. Steps
+    may name their `input`/`output` explicitly; otherwise the defaults match
+    the historical linear wiring.
+    """
+
+    resolved: list[tuple[str, StepIO]] = []
+    for step in steps:
+        kind = str(step.get("kind") or "").strip()
+        explicit_in = str(step.get("input") or "").strip()
+        explicit_out = str(step.get("output") or "").strip()
+
+        if kind == "pandoc":
+            to = str(step.get("to") or "").strip()
+            default_out = f"output.{to}" if to in {"pdf", "docx"} else "body_raw.tex"
+            io = StepIO(
+                inputs=(explicit_in or SOURCE_INPUT,),
+                outputs=(explicit_out or default_out,),
+            )
+        elif kind == "latexmk":
+            body = explicit_in or _default_latex_input(resolved)
+            main = Path(str(step.get("main") or "main.tex").strip())
+            io = StepIO(
+                inputs=(body,) if body else (),
+                outputs=(main.with_suffix(".pdf").name,),
+            )
+        else:
+            io = StepIO(inputs=(explicit_in,), outputs=(explicit_out,))
+        resolved.append((kind, io))
+
+    return [io for _, io in resolved]
+
+
+def _validate_step_graph(name: str, graph: list[StepIO]) -> None:
+    producers: dict[str, int] = {}
+    for i, io in enumerate(graph):
+        for out in io.outputs:
+            if out == SOURCE_INPUT or out in producers:
+                raise PipelineConfigError(
+                    f"Invalid config: pipeline '{name}' step {i} output "
+                    f"'{out}' is already produced by another step."
+                )
+            producers[out] = i
+
+    for i, io in enumerate(graph):
+        if not io.inputs:
+            raise PipelineConfigError(
+                f"Invalid config: pipeline '{name}' step {i} has no input."
+            )
+        for inp in io.inputs:
+            if inp != SOURCE_INPUT and inp not in producers:
+                raise PipelineConfigError(
+                    f"Invalid config: pipeline '{name}' step {i} input "
+                    f"'{inp}' is not produced by any step."
+                )
+
+    # Kahn's algorithm: whatever cannot be ordered sits on a cycle.
+    deps = {
+        i: {producers[n] for n in io.inputs if n in producers}
+        for i, io in enumerate(graph)
+    }
+    done: set[int] = set()
+    ready = [i for i, d in deps.items() if not d]
+    while ready:
+        done.add(ready.pop())
+        ready.extend(
+            i for i, d in deps.items() if i not in done and d <= done and i not in ready
+        )
+    if len(done) != len(graph):
+        stuck = ", ".join(str(i) for i in sorted(set(deps) - done))
+        raise PipelineConfigError(
+            f"Invalid config: pipeline '{name}' has a dependency cycle "
+            f"between steps {stuck}."
+        )
 
 
 def _require_non_empty_str(
@@ -331,6 +459,56 @@ def resolve_artifacts_path(
     return root / get_artifacts_dir(repo_root=root)
 
 
+def resolve_scratch_dir(repo_root: Path | None) -> Path | None:
+    """Return where build scratch directories go, or None for the default.
+
+    `MCODEX_SCRATCH_DIR` overrides `build.scratch_dir` from the repo config;
+    a relative config value is taken relative to the repo root. The
+    directory is created if needed.
+    """
+
+    raw: object = os.environ.get(SCRATCH_DIR_ENV_VAR)
+    base = Path.cwd()
+    if not raw and repo_root is not None:
+        build = load_config(repo_root=repo_root).get("build")
+        raw = build.get("scratch_dir") if isinstance(build, dict) else None
+        base = repo_root
+    if raw is None or raw == "":
+        return None
+    if not isinstance(raw, str) or not raw.strip():
+        raise ValueError("Invalid build.scratch_dir: must be a non-empty path.")
+
+    path = Path(raw.strip()).expanduser()
+    if not path.is_absolute():
+        path = base / path
+    path.mkdir(parents=True, exist_ok=True)
+    return path.resolve()
+
+
+def get_gc_protect_stage(repo_root: Path) -> str:
+    """Return `gc.protect_stage`: artifacts of snapshots at or past it are kept."""
+
+    gc = load_config(repo_root=repo_root).get("gc")
+    raw = gc.get("protect_stage") if isinstance(gc, dict) else None
+    if raw is None:
+        return DEFAULT_GC_PROTECT_STAGE
+    if not isinstance(raw, str) or not raw.strip():
+        raise ValueError("Invalid gc.protect_stage: must be a stage name.")
+    return raw.strip()
+
+
+def get_snapshot_mode(repo_root: Path) -> str:
+    """Return `snapshot.mode`: "copy" (default) or "lazy" (tag and tree only)."""
+
+    snapshot = load_config(repo_root=repo_root).get("snapshot")
+    raw = snapshot.get("mode") if isinstance(snapshot, dict) else None
+    if raw is None:
+        return SNAPSHOT_MODES[0]
+    if raw not in SNAPSHOT_MODES:
+        raise ValueError(f"Invalid snapshot.mode: {raw!r} (expected copy or lazy).")
+    return str(raw)
+
+
 def save_authors(
     authors: dict[str, Author],
     *,
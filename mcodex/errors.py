@@ -24,3 +24,15 @@ class PipelineNotFoundError(McodexError):
 
         options = ", ".join(self.available)
         return f"Pipeline '{self.requested}' not found. Available pipelines: {options}."
+
+
+class StepTimeoutError(McodexError, RuntimeError):
+    """Raised when a pipeline step runs longer than its `timeout`."""
+
+    def __init__(self, command: list[str], timeout: float) -> None:
+        super().__init__(command, timeout)
+        self.command = command
+        self.timeout = timeout
+
+    def __str__(self) -> str:
+        return f"Command timed out after {self.timeout:g}s: {' '.join(self.command)}"
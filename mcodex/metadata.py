@@ -5,9 +5,12 @@ from typing import Any
 
 import yaml
 
+from mcodex import trace
+
 LATEST_METADATA_VERSION = 1
 
 
+@trace.traced("load_metadata", "metadata")
 def load_metadata(path: Path) -> dict[str, Any]:
     if not path.exists():
         raise FileNotFoundError(f"Metadata file not found: {path}")
@@ -0,0 +1,170 @@
+"""Index of built artifacts: `<artifacts>/manifest.jsonl`.
+
+Every build appends one JSON line per published artifact, recording what it
+was built from (text, version, pipeline, source digest, tool versions), when
+and how long it took. The file is append-only; the latest line for a path
+describes the current artifact. Appends from concurrent builds, and the
+rewrite by `compact_manifest`, are serialized with `flock` on a lock file
+next to it; a torn line left by an interrupted write is skipped.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+from collections.abc import Iterable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+from mcodex.config import find_repo_root, get_artifacts_dir
+
+MANIFEST_NAME = "manifest.jsonl"
+_LOCK_NAME = ".manifest.lock"
+
+
+@dataclass(frozen=True)
+class ArtifactRecord:
+    # Relative to the artifacts directory.
+    path: str
+    text: str
+    version: str
+    pipeline: str
+    source_digest: str
+    built_at: str
+    wall: float = 0.0
+    size: int = 0
+    # Served from the build cache rather than built.
+    cached: bool = False
+    tools: dict[str, str] = field(default_factory=dict)
+
+
+def manifest_path(artifacts_dir: Path) -> Path:
+    return artifacts_dir / MANIFEST_NAME
+
+
+def append_records(artifacts_dir: Path, records: Iterable[ArtifactRecord]) -> None:
+    """Append `records` to the manifest in one locked write."""
+
+    data = _encode(records)
+    if not data:
+        return
+
+    with _manifest_lock(artifacts_dir):
+        fd = os.open(
+            manifest_path(artifacts_dir), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o666
+        )
+        try:
+            size = os.fstat(fd).st_size
+            # Start on a fresh line after a write that was cut short.
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                data = b"\n" + data
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def compact_manifest(artifacts_dir: Path) -> None:
+    """Rewrite the manifest with the latest record of each artifact on disk.
+
+    Builds publish an artifact before appending its record, so a record
+    appended while this runs is never dropped.
+    """
+
+    with _manifest_lock(artifacts_dir):
+        records = [
+            r
+            for r in latest_records(artifacts_dir)
+            if (artifacts_dir / r.path).is_file()
+        ]
+        path = manifest_path(artifacts_dir)
+        tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(_encode(records))
+        os.replace(tmp, path)
+
+
+@contextmanager
+def _manifest_lock(artifacts_dir: Path) -> Iterator[None]:
+    artifacts_dir.mkdir(parents=True, exist_ok=True)
+    with (artifacts_dir / _LOCK_NAME).open("a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def _encode(records: Iterable[ArtifactRecord]) -> bytes:
+    return "".join(
+        json.dumps(asdict(r), sort_keys=True, ensure_ascii=False) + "\n"
+        for r in records
+    ).encode("utf-8")
+
+
+def _parse(line: str) -> ArtifactRecord | None:
+    try:
+        raw: Any = json.loads(line)
+        record = ArtifactRecord(**raw)
+    except (ValueError, TypeError):
+        return None
+    return record if isinstance(record.path, str) and record.path else None
+
+
+def read_records(artifacts_dir: Path) -> list[ArtifactRecord]:
+    """All records in the order they were appended."""
+
+    path = manifest_path(artifacts_dir)
+    if not path.is_file():
+        return []
+    with path.open(encoding="utf-8", errors="replace") as f:
+        return [r for line in f if line.strip() and (r := _parse(line)) is not None]
+
+
+def latest_records(artifacts_dir: Path) -> list[ArtifactRecord]:
+    """The most recent record of every artifact path, sorted by path."""
+
+    latest: dict[str, ArtifactRecord] = {}
+    for record in read_records(artifacts_dir):
+        latest[record.path] = record
+    return [latest[p] for p in sorted(latest)]
+
+
+def repo_artifacts_dir(start: Path | None = None) -> Path:
+    repo_root = find_repo_root(start)
+    return repo_root / get_artifacts_dir(repo_root=repo_root)
+
+
+def format_records(records: list[ArtifactRecord]) -> str:
+    headers = ("ARTIFACT", "TEXT", "VERSION", "PIPELINE", "BUILT", "WALL", "SOURCE")
+    rows = [
+        (
+            r.path,
+            r.text,
+            r.version,
+            r.pipeline,
+            r.built_at[:19].replace("T", " "),
+            "cached" if r.cached else f"{r.wall:.2f}s",
+            r.source_digest[:12] or "-",
+        )
+        for r in records
+    ]
+    widths = [
+        max([len(headers[i]), *(len(row[i]) for row in rows)])
+        for i in range(len(headers))
+    ]
+    return "\n".join(
+        "  ".join(cell.ljust(w) for cell, w in zip(row, widths, strict=True)).rstrip()
+        for row in [headers, *rows]
+    )
+
+
+def artifacts_list(*, start: Path | None = None, as_json: bool = False) -> None:
+    """Print the current artifacts of the repo from its manifest."""
+
+    records = latest_records(repo_artifacts_dir(start))
+    if as_json:
+        print(json.dumps([asdict(r) for r in records], indent=2, ensure_ascii=False))
+        return
+    if not records:
+        print("No artifacts recorded.")
+        return
+    print(format_records(records))
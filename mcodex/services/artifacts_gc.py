@@ -0,0 +1,351 @@
+"""Evict artifacts and build-cache entries down to a size budget.
+
+Artifacts are evicted per built version of a text (every pipeline output
+recorded in the manifest for that text and ref, plus its tool logs), cache
+entries (including materialized lazy snapshots and the persistent latexmk
+directories of `--persistent` builds) one at a time, least recently used
+first. An artifact was last used when it was built or read; a
+cache entry when it was stored or hit.
+
+Never evicted:
+- artifacts of snapshots at or past `gc.protect_stage` (default "final"),
+- the `keep_latest_per_text` most recently used versions of every text,
+- anything used in the last `IN_USE_GRACE` seconds, which covers builds
+  running concurrently,
+- a persistent latexmk directory whose lock a running build holds.
+
+Files are removed with `safe_unlink` and only if they were not replaced since
+they were inspected, directories with `safe_rmtree`, both confined to the
+artifacts and cache directories.
+"""
+
+from __future__ import annotations
+
+import fcntl
+import os
+import re
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from pathlib import Path
+
+from mcodex.config import (
+    find_repo_root,
+    get_gc_protect_stage,
+    resolve_artifacts_path,
+)
+from mcodex.services.artifacts import compact_manifest, latest_records
+from mcodex.services.build_cache import WORKDIR_LOCK, cache_entry_roots
+from mcodex.services.fs import safe_rmtree, safe_unlink
+from mcodex.services.snapshot_index import stage_index
+
+IN_USE_GRACE = 600.0
+
+_SIZE_RE = re.compile(r"^\s*(?P<num>[0-9]+)\s*(?P<unit>[KMGT]?)(?:i?B)?\s*$", re.I)
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+@dataclass(frozen=True)
+class _Unit:
+    """Something evicted as a whole: a built version or a cache entry."""
+
+    name: str
+    files: tuple[tuple[Path, os.stat_result], ...]
+    last_used: float
+    size: int
+    # A directory removed along with the files (logs, a step entry).
+    tree: Path | None = None
+    # Lock file of `tree` held by a build using it (persistent latexmk dirs).
+    lock: Path | None = None
+    text: str | None = None
+    protected: bool = False
+
+
+@dataclass(frozen=True)
+class GcReport:
+    max_size: int
+    size_before: int
+    size_after: int
+    evicted: list[str] = field(default_factory=list)
+    evicted_cache_entries: int = 0
+
+    @property
+    def reclaimed(self) -> int:
+        return self.size_before - self.size_after
+
+
+def parse_size(value: str) -> int:
+    """Parse a byte count such as "1048576", "500M" or "2GiB" (powers of 1024)."""
+
+    m = _SIZE_RE.match(value)
+    if not m:
+        raise ValueError(f"Invalid size: {value!r}")
+    return int(m.group("num")) * _SIZE_UNITS[m.group("unit").upper()]
+
+
+def _stat(path: Path) -> os.stat_result | None:
+    try:
+        return path.lstat()
+    except FileNotFoundError:
+        return None
+
+
+def _tree_files(root: Path) -> list[tuple[Path, os.stat_result]]:
+    out: list[tuple[Path, os.stat_result]] = []
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = Path(dirpath) / name
+            st = _stat(path)
+            if st is not None:
+                out.append((path, st))
+    return out
+
+
+def _built_at(value: str) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def _artifact_units(
+    artifacts_dir: Path, *, protect_from: int, keep_latest: int
+) -> list[_Unit]:
+    groups: dict[tuple[str, str], list[tuple[Path, os.stat_result, float]]] = {}
+    for record in latest_records(artifacts_dir):
+        path = artifacts_dir / record.path
+        st = _stat(path)
+        if st is None:
+            continue
+        groups.setdefault((record.text, record.version), []).append(
+            (path, st, _built_at(record.built_at))
+        )
+
+    units: list[_Unit] = []
+    for (text, version), files in groups.items():
+        logs = artifacts_dir / "logs" / f"{text}_{version}"
+        log_files = _tree_files(logs) if logs.is_dir() else []
+        index = stage_index(version)
+        units.append(
+            _Unit(
+                name=", ".join(sorted(p.name for p, _, _ in files)),
+                files=tuple((p, st) for p, st, _ in files),
+                last_used=max(
+                    max(built, st.st_atime, st.st_mtime) for _, st, built in files
+                ),
+                size=sum(st.st_size for _, st, _ in files)
+                + sum(st.st_size for _, st in log_files),
+                tree=logs if log_files else None,
+                text=text,
+                protected=index is not None and index >= protect_from,
+            )
+        )
+
+    by_text: dict[str, list[_Unit]] = {}
+    for unit in units:
+        by_text.setdefault(unit.text or "", []).append(unit)
+    out: list[_Unit] = []
+    for text_units in by_text.values():
+        text_units.sort(key=lambda u: u.last_used, reverse=True)
+        out.extend(replace(u, protected=True) for u in text_units[:keep_latest])
+        out.extend(text_units[keep_latest:])
+    return out
+
+
+def _cache_units(repo_root: Path) -> list[_Unit]:
+    builds, steps, trees, work = cache_entry_roots(repo_root)
+    units: list[_Unit] = []
+
+    # builds/<xx>/<key> plus its <key>.tools.json record.
+    entries: dict[Path, list[tuple[Path, os.stat_result]]] = {}
+    for path, st in _tree_files(builds) if builds.is_dir() else []:
+        if path.name.startswith("."):
+            continue
+        key = path.name.removesuffix(".tools.json")
+        entries.setdefault(path.with_name(key), []).append((path, st))
+    for entry, files in entries.items():
+        units.append(
+            _Unit(
+                name=entry.name,
+                files=tuple(files),
+                last_used=max(st.st_mtime for _, st in files),
+                size=sum(st.st_size for _, st in files),
+            )
+        )
+
+    # steps/<xx>/<key>/, trees/<xx>/<tree>/ and work/<source>/<pipeline>/
+    # directories. A work dir's `.lock` is rewritten by every build using it.
+    shards = [
+        (root, d)
+        for root in (steps, trees, work)
+        if root.is_dir()
+        for d in root.iterdir()
+    ]
+    for root, shard in sorted(shards):
+        for entry in sorted(shard.iterdir()) if shard.is_dir() else []:
+            dir_st = _stat(entry)
+            if dir_st is None or not entry.is_dir():
+                continue
+            files = _tree_files(entry)
+            units.append(
+                _Unit(
+                    name=entry.name,
+                    files=(),
+                    last_used=max([dir_st.st_mtime, *(s.st_mtime for _, s in files)]),
+                    size=sum(s.st_size for _, s in files),
+                    tree=entry,
+                    lock=entry / WORKDIR_LOCK if root == work else None,
+                )
+            )
+    return units
+
+
+@contextmanager
+def _unless_locked(lock: Path) -> Iterator[bool]:
+    """Hold `lock` while nobody else does; yields whether it was free."""
+
+    try:
+        fd = os.open(lock, os.O_RDONLY)
+    except FileNotFoundError:
+        yield True
+        return
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)
+
+
+def _evict(unit: _Unit, *, roots: list[Path]) -> int:
+    """Remove `unit`; returns the bytes actually freed."""
+
+    if unit.lock is None:
+        return _remove(unit, roots=roots)
+    # A latexmk dir in use is skipped, however long the build has run.
+    with _unless_locked(unit.lock) as free:
+        return _remove(unit, roots=roots) if free else 0
+
+
+def _remove(unit: _Unit, *, roots: list[Path]) -> int:
+    freed = 0
+    for path, st in unit.files:
+        if safe_unlink(path, allowed_roots=roots, expected=st):
+            freed += st.st_size
+    # Logs go with their artifacts, unless a build replaced all of those.
+    if unit.tree is not None and (freed or not unit.files):
+        size = sum(st.st_size for _, st in _tree_files(unit.tree))
+        safe_rmtree(unit.tree, allowed_roots=roots, ignore_errors=True)
+        freed += size - sum(st.st_size for _, st in _tree_files(unit.tree))
+    return freed
+
+
+def collect_garbage(
+    *,
+    repo_root: Path,
+    max_size: int,
+    keep_latest_per_text: int = 0,
+    now: float | None = None,
+) -> GcReport:
+    """Evict the least recently used artifacts and cache entries of a repo.
+
+    Stops once the rest takes at most `max_size` bytes, or when only
+    protected, kept or recently used data is left.
+    """
+
+    if max_size < 0:
+        raise ValueError("max_size must not be negative.")
+    if keep_latest_per_text < 0:
+        raise ValueError("keep_latest_per_text must not be negative.")
+
+    stage = get_gc_protect_stage(repo_root)
+    protect_from = stage_index(stage)
+    if protect_from is None:
+        raise ValueError(f"Invalid gc.protect_stage: unknown stage {stage!r}.")
+
+    artifacts_dir = resolve_artifacts_path(repo_root=repo_root)
+    cache_roots = list(cache_entry_roots(repo_root))
+    artifact_units = _artifact_units(
+        artifacts_dir, protect_from=protect_from, keep_latest=keep_latest_per_text
+    )
+    cache_units = _cache_units(repo_root)
+
+    size_before = sum(u.size for u in artifact_units + cache_units)
+    size = size_before
+    cutoff = (time.time() if now is None else now) - IN_USE_GRACE
+    evicted: list[str] = []
+    evicted_cache = 0
+
+    candidates = sorted(
+        [(u, True) for u in artifact_units] + [(u, False) for u in cache_units],
+        key=lambda c: c[0].last_used,
+    )
+    for unit, is_artifact in candidates:
+        if size <= max_size:
+            break
+        if unit.protected or unit.last_used >= cutoff:
+            continue
+        roots = [artifacts_dir] if is_artifact else cache_roots
+        freed = _evict(unit, roots=roots)
+        size -= freed
+        if not freed:
+            continue
+        if is_artifact:
+            evicted.append(unit.name)
+        else:
+            evicted_cache += 1
+
+    if evicted:
+        compact_manifest(artifacts_dir)
+
+    return GcReport(
+        max_size=max_size,
+        size_before=size_before,
+        size_after=size,
+        evicted=evicted,
+        evicted_cache_entries=evicted_cache,
+    )
+
+
+def _human(n: int) -> str:
+    value = float(n)
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if value < 1024 or unit == "GiB":
+            return f"{value:.0f} {unit}" if unit == "B" else f"{value:.1f} {unit}"
+        value /= 1024
+    raise AssertionError("unreachable")
+
+
+def format_gc_report(report: GcReport) -> str:
+    lines = [f"Evicted: {name}" for name in report.evicted]
+    lines.append(
+        f"Reclaimed {_human(report.reclaimed)} ({report.reclaimed} bytes): "
+        f"{len(report.evicted)} artifact version(s), "
+        f"{report.evicted_cache_entries} cache entries."
+    )
+    lines.append(
+        f"Artifacts and cache now take {_human(report.size_after)} "
+        f"of {_human(report.max_size)}."
+    )
+    if report.size_after > report.max_size:
+        lines.append("Still over budget: the rest is protected, kept or recently used.")
+    return "\n".join(lines)
+
+
+def artifacts_gc(
+    *, start: Path | None = None, max_size: int, keep_latest_per_text: int = 0
+) -> GcReport:
+    """Run `collect_garbage` on the repo around `start` and print the report."""
+
+    report = collect_garbage(
+        repo_root=find_repo_root(start),
+        max_size=max_size,
+        keep_latest_per_text=keep_latest_per_text,
+    )
+    print(format_gc_report(report))
+    return report
@@ -1,19 +1,32 @@
 from __future__ import annotations
 
-import re
+import fnmatch
+import os
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
+from datetime import datetime
 from pathlib import Path
 
 from mcodex.config import (
     DEFAULT_ARTIFACTS_DIR,
+    DEFAULT_PIPELINES,
     RepoConfigNotFoundError,
     find_repo_root,
     get_artifacts_dir,
+    get_pipelines,
 )
+from mcodex.errors import PipelineConfigError
 from mcodex.metadata import load_metadata
-from mcodex.services.pipeline import run_pipeline
-
-_SNAP_RE = re.compile(r"^(?P<stage>[a-z]+)-(?P<num>[0-9]+)$")
+from mcodex.services.artifacts import ArtifactRecord, append_records
+from mcodex.services.pipeline import PipelineResult, run_pipeline
+from mcodex.services.snapshot import materialize_snapshot
+from mcodex.services.snapshot_index import (
+    SnapshotEntry,
+    SnapshotIndex,
+    load_snapshot_index,
+    parse_snapshot_label,
+    refresh_snapshot_index,
+)
 
 
 @dataclass(frozen=True)
@@ -22,7 +35,28 @@ class BuildSource:
     version_label: str
 
 
-def build(*, text_dir: Path, ref: str, pipeline: str = "pdf") -> Path:
+@dataclass(frozen=True)
+class _PipelineJob:
+    pipeline_name: str
+    source_dir: Path
+    output_path: Path
+    version_label: str
+    use_cache: bool
+    persistent: bool
+    built_at: datetime
+    slug: str = ""
+    keep_scratch: bool = False
+    log_dir: Path | None = None
+
+
+def build(
+    *,
+    text_dir: Path,
+    ref: str,
+    pipeline: str = "pdf",
+    use_cache: bool = True,
+    persistent: bool = False,
+) -> Path:
     """Build a document artifact.
 
     Args:
@@ -30,30 +64,215 @@ def build(*, text_dir: Path, ref: str, pipeline: str = "pdf") -> Path:
         ref: "." for worktree, a snapshot label (e.g. "draft-3"),
              or a stage name (e.g. "draft") which resolves to latest "draft-N".
         pipeline: Build pipeline name. Supported: "pdf", "noop".
+        use_cache: Reuse a cached artifact when all build inputs are unchanged.
+        persistent: Keep the latexmk working directory between builds.
     """
 
     pipeline_name = str(pipeline or "pdf").strip().lower()
-    if pipeline_name == "noop":
-        return _build_noop(text_dir=text_dir, version=ref)
+    return build_pipelines(
+        text_dir=text_dir,
+        ref=ref,
+        pipelines=[pipeline_name],
+        use_cache=use_cache,
+        persistent=persistent,
+    )[0]
+
+
+def build_pipelines(
+    *,
+    text_dir: Path,
+    ref: str,
+    pipelines: list[str],
+    use_cache: bool = True,
+    persistent: bool = False,
+    jobs: int | None = None,
+    keep_scratch: bool = False,
+) -> list[Path]:
+    """Build one text with several pipelines; see `build_pipeline_results`.
+
+    Returns artifact paths in `pipelines` order; a pipeline with several
+    outputs contributes its primary artifact first.
+    """
+
+    results = build_pipeline_results(
+        text_dir=text_dir,
+        ref=ref,
+        pipelines=pipelines,
+        use_cache=use_cache,
+        persistent=persistent,
+        jobs=jobs,
+        keep_scratch=keep_scratch,
+    )
+    return [path for result in results for path in result.outputs]
+
+
+def build_pipeline_results(
+    *,
+    text_dir: Path,
+    ref: str,
+    pipelines: list[str],
+    use_cache: bool = True,
+    persistent: bool = False,
+    jobs: int | None = None,
+    keep_scratch: bool = False,
+) -> list[PipelineResult]:
+    """Build one text with several pipelines.
+
+    The source is resolved once and every artifact gets the same build time.
+    Tool output is logged under `<artifacts>/logs/<slug>_<version>/<pipeline>/`.
+    With more than one pipeline, each runs in its own worker process (at most
+    `jobs` at a time, default one per pipeline), so the wall time approaches
+    that of the slowest pipeline. Returns one result per pipeline, in order.
+    """
 
     text_dir = text_dir.expanduser().resolve()
+    if "noop" in pipelines:
+        if len(pipelines) != 1:
+            raise ValueError("The noop pipeline cannot be combined with others.")
+        noop = _build_noop(text_dir=text_dir, version=ref)
+        result = PipelineResult(
+            output_path=noop, commands=[], outputs=[noop], pipeline="noop"
+        )
+        source = _resolve_source(text_dir=text_dir, version=ref)
+        _record_artifacts(
+            result,
+            slug=_load_slug(source.source_dir),
+            version_label=source.version_label,
+            built_at=datetime.now().astimezone(),
+        )
+        return [result]
+
     source = _resolve_source(text_dir=text_dir, version=ref)
     slug = _load_slug(source.source_dir)
 
     out_dir = _resolve_artifacts_dir(text_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
 
-    out_ext = _pipeline_output_ext(pipeline_name)
-    out_name = f"{slug}_{source.version_label}.{out_ext}"
-    out_path = out_dir / out_name
+    built_at = datetime.now().astimezone()
+    out_names = _artifact_names(
+        slug=slug, version_label=source.version_label, pipelines=pipelines
+    )
+    pipeline_jobs = [
+        _PipelineJob(
+            pipeline_name=name,
+            source_dir=source.source_dir,
+            output_path=out_dir / out_names[name],
+            version_label=source.version_label,
+            use_cache=use_cache,
+            persistent=persistent,
+            built_at=built_at,
+            slug=slug,
+            keep_scratch=keep_scratch,
+            log_dir=out_dir / "logs" / f"{slug}_{source.version_label}" / name,
+        )
+        for name in pipelines
+    ]
+
+    workers = min(len(pipeline_jobs), jobs or len(pipeline_jobs))
+    if workers <= 1:
+        return [_run_pipeline_job(job) for job in pipeline_jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_pipeline_job, pipeline_jobs))
+
+
+def resolve_pipeline_names(value: str | None, *, text_dir: Path) -> list[str]:
+    """Expand a `--pipeline` value into pipeline names.
+
+    Accepts a single name, a comma-separated list, or "all" for every
+    configured pipeline (`DEFAULT_PIPELINES` outside a repo).
+    """
+
+    names: list[str] = []
+    for raw in str(value or "pdf").split(","):
+        name = raw.strip().lower()
+        if not name:
+            continue
+        if name == "all":
+            names.extend(_available_pipelines(text_dir))
+        else:
+            names.append(name)
+
+    unique = list(dict.fromkeys(names))
+    if not unique:
+        raise PipelineConfigError("No pipelines selected.")
+    return unique
+
+
+def _artifact_names(
+    *, slug: str, version_label: str, pipelines: list[str]
+) -> dict[str, str]:
+    """Name artifacts `<slug>_<version>.<ext>`.
+
+    When several selected pipelines produce the same extension, those whose
+    name differs from the extension get a `_<pipeline>` suffix so they do not
+    overwrite each other.
+    """
 
-    run_pipeline(
-        pipeline_name=pipeline_name,
-        source_dir=source.source_dir,
-        output_path=out_path,
-        version_label=source.version_label,
+    exts = {name: _pipeline_output_ext(name) for name in pipelines}
+    out: dict[str, str] = {}
+    for name, ext in exts.items():
+        shared = sum(1 for e in exts.values() if e == ext) > 1
+        if shared and name != ext:
+            out[name] = f"{slug}_{version_label}_{name}.{ext}"
+        else:
+            out[name] = f"{slug}_{version_label}.{ext}"
+    return out
+
+
+def _available_pipelines(text_dir: Path) -> list[str]:
+    try:
+        repo_root = find_repo_root(text_dir)
+    except RepoConfigNotFoundError:
+        return list(DEFAULT_PIPELINES)
+    return [str(name) for name in get_pipelines(repo_root=repo_root)]
+
+
+def _run_pipeline_job(job: _PipelineJob) -> PipelineResult:
+    result = run_pipeline(
+        pipeline_name=job.pipeline_name,
+        source_dir=job.source_dir,
+        output_path=job.output_path,
+        version_label=job.version_label,
+        use_cache=job.use_cache,
+        persistent=job.persistent,
+        built_at=job.built_at,
+        keep_scratch=job.keep_scratch,
+        log_dir=job.log_dir,
+    )
+    _record_artifacts(
+        result,
+        slug=job.slug,
+        version_label=job.version_label,
+        built_at=job.built_at,
+    )
+    return result
+
+
+def _record_artifacts(
+    result: PipelineResult, *, slug: str, version_label: str, built_at: datetime
+) -> None:
+    """Append the outputs of `result` to the artifacts manifest."""
+
+    artifacts_dir = result.output_path.parent
+    append_records(
+        artifacts_dir,
+        [
+            ArtifactRecord(
+                path=os.path.relpath(out, artifacts_dir),
+                text=slug,
+                version=version_label,
+                pipeline=result.pipeline,
+                source_digest=result.source_digest,
+                built_at=built_at.isoformat(timespec="seconds"),
+                wall=round(result.wall, 3),
+                size=out.stat().st_size,
+                cached=result.cached,
+                tools=result.tools,
+            )
+            for out in result.outputs
+        ],
     )
-    return out_path
 
 
 def build_pdf(*, text_dir: Path, version: str) -> Path:
@@ -106,28 +325,68 @@ def _pipeline_output_ext(pipeline_name: str) -> str:
     return "pdf"
 
 
-def _latest_snapshot_for_stage(text_dir: Path, stage: str) -> str | None:
-    root = text_dir / ".snapshot"
-    if not root.exists():
-        return None
+def _find_snapshot(index: SnapshotIndex, label: str) -> SnapshotEntry | None:
+    """A snapshot by label, or the latest of a stage ("draft")."""
+
+    entry = index.get(label)
+    if entry is None and label.isalpha() and label.islower():
+        latest = index.latest_of_stage(label)
+        entry = index.get(latest) if latest is not None else None
+    return entry
+
 
-    best_num: int | None = None
-    best_label: str | None = None
+def _snapshot_sort_key(label: str) -> tuple[str, int, str]:
+    parsed = parse_snapshot_label(label)
+    if parsed is None:
+        return (label, 0, label)
+    return (parsed[0], parsed[1], label)
 
-    for p in root.iterdir():
-        if not p.is_dir() or p.name == ".gitkeep":
+
+def resolve_ref_patterns(*, text_dir: Path, patterns: str) -> list[str]:
+    """Expand a comma-separated `--refs` value into concrete refs.
+
+    Each item is "." (worktree), a glob over snapshot labels (e.g. "draft-*"),
+    a stage name resolving to its latest snapshot, or an explicit label. The
+    snapshot index is loaded once. Duplicates are dropped, order is kept.
+    """
+
+    index = load_snapshot_index(text_dir.expanduser().resolve())
+    labels = sorted(index.labels, key=_snapshot_sort_key)
+
+    refs: list[str] = []
+    for raw in str(patterns or "").split(","):
+        item = raw.strip()
+        if not item:
             continue
-        m = _SNAP_RE.match(p.name)
-        if not m:
+        if item == ".":
+            refs.append(item)
             continue
-        if m.group("stage") != stage:
+        if any(c in item for c in "*?["):
+            matched = fnmatch.filter(labels, item)
+            if not matched:
+                raise FileNotFoundError(f"No snapshots match: {item}")
+            refs.extend(matched)
             continue
-        num = int(m.group("num"))
-        if best_num is None or num > best_num:
-            best_num = num
-            best_label = p.name
+        if item in labels:
+            refs.append(item)
+            continue
+        if item.isalpha() and item.islower():
+            latest = index.latest_of_stage(item)
+            if latest is not None:
+                refs.append(latest)
+                continue
+        raise FileNotFoundError(f"Snapshot not found: {item}")
+
+    unique = list(dict.fromkeys(refs))
+    if not unique:
+        raise ValueError("No refs selected.")
+    return unique
+
 
-    return best_label
+def resolve_build_source(*, text_dir: Path, version: str) -> BuildSource:
+    """Resolve a ref (".", a snapshot label or a stage name) to its sources."""
+
+    return _resolve_source(text_dir=text_dir.expanduser().resolve(), version=version)
 
 
 def _resolve_source(*, text_dir: Path, version: str) -> BuildSource:
@@ -141,14 +400,18 @@ def _resolve_source(*, text_dir: Path, version: str) -> BuildSource:
             raise NotADirectoryError(f"Snapshot is not a directory: {snap_dir}")
         return BuildSource(source_dir=snap_dir, version_label=label)
 
-    stage_candidate = label
-    if stage_candidate.isalpha() and stage_candidate.islower():
-        latest = _latest_snapshot_for_stage(text_dir, stage_candidate)
-        if latest is not None:
-            resolved = text_dir / ".snapshot" / latest
-            return BuildSource(source_dir=resolved, version_label=latest)
-
-    raise FileNotFoundError(f"Snapshot not found: {label}")
+    entry = _find_snapshot(load_snapshot_index(text_dir), label)
+    if entry is None:
+        # Lazy snapshots fetched since the index was written.
+        entry = _find_snapshot(refresh_snapshot_index(text_dir), label)
+    if entry is None:
+        raise FileNotFoundError(f"Snapshot not found: {label}")
+
+    if entry.tree is not None:
+        source_dir = materialize_snapshot(text_dir=text_dir, entry=entry)
+    else:
+        source_dir = text_dir / ".snapshot" / entry.label
+    return BuildSource(source_dir=source_dir, version_label=entry.label)
 
 
 def _load_slug(source_dir: Path) -> str:
@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from mcodex.services.build import (
+    build_pipeline_results,
+    resolve_pipeline_names,
+    resolve_ref_patterns,
+)
+from mcodex.services.pipeline import PipelineResult
+from mcodex.services.texts import discover_text_dirs
+
+
+@dataclass(frozen=True)
+class BuildReport:
+    text_dir: Path
+    ref: str
+    ok: bool
+    duration: float
+    outputs: list[Path] = field(default_factory=list)
+    error: str | None = None
+    results: list[PipelineResult] = field(default_factory=list)
+
+    @property
+    def status(self) -> str:
+        return "ok" if self.ok else "FAILED"
+
+
+@dataclass(frozen=True)
+class _TextJob:
+    text_dir: Path
+    ref: str
+    pipelines: list[str]
+    use_cache: bool
+    persistent: bool
+    keep_scratch: bool = False
+
+
+def build_all(
+    *,
+    repo_root: Path,
+    ref: str = ".",
+    pipeline: str | None = "pdf",
+    jobs: int | None = None,
+    use_cache: bool = True,
+    persistent: bool = False,
+    keep_scratch: bool = False,
+) -> list[BuildReport]:
+    """Build every text in the repo, `jobs` texts at a time.
+
+    Each text is built in a worker process; a failing text is reported and
+    does not stop the others. Reports are returned sorted by text directory.
+    """
+
+    text_dirs = discover_text_dirs(repo_root=repo_root)
+    if not text_dirs:
+        return []
+
+    pipelines = resolve_pipeline_names(pipeline, text_dir=repo_root)
+    text_jobs = [
+        _TextJob(
+            text_dir=tdir,
+            ref=ref,
+            pipelines=pipelines,
+            use_cache=use_cache,
+            persistent=persistent,
+            keep_scratch=keep_scratch,
+        )
+        for tdir in text_dirs
+    ]
+    return _run_text_jobs(text_jobs, jobs=jobs)
+
+
+def build_refs(
+    *,
+    text_dir: Path,
+    refs: str,
+    pipeline: str | None = "pdf",
+    jobs: int | None = None,
+    use_cache: bool = True,
+    persistent: bool = False,
+    keep_scratch: bool = False,
+) -> list[BuildReport]:
+    """Build several refs of one text, `jobs` refs at a time.
+
+    `refs` is a comma-separated list of labels, stage names and globs (see
+    `resolve_ref_patterns`). All refs are resolved up front; each resulting
+    build runs in a worker process and failures are reported per ref.
+    """
+
+    tdir = text_dir.expanduser().resolve()
+    labels = resolve_ref_patterns(text_dir=tdir, patterns=refs)
+    pipelines = resolve_pipeline_names(pipeline, text_dir=tdir)
+    text_jobs = [
+        _TextJob(
+            text_dir=tdir,
+            ref=label,
+            pipelines=pipelines,
+            use_cache=use_cache,
+            persistent=persistent,
+            keep_scratch=keep_scratch,
+        )
+        for label in labels
+    ]
+    return _run_text_jobs(text_jobs, jobs=jobs)
+
+
+def _run_text_jobs(text_jobs: list[_TextJob], *, jobs: int | None) -> list[BuildReport]:
+    workers = min(len(text_jobs), jobs or os.cpu_count() or 1)
+    if workers <= 1:
+        return [_build_text(job) for job in text_jobs]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_build_text, text_jobs))
+
+
+def _build_text(job: _TextJob) -> BuildReport:
+    started = time.perf_counter()
+    try:
+        results = build_pipeline_results(
+            text_dir=job.text_dir,
+            ref=job.ref,
+            pipelines=job.pipelines,
+            use_cache=job.use_cache,
+            persistent=job.persistent,
+            jobs=1,
+            keep_scratch=job.keep_scratch,
+        )
+    except Exception as e:
+        return BuildReport(
+            text_dir=job.text_dir,
+            ref=job.ref,
+            ok=False,
+            duration=time.perf_counter() - started,
+            error=str(e).strip().splitlines()[0] if str(e).strip() else repr(e),
+        )
+
+    return BuildReport(
+        text_dir=job.text_dir,
+        ref=job.ref,
+        ok=True,
+        duration=time.perf_counter() - started,
+        outputs=[path for result in results for path in result.outputs],
+        results=results,
+    )
+
+
+def format_build_reports(reports: list[BuildReport]) -> str:
+    """Render reports as a fixed-width summary table."""
+
+    headers = ("TEXT", "REF", "STATUS", "TIME", "DETAIL")
+    rows = [
+        (
+            r.text_dir.name,
+            r.ref,
+            r.status,
+            f"{r.duration:.2f}s",
+            r.error or ", ".join(p.name for p in r.outputs),
+        )
+        for r in reports
+    ]
+    widths = [max([len(headers[i]), *(len(row[i]) for row in rows)]) for i in range(4)]
+
+    lines: list[str] = []
+    for row in [headers, *rows]:
+        cells = [row[i].ljust(widths[i]) for i in range(4)]
+        lines.append("  ".join([*cells, row[4]]).rstrip())
+
+    ok = sum(1 for r in reports if r.ok)
+    lines.append(f"{ok}/{len(reports)} builds succeeded.")
+    return "\n".join(lines)
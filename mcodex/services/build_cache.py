@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+from mcodex import trace
+from mcodex.config import repo_cache_path
+from mcodex.services.fs import file_digest
+
+# Bump when the key layout changes so stale entries are never reused.
+_CACHE_SCHEMA = 1
+
+_SOURCE_IGNORE_NAMES = frozenset({".snapshot", ".git"})
+_RUNTIME_STEP_KEYS = frozenset({"timeout"})
+
+
+def ensure_cache_dir(repo_root: Path) -> Path:
+    """Create `.mcodex/cache/` and keep it out of Git."""
+
+    root = repo_cache_path(repo_root)
+    root.mkdir(parents=True, exist_ok=True)
+    gitignore = root / ".gitignore"
+    if not gitignore.exists():
+        gitignore.write_text("*\n", encoding="utf-8")
+    return root
+
+
+def _iter_files(root: Path, ignore_names: Iterable[str]) -> Iterator[Path]:
+    ignored = set(ignore_names)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [d for d in dirnames if d not in ignored]
+        for name in filenames:
+            if name in ignored:
+                continue
+            yield Path(dirpath) / name
+
+
+def tree_digest(root: Path, *, ignore_names: Iterable[str] = ()) -> str:
+    """Digest relative paths and contents of all files below `root`."""
+
+    h = hashlib.sha256()
+    if not root.is_dir():
+        h.update(b"missing")
+        return h.hexdigest()
+
+    files = sorted(
+        (p.relative_to(root).as_posix(), p) for p in _iter_files(root, ignore_names)
+    )
+    for rel, path in files:
+        h.update(rel.encode("utf-8"))
+        h.update(b"\0")
+        h.update(file_digest(path).encode("ascii"))
+        h.update(b"\n")
+    return h.hexdigest()
+
+
+@trace.traced("source digest", "cache")
+def source_digest(source_dir: Path) -> str:
+    """Digest everything a build may read from a text directory."""
+
+    return tree_digest(source_dir, ignore_names=_SOURCE_IGNORE_NAMES)
+
+
+def context_digest(*, source_dir: Path, pipeline_name: str, version_label: str) -> str:
+    """Digest the inputs of `write_build_context`, except the build time."""
+
+    h = hashlib.sha256()
+    for name in ("metadata.yaml", "snapshot.yaml"):
+        path = source_dir / name
+        h.update(name.encode("utf-8"))
+        h.update(b"\0")
+        h.update(file_digest(path).encode("ascii") if path.is_file() else b"-")
+        h.update(b"\n")
+    h.update(f"{pipeline_name}\0{version_label}".encode())
+    return h.hexdigest()
+
+
+def _digest_payload(payload: dict[str, Any]) -> str:
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+@trace.traced("artifact key", "cache")
+def artifact_cache_key(
+    *,
+    source: str,
+    pipeline_name: str,
+    pipeline: dict[str, Any],
+    version_label: str,
+    templates_root: Path,
+    tools: dict[str, str],
+) -> str:
+    """Compute the content address of a pipeline output.
+
+    `source` is the `source_digest()` of the text directory being built and
+    `tools` the `Toolchain.fingerprints()` of the pipeline's steps.
+    """
+
+    payload: dict[str, Any] = {
+        "schema": _CACHE_SCHEMA,
+        "source": source,
+        "pipeline_name": pipeline_name,
+        "pipeline": {
+            **pipeline,
+            "steps": [_cacheable_step(s) for s in pipeline.get("steps") or []],
+        },
+        "version": version_label,
+        "templates_root": str(templates_root),
+        "templates": tree_digest(templates_root),
+        "tools": tools,
+    }
+    return _digest_payload(payload)
+
+
+def output_cache_key(key: str, name: str, *, primary: bool) -> str:
+    """Key of one published output of a pipeline with artifact key `key`.
+
+    The primary output uses `key` itself; other outputs mix in their name.
+    """
+
+    if primary:
+        return key
+    return hashlib.sha256(f"{key}\0{name}".encode()).hexdigest()
+
+
+def _cacheable_step(step: dict[str, Any]) -> dict[str, Any]:
+    # Keys that affect how a step runs but never what it produces.
+    return {k: v for k, v in step.items() if k not in _RUNTIME_STEP_KEYS}
+
+
+def step_cache_key(
+    *, step: dict[str, Any], inputs: dict[str, str], tools: dict[str, str]
+) -> str:
+    """Compute the content address of a single step's outputs.
+
+    `inputs` maps input names to digests of whatever the step reads; the step
+    definition and `tools`, the fingerprints of its executables, complete
+    the key.
+    """
+
+    payload: dict[str, Any] = {
+        "schema": _CACHE_SCHEMA,
+        "step": _cacheable_step(step),
+        "inputs": inputs,
+        "tools": tools,
+    }
+    return _digest_payload(payload)
+
+
+def cache_entry_roots(repo_root: Path) -> tuple[Path, Path, Path, Path]:
+    """Directories holding artifact, step, snapshot tree and latexmk entries."""
+
+    root = repo_cache_path(repo_root)
+    return root / "builds", root / "steps", root / "trees", root / "work"
+
+
+def tree_cache_entry(repo_root: Path, tree: str) -> Path:
+    """Where the files of Git tree `tree` are materialized."""
+
+    return repo_cache_path(repo_root) / "trees" / tree[:2] / tree
+
+
+def _artifact_entry(repo_root: Path, key: str) -> Path:
+    return repo_cache_path(repo_root) / "builds" / key[:2] / key
+
+
+def _step_entry(repo_root: Path, key: str) -> Path:
+    return repo_cache_path(repo_root) / "steps" / key[:2] / key
+
+
+def _copy_atomic(src: Path, dst: Path) -> None:
+    fd, tmp_name = tempfile.mkstemp(dir=dst.parent, prefix=".tmp-")
+    os.close(fd)
+    tmp = Path(tmp_name)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+# Lock file a build holds (flock) while it uses a persistent latexmk directory.
+WORKDIR_LOCK = ".lock"
+
+
+def latex_workdir(*, repo_root: Path, source_dir: Path, pipeline_name: str) -> Path:
+    """Return the persistent latexmk directory for a source and pipeline.
+
+    The directory is stable across builds so latexmk can reuse its `.aux`,
+    `.toc` and `.fdb_latexmk` files. Worktree and snapshot sources map to
+    different directories because `source_dir` differs.
+    """
+
+    rel = source_dir.resolve().relative_to(repo_root.resolve()).as_posix()
+    name = rel.replace("/", "__") or "_root"
+    return repo_cache_path(repo_root) / "work" / name / pipeline_name
+
+
+@trace.traced("restore step", "cache")
+def restore_step(*, repo_root: Path, key: str, outputs: list[Path]) -> bool:
+    """Copy cached step outputs into place. Returns False on a miss."""
+
+    entry = _step_entry(repo_root, key)
+    cached = [entry / out.name for out in outputs]
+    if not all(p.is_file() for p in cached):
+        return False
+    _mark_used(entry)
+
+    for src, dst in zip(cached, outputs, strict=True):
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(src, dst)
+    return True
+
+
+@trace.traced("store step", "cache")
+def store_step(*, repo_root: Path, key: str, outputs: list[Path]) -> None:
+    """Store the outputs of a step that just ran under its cache key."""
+
+    ensure_cache_dir(repo_root)
+    entry = _step_entry(repo_root, key)
+    entry.mkdir(parents=True, exist_ok=True)
+    for out in outputs:
+        _copy_atomic(out, entry / out.name)
+
+
+def cached_artifact(*, repo_root: Path, key: str) -> Path | None:
+    """Return the cache entry for an artifact key, or None on a miss."""
+
+    entry = _artifact_entry(repo_root, key)
+    if not entry.is_file():
+        return None
+    _mark_used(entry)
+    return entry
+
+
+def _mark_used(entry: Path) -> None:
+    # Entries are content-addressed, so their mtime is free to record the
+    # last hit; `mcodex artifacts gc` evicts the least recently used ones.
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+
+
+@trace.traced("store artifact", "cache")
+def store_artifact(
+    *,
+    repo_root: Path,
+    key: str,
+    artifact: Path,
+    tools: dict[str, str] | None = None,
+) -> None:
+    """Store a freshly built artifact under its cache key.
+
+    `tools` (tool name to version) is kept next to the entry as
+    `<key>.tools.json`, a record of what produced it.
+    """
+
+    ensure_cache_dir(repo_root)
+    entry = _artifact_entry(repo_root, key)
+    entry.parent.mkdir(parents=True, exist_ok=True)
+    if tools is not None:
+        record = entry.with_name(f"{entry.name}.tools.json")
+        fd, tmp_name = tempfile.mkstemp(dir=entry.parent, prefix=".tmp-")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(tools, f, indent=2, sort_keys=True)
+        os.replace(tmp_name, record)
+    _copy_atomic(artifact, entry)
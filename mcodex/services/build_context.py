@@ -121,6 +121,7 @@ def write_build_context(
     source_dir: Path,
     pipeline_name: str,
     version_label: str,
+    built_at: datetime | None = None,
 ) -> BuildContextResult:
     """Create build context artifacts in the temp build directory.
 
@@ -128,6 +129,9 @@ def write_build_context(
     - build_context.yaml: merged metadata + optional snapshot + runtime
     - build_header.md: a human-friendly header for pandoc standalone builds
     - context.tex: macros used by the latexmk template
+
+    `built_at` defaults to now; pass it to give several artifacts of one
+    build the same timestamp.
     """
 
     tmp_dir = tmp_dir.expanduser().resolve()
@@ -150,7 +154,7 @@ def write_build_context(
     context["build"] = {
         "pipeline": pipeline_name,
         "version": version_label,
-        "built_at": datetime.now().astimezone().isoformat(),
+        "built_at": (built_at or datetime.now()).astimezone().isoformat(),
     }
 
     yaml_path = tmp_dir / "build_context.yaml"
@@ -0,0 +1,324 @@
+"""Local build server: a warm process serving `mcodex build` over a Unix socket.
+
+The protocol is one JSON object per line. A client sends a single request,
+e.g. ``{"op": "build", "text_dir": "/abs/path", "ref": ".", "pipeline": "pdf"}``,
+and receives events until the last one:
+
+- ``{"event": "queued", "coalesced": false}``: the build was accepted;
+  ``coalesced`` is true when it joined an identical build already running.
+- ``{"event": "done", "outputs": [...], "unchanged": [...], "logs": [...]}``
+- ``{"event": "error", "message": "..."}``
+
+Builds run in a bounded pool of worker processes. Concurrent requests for the
+same text directory, ref, pipelines and options whose sources, templates and
+configuration have the same digest share one execution.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from mcodex.config import RepoConfigNotFoundError, find_repo_root, repo_config_path
+from mcodex.errors import McodexError
+from mcodex.services.build import (
+    build_pipeline_results,
+    resolve_build_source,
+    resolve_pipeline_names,
+)
+from mcodex.services.build_cache import source_digest, tree_digest
+from mcodex.services.fs import file_digest
+
+# A request line larger than this is rejected instead of buffered.
+_MAX_REQUEST_BYTES = 1 << 20
+
+
+@dataclass(frozen=True)
+class BuildRequest:
+    text_dir: Path
+    ref: str
+    pipelines: tuple[str, ...]
+    use_cache: bool = True
+    persistent: bool = False
+
+
+def _execute(request: BuildRequest) -> dict[str, Any]:
+    results = build_pipeline_results(
+        text_dir=request.text_dir,
+        ref=request.ref,
+        pipelines=list(request.pipelines),
+        use_cache=request.use_cache,
+        persistent=request.persistent,
+        jobs=1,
+    )
+    return {
+        "outputs": [str(p) for r in results for p in r.outputs],
+        "unchanged": [str(p) for r in results for p in r.unchanged],
+        "logs": [str(r.log_dir) for r in results if r.log_dir is not None],
+    }
+
+
+def _inputs_digest(request: BuildRequest) -> str:
+    """Digest the sources, templates and config a build of `request` reads."""
+
+    source = resolve_build_source(text_dir=request.text_dir, version=request.ref)
+    parts = [source.version_label, source_digest(source.source_dir)]
+    try:
+        repo_root = find_repo_root(request.text_dir)
+    except RepoConfigNotFoundError:
+        return "\0".join(parts)
+
+    config = repo_config_path(repo_root)
+    parts.append(file_digest(config) if config.is_file() else "-")
+    parts.append(tree_digest(repo_root / ".mcodex" / "templates"))
+    return "\0".join(parts)
+
+
+def request_key(request: BuildRequest) -> tuple[object, ...]:
+    """Identity of a build: requests with equal keys are coalesced."""
+
+    return (
+        str(request.text_dir),
+        request.ref,
+        request.pipelines,
+        request.use_cache,
+        request.persistent,
+        _inputs_digest(request),
+    )
+
+
+class BuildServer:
+    """Single-flight job queue in front of an executor."""
+
+    def __init__(
+        self,
+        *,
+        executor: Executor,
+        execute: Callable[[BuildRequest], dict[str, Any]] = _execute,
+    ) -> None:
+        self._executor = executor
+        self._execute = execute
+        self._lock = threading.Lock()
+        self._inflight: dict[tuple[object, ...], Future[dict[str, Any]]] = {}
+
+    def submit(self, request: BuildRequest) -> tuple[Future[dict[str, Any]], bool]:
+        """Queue `request`; returns its future and whether it was coalesced."""
+
+        key = request_key(request)
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future, True
+            future = self._executor.submit(self._execute, request)
+            self._inflight[key] = future
+
+        future.add_done_callback(lambda f: self._forget(key, f))
+        return future, False
+
+    def _forget(self, key: tuple[object, ...], future: Future[dict[str, Any]]) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def handle(self, payload: Any, send: Callable[[dict[str, Any]], None]) -> None:
+        """Serve one decoded request, reporting progress through `send`."""
+
+        try:
+            request = _parse_request(payload)
+            if request is None:
+                send({"event": "pong", "pid": os.getpid()})
+                return
+            future, coalesced = self.submit(request)
+        # RuntimeError: resolving the source, e.g. `git archive` of a lazy
+        # snapshot, failed while computing the request key.
+        except (McodexError, OSError, RuntimeError, ValueError) as e:
+            send({"event": "error", "message": str(e)})
+            return
+
+        send({"event": "queued", "coalesced": coalesced})
+        try:
+            result = future.result()
+        except Exception as e:
+            send({"event": "error", "message": str(e) or type(e).__name__})
+            return
+        send({"event": "done", **result})
+
+
+def _parse_request(payload: Any) -> BuildRequest | None:
+    if not isinstance(payload, dict):
+        raise ValueError("Request must be a JSON object.")
+    op = payload.get("op")
+    if op == "ping":
+        return None
+    if op != "build":
+        raise ValueError(f"Unknown op: {op!r}")
+
+    raw_dir = payload.get("text_dir")
+    if not isinstance(raw_dir, str) or not Path(raw_dir).is_absolute():
+        raise ValueError("text_dir must be an absolute path.")
+    text_dir = Path(raw_dir).resolve()
+    if not (text_dir / "metadata.yaml").is_file():
+        raise FileNotFoundError(f"No metadata.yaml found in: {text_dir}")
+
+    ref = payload.get("ref", ".")
+    pipeline = payload.get("pipeline", "pdf")
+    if not isinstance(ref, str) or not isinstance(pipeline, str):
+        raise ValueError("ref and pipeline must be strings.")
+
+    return BuildRequest(
+        text_dir=text_dir,
+        ref=ref.strip() or ".",
+        pipelines=tuple(resolve_pipeline_names(pipeline, text_dir=text_dir)),
+        use_cache=bool(payload.get("use_cache", True)),
+        persistent=bool(payload.get("persistent", False)),
+    )
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: _SocketServer
+
+    def handle(self) -> None:
+        line = self.rfile.readline(_MAX_REQUEST_BYTES)
+
+        def send(event: dict[str, Any]) -> None:
+            self.wfile.write(json.dumps(event).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+        try:
+            try:
+                payload = json.loads(line)
+            except ValueError:
+                send({"event": "error", "message": "Malformed request."})
+                return
+            self.server.build_server.handle(payload, send)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; a coalesced build still serves the others.
+            pass
+
+
+class _SocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: Path, build_server: BuildServer) -> None:
+        self.build_server = build_server
+        super().__init__(str(socket_path), _Handler)
+
+
+def _claim_socket_path(socket_path: Path) -> None:
+    """Remove a stale socket file; refuse if a server is still listening."""
+
+    if not socket_path.exists() and not socket_path.is_symlink():
+        return
+    if not socket_path.is_socket():
+        raise FileExistsError(f"Not a socket: {socket_path}")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(str(socket_path))
+        except OSError:
+            socket_path.unlink()
+            return
+    raise RuntimeError(f"A build server is already listening on: {socket_path}")
+
+
+def open_server(socket_path: Path, build_server: BuildServer) -> _SocketServer:
+    """Bind `build_server` to a Unix socket only the current user can use."""
+
+    socket_path = socket_path.expanduser().absolute()
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    _claim_socket_path(socket_path)
+    old_umask = os.umask(0o177)
+    try:
+        return _SocketServer(socket_path, build_server)
+    finally:
+        os.umask(old_umask)
+
+
+def _reset_signals() -> None:
+    # Workers are forked after `serve` installs its handler; they should
+    # just die on SIGTERM.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def serve(*, socket_path: Path, jobs: int | None = None) -> None:
+    """Serve build requests on `socket_path` until interrupted."""
+
+    socket_path = socket_path.expanduser().absolute()
+    workers = jobs or os.cpu_count() or 1
+
+    def stop(signum: int, frame: object) -> None:
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, stop)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_reset_signals) as pool:
+        server = open_server(socket_path, BuildServer(executor=pool))
+        print(
+            f"Serving builds on {socket_path} ({workers} workers)",
+            file=sys.stderr,
+            flush=True,
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            with contextlib.suppress(FileNotFoundError):
+                socket_path.unlink()
+
+
+def request_build(
+    *,
+    socket_path: Path,
+    text_dir: Path,
+    ref: str,
+    pipeline: str | None,
+    use_cache: bool = True,
+    persistent: bool = False,
+    on_event: Callable[[dict[str, Any]], None] | None = None,
+) -> dict[str, Any]:
+    """Run a build on the server at `socket_path` and return its "done" event.
+
+    Intermediate events are passed to `on_event`. Raises `RuntimeError` when
+    the server is unreachable or reports an error.
+    """
+
+    request = {
+        "op": "build",
+        "text_dir": str(text_dir.expanduser().resolve()),
+        "ref": ref,
+        "pipeline": pipeline or "pdf",
+        "use_cache": use_cache,
+        "persistent": persistent,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(socket_path.expanduser()))
+        except OSError as e:
+            raise RuntimeError(
+                f"Build server not reachable at {socket_path}: {e.strerror or e}"
+            ) from None
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+
+        with sock.makefile("rb") as stream:
+            for line in stream:
+                event = json.loads(line)
+                kind = event.get("event")
+                if kind == "done":
+                    return dict(event)
+                if kind == "error":
+                    raise RuntimeError(str(event.get("message") or "Build failed."))
+                if on_event is not None:
+                    on_event(event)
+
+    raise RuntimeError("Build server closed the connection without a result.")
@@ -0,0 +1,55 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from mcodex.config import (
+    DEFAULT_PIPELINES,
+    RepoConfigNotFoundError,
+    find_repo_root,
+    get_pipelines,
+)
+from mcodex.services.toolchain import load_toolchain, step_executables
+
+
+def doctor(*, start: Path | None = None, refresh: bool = False) -> bool:
+    """Print the executables the configured pipelines need.
+
+    Uses the toolchain manifest, re-probing every tool with `refresh=True`.
+    Returns False if any of them is missing.
+    """
+
+    repo_root: Path | None
+    try:
+        repo_root = find_repo_root(start)
+        pipelines = get_pipelines(repo_root=repo_root)
+    except RepoConfigNotFoundError:
+        repo_root = None
+        pipelines = DEFAULT_PIPELINES
+
+    users: dict[str, list[str]] = {}
+    for name, pipe in sorted(pipelines.items()):
+        for exe in step_executables(list(pipe.get("steps") or [])):
+            users.setdefault(exe, []).append(str(name))
+
+    toolchain = load_toolchain(repo_root)
+    rows = [("TOOL", "PIPELINES", "PATH", "VERSION")]
+    ok = True
+    for name in sorted(users):
+        tool = toolchain.get(name, refresh=refresh)
+        ok = ok and tool.path is not None
+        rows.append(
+            (
+                name,
+                ",".join(users[name]),
+                tool.path or "missing",
+                tool.version or "-",
+            )
+        )
+
+    widths = [max(len(row[i]) for row in rows) for i in range(len(rows[0]))]
+    for row in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths, strict=True)).rstrip())
+
+    if toolchain.manifest_path is not None:
+        print(f"\nManifest: {toolchain.manifest_path}")
+    return ok
@@ -1,11 +1,20 @@
 from __future__ import annotations
 
+import fcntl
+import hashlib
+import os
 import shutil
-from collections.abc import Iterable
+import uuid
+from collections.abc import Callable, Iterable
 from pathlib import Path
 
 TEST_ROOT_MARKER = ".mcodex-test-root"
 
+_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+# ioctl(2) request for a copy-on-write clone (linux/fs.h).
+_FICLONE = 0x40049409
+
 
 def ensure_test_root_marker(root: Path) -> Path:
     """Create a marker file that identifies a directory as a safe test root."""
@@ -82,3 +91,135 @@ def safe_rmtree(
         )
 
     shutil.rmtree(resolved, ignore_errors=ignore_errors)
+
+
+def safe_unlink(
+    path: Path,
+    *,
+    allowed_roots: Iterable[Path],
+    expected: os.stat_result | None = None,
+) -> bool:
+    """Remove a single file under one of `allowed_roots`.
+
+    With `expected`, the file is removed only if it is still the same file
+    (inode, size and mtime), so a file replaced by a concurrent writer since
+    it was inspected is kept. Returns True if a file was removed.
+    """
+
+    roots = [r.expanduser().resolve() for r in allowed_roots]
+    # Resolve the directory only: a symlink is removed, not its target.
+    parent = path.expanduser().parent.resolve()
+    target = parent / path.name
+    if target in roots or not _is_under_any_root(parent, roots):
+        raise RuntimeError(
+            "Refusing to delete path outside of allowed roots: "
+            f"{target} (allowed_roots={roots})"
+        )
+
+    try:
+        st = target.lstat()
+    except FileNotFoundError:
+        return False
+    if expected is not None and (st.st_ino, st.st_size, st.st_mtime_ns) != (
+        expected.st_ino,
+        expected.st_size,
+        expected.st_mtime_ns,
+    ):
+        return False
+    try:
+        target.unlink()
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def file_digest(path: Path) -> str:
+    """Return the hex SHA-256 digest of a file, read in chunks."""
+
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(_DIGEST_CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    with src.open("rb") as fsrc, dst.open("wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def link_or_copy(src: Path, dst: Path, *, allow_symlink: bool = True) -> str:
+    """Make `dst` show the contents of `src` as cheaply as the filesystem allows.
+
+    Tries a hardlink, a reflink (FICLONE), a symlink (unless
+    `allow_symlink=False`, e.g. when `src` is temporary) and finally a copy.
+    An existing `dst` is replaced atomically, never written through. Returns
+    the method used: "hardlink", "reflink", "symlink" or "copy".
+
+    Callers must treat `dst` as read-only: writing into it in place would
+    also change `src`.
+    """
+
+    src = src.resolve()
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex[:12]}.tmp")
+
+    attempts: list[tuple[str, Callable[[], object]]] = [
+        ("hardlink", lambda: os.link(src, tmp)),
+        ("reflink", lambda: _reflink(src, tmp)),
+    ]
+    if allow_symlink:
+        attempts.append(("symlink", lambda: os.symlink(src, tmp)))
+    attempts.append(("copy", lambda: shutil.copy2(src, tmp)))
+
+    for method, attempt in attempts:
+        try:
+            attempt()
+        except OSError:
+            tmp.unlink(missing_ok=True)
+            if method == "copy":
+                raise
+            continue
+        try:
+            os.replace(tmp, dst)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+        return method
+
+    raise AssertionError("unreachable")
+
+
+def _same_content(a: Path, b: Path) -> bool:
+    try:
+        if a.stat().st_size != b.stat().st_size:
+            return False
+    except FileNotFoundError:
+        return False
+    return file_digest(a) == file_digest(b)
+
+
+def publish_file(src: Path, dst: Path) -> bool:
+    """Atomically make `dst` a copy of `src`; returns False if it already was.
+
+    The copy is written to a temporary file next to `dst` and renamed over
+    it, so readers never see a partial file. If `dst` already has the same
+    content it is left alone, keeping its mtime.
+    """
+
+    if _same_content(src, dst):
+        return False
+
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{uuid.uuid4().hex[:12]}.tmp")
+    # os.open honours the umask, unlike mkstemp's fixed 0600.
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+    try:
+        with os.fdopen(fd, "wb") as fout, src.open("rb") as fin:
+            shutil.copyfileobj(fin, fout, _DIGEST_CHUNK_SIZE)
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return True
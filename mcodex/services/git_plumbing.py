@@ -0,0 +1,576 @@
+"""Commit new directories with git plumbing, without `git add`/`git commit`.
+
+`commit_new_trees` writes the blobs of one or more new directories
+(`hash-object --stdin-paths`), builds their trees and the changed ancestor
+trees (`mktree --batch`) on top of HEAD, creates the commit
+(`commit-tree`), adds only the new paths to the index (`update-index
+--index-info`) and finally moves HEAD and creates the tags in one atomic
+`update-ref --stdin` transaction. Neither the working tree nor the rest of
+the index is scanned, so the cost does not grow with the size of the repo.
+
+`tag_trees` instead commits directories as root trees of their own,
+reachable from a tag only; that is how lazy snapshots are stored.
+
+Like `git add`, files ignored by `.gitignore` are left out
+(`untracked_files`). Unlike `git commit`, no hooks run and nothing else that
+happens to be staged is committed.
+"""
+
+from __future__ import annotations
+
+import os
+import stat
+import subprocess
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from pathlib import Path, PurePosixPath
+
+from mcodex import trace
+
+_TREE_MODE = "040000"
+
+
+@dataclass(frozen=True)
+class NewTree:
+    """A directory to commit: `path` in the repo and the files under it.
+
+    `files` maps paths relative to `path` (POSIX) to the files on disk whose
+    content is committed there. `blobs` may give the blob id of some of them
+    when it is already known, so they are not read and hashed again.
+    """
+
+    path: str
+    files: dict[str, Path]
+    blobs: dict[str, str] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class PlumbingCommit:
+    commit: str
+    # Tree id of every `NewTree.path`.
+    trees: dict[str, str]
+
+
+@dataclass(frozen=True)
+class TaggedCommit:
+    tag: str
+    commit: str
+    tree: str
+    created_at: str
+    # Value of the requested trailer of the commit message ("" if absent).
+    trailer: str
+
+
+@dataclass(frozen=True)
+class _Entry:
+    mode: str
+    kind: str
+    oid: str
+
+
+def _git(
+    args: list[str], *, cwd: Path, stdin: str | None = None
+) -> subprocess.CompletedProcess[str]:
+    with trace.span(f"git {args[0]}", "git", argv=" ".join(args)):
+        completed = subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            input=stdin,
+            text=True,
+            capture_output=True,
+            check=False,
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"git {args[0]} failed:\nout: {completed.stdout}\nerr: {completed.stderr}\n"
+        )
+    return completed
+
+
+def untracked_files(*, repo_root: Path, paths: Iterable[str]) -> list[str]:
+    """Untracked, not ignored files under `paths`: what `git add` would add."""
+
+    pathspecs = list(paths)
+    if not pathspecs:
+        return []
+    out = _git(
+        ["ls-files", "-z", "--others", "--exclude-standard", "--", *pathspecs],
+        cwd=repo_root,
+    ).stdout
+    return [p for p in out.split("\0") if p]
+
+
+def worktree_files(*, repo_root: Path, paths: Iterable[str]) -> list[str]:
+    """Tracked and untracked, not ignored files under `paths` that exist."""
+
+    pathspecs = list(paths)
+    if not pathspecs:
+        return []
+    out = _git(
+        [
+            "ls-files",
+            "-z",
+            "--cached",
+            "--others",
+            "--exclude-standard",
+            "--",
+            *pathspecs,
+        ],
+        cwd=repo_root,
+    ).stdout
+    files = dict.fromkeys(p for p in out.split("\0") if p)
+    return [p for p in files if (repo_root / p).is_file()]
+
+
+def tagged_commits(*, cwd: Path, prefix: str, trailer: str) -> list[TaggedCommit]:
+    """Commits tagged `<prefix>*`, with the value of one message trailer."""
+
+    fmt = "%00".join(
+        [
+            "%(refname:strip=2)",
+            "%(objectname)",
+            "%(tree)",
+            "%(creatordate:iso-strict)",
+            f"%(contents:trailers:key={trailer},valueonly)",
+        ]
+    )
+    out = _git(
+        ["for-each-ref", f"--format={fmt}%00", f"refs/tags/{prefix}"], cwd=cwd
+    ).stdout
+    commits: list[TaggedCommit] = []
+    for record in out.split("\0\n"):
+        fields = record.split("\0")
+        if len(fields) != 5 or not fields[2]:
+            continue
+        tag, commit, tree, created_at, value = fields
+        commits.append(
+            TaggedCommit(
+                tag=tag,
+                commit=commit,
+                tree=tree,
+                created_at=created_at,
+                trailer=value.strip(),
+            )
+        )
+    return commits
+
+
+def _git_common_dir(start: Path) -> Path | None:
+    """The `.git` directory holding the refs of the repository at `start`."""
+
+    for d in (start, *start.parents):
+        dot_git = d / ".git"
+        if dot_git.is_dir():
+            return dot_git
+        if not dot_git.is_file():
+            continue
+        # A linked worktree or submodule: "gitdir: <path>".
+        try:
+            raw = dot_git.read_text(encoding="utf-8").strip()
+        except OSError:
+            return None
+        if not raw.startswith("gitdir:"):
+            return None
+        git_dir = d / raw.removeprefix("gitdir:").strip()
+        try:
+            common = (git_dir / "commondir").read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return git_dir
+        except OSError:
+            return None
+        return git_dir / common
+    return None
+
+
+def _file_stamp(path: Path) -> tuple[int, int] | None:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+@dataclass(frozen=True)
+class TagState:
+    """Where the tags under a prefix are stored, read without running git."""
+
+    # Changes whenever such a tag may have been created, fetched or deleted.
+    stamp: tuple[object, ...]
+    # False when there certainly is no such tag.
+    may_exist: bool
+
+
+def tag_state(*, cwd: Path, prefix: str) -> TagState | None:
+    """Stat the ref storage for tags `<prefix>*`; None outside a repository.
+
+    Covers loose refs (`refs/tags/<prefix>`), `packed-refs` and reftable.
+    """
+
+    git_dir = _git_common_dir(cwd)
+    if git_dir is None:
+        return None
+    loose = git_dir / "refs" / "tags" / prefix.rstrip("/")
+    packed = git_dir / "packed-refs"
+    reftable = git_dir / "reftable" / "tables.list"
+    stamp = (_file_stamp(loose), _file_stamp(packed), _file_stamp(reftable))
+    may_exist = loose.is_dir() or stamp[2] is not None
+    if not may_exist and stamp[1] is not None:
+        try:
+            may_exist = f" refs/tags/{prefix}".encode() in packed.read_bytes()
+        except OSError:
+            may_exist = True
+    return TagState(stamp=stamp, may_exist=may_exist)
+
+
+def group_by_dir(
+    paths: Iterable[str], dirs: Iterable[str]
+) -> dict[str, dict[str, str]]:
+    """Sort repo paths into `dirs`: dir -> {path relative to dir: path}.
+
+    Paths outside every dir are dropped; `dirs` must not be nested.
+    """
+
+    out: dict[str, dict[str, str]] = {d.rstrip("/"): {} for d in dirs}
+    for path in paths:
+        for parent in PurePosixPath(path).parents:
+            group = out.get(parent.as_posix())
+            if group is not None:
+                group[PurePosixPath(path).relative_to(parent).as_posix()] = path
+                break
+    return out
+
+
+def staged_blobs(*, repo_root: Path, paths: Iterable[str]) -> dict[str, dict[str, str]]:
+    """Blob ids of the index entries under each of `paths`, keyed relative to it."""
+
+    pathspecs = list(paths)
+    if not pathspecs:
+        return {}
+    staged = _git(["ls-files", "-s", "-z", "--", *pathspecs], cwd=repo_root).stdout
+    oids: dict[str, str] = {}
+    for record in staged.split("\0"):
+        if not record:
+            continue
+        info, repo_path = record.split("\t", 1)
+        _, oid, stage = info.split()
+        if stage == "0":
+            oids[repo_path] = oid
+    return {
+        path: {rel: oids[repo_path] for rel, repo_path in group.items()}
+        for path, group in group_by_dir(oids, pathspecs).items()
+    }
+
+
+def _hash_blobs(repo_root: Path, files: list[Path]) -> list[str]:
+    if not files:
+        return []
+    for f in files:
+        if "\n" in str(f):
+            raise ValueError(f"Cannot commit a file with a newline in its name: {f}")
+    out = _git(
+        ["hash-object", "-w", "--stdin-paths"],
+        cwd=repo_root,
+        stdin="".join(f"{f}\n" for f in files),
+    ).stdout
+    oids = out.split()
+    if len(oids) != len(files):
+        raise RuntimeError("git hash-object returned an unexpected number of ids.")
+    return oids
+
+
+def _parse_tree(data: bytes, oid_len: int) -> dict[str, _Entry]:
+    entries: dict[str, _Entry] = {}
+    pos = 0
+    while pos < len(data):
+        space = data.index(b" ", pos)
+        nul = data.index(b"\0", space)
+        mode = data[pos:space].decode("ascii").rjust(6, "0")
+        name = data[space + 1 : nul].decode("utf-8", errors="surrogateescape")
+        oid = data[nul + 1 : nul + 1 + oid_len].hex()
+        kind = (
+            "tree" if mode == _TREE_MODE else "commit" if mode == "160000" else "blob"
+        )
+        entries[name] = _Entry(mode=mode, kind=kind, oid=oid)
+        pos = nul + 1 + oid_len
+    return entries
+
+
+def _read_head_trees(
+    repo_root: Path, dirs: list[str]
+) -> tuple[str | None, dict[str, dict[str, _Entry]]]:
+    """Return the HEAD commit and the entries of its trees at `dirs`.
+
+    Directories missing from HEAD (or an unborn HEAD) come back empty.
+    """
+
+    queries = ["HEAD", *(f"HEAD:{d}" if d else "HEAD^{tree}" for d in dirs)]
+    with trace.span("git cat-file", "git", argv="cat-file --batch"):
+        completed = subprocess.run(
+            ["git", "cat-file", "--batch"],
+            cwd=repo_root,
+            input="".join(f"{q}\n" for q in queries).encode("utf-8"),
+            capture_output=True,
+            check=False,
+        )
+    if completed.returncode != 0:
+        raise RuntimeError(
+            f"git cat-file failed:\nerr: {completed.stderr.decode(errors='replace')}"
+        )
+
+    out = completed.stdout
+    pos = 0
+    head: str | None = None
+    trees: dict[str, dict[str, _Entry]] = {}
+    for i, query in enumerate(queries):
+        eol = out.index(b"\n", pos)
+        header = out[pos:eol].decode("utf-8", errors="replace").split()
+        pos = eol + 1
+        if header[-1] == "missing":
+            if i > 0:
+                trees[dirs[i - 1]] = {}
+            continue
+        oid, kind, size = header[0], header[1], int(header[2])
+        body = out[pos : pos + size]
+        pos += size + 1
+        if i == 0:
+            head = oid
+        elif kind == "tree":
+            trees[dirs[i - 1]] = _parse_tree(body, len(oid) // 2)
+        else:
+            raise RuntimeError(f"Not a directory in HEAD: {query.split(':', 1)[1]}")
+    return head, trees
+
+
+class _TreeWriter:
+    """Feeds trees to one `git mktree --batch` and reads back their ids."""
+
+    def __init__(self, repo_root: Path) -> None:
+        self._proc = subprocess.Popen(
+            ["git", "mktree", "--batch"],
+            cwd=repo_root,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+    def write(self, entries: dict[str, _Entry]) -> str:
+        assert self._proc.stdin is not None and self._proc.stdout is not None
+        for name, e in entries.items():
+            if "\n" in name or "\t" in name:
+                raise ValueError(
+                    f"Cannot commit a path containing a tab or newline: {name}"
+                )
+            self._proc.stdin.write(f"{e.mode} {e.kind} {e.oid}\t{name}\n")
+        self._proc.stdin.write("\n")
+        self._proc.stdin.flush()
+        oid = self._proc.stdout.readline().strip()
+        if not oid:
+            raise RuntimeError("git mktree failed.")
+        return oid
+
+    def close(self) -> None:
+        _, err = self._proc.communicate()
+        if self._proc.returncode != 0:
+            raise RuntimeError(f"git mktree failed:\nerr: {err}")
+
+    def __enter__(self) -> _TreeWriter:
+        return self
+
+    def __exit__(self, exc_type: object, exc: object, tb: object) -> None:
+        if self._proc.returncode is None:
+            self._proc.kill()
+            self._proc.communicate()
+
+
+def _depth(path: str) -> int:
+    return len(PurePosixPath(path).parts)
+
+
+def _parent(path: str) -> str:
+    parent = PurePosixPath(path).parent.as_posix()
+    return "" if parent == "." else parent
+
+
+def _file_mode(path: Path) -> str:
+    return "100755" if os.stat(path).st_mode & stat.S_IXUSR else "100644"
+
+
+def _blob_entries(
+    repo_root: Path, trees: list[NewTree], prefixes: list[str]
+) -> list[dict[str, _Entry]]:
+    """Blob entries of every tree, keyed by `<prefix>/<file>`.
+
+    Files without a known blob id are hashed in one process.
+    """
+
+    flat = [
+        [
+            (f"{prefix}/{rel}".lstrip("/"), src, _file_mode(src), tree.blobs.get(rel))
+            for rel, src in sorted(tree.files.items())
+        ]
+        for prefix, tree in zip(prefixes, trees, strict=True)
+    ]
+    hashed = iter(
+        _hash_blobs(repo_root, [src for f in flat for _, src, _, oid in f if not oid])
+    )
+    return [
+        {
+            path: _Entry(mode=mode, kind="blob", oid=oid or next(hashed))
+            for path, _, mode, oid in files
+        }
+        for files in flat
+    ]
+
+
+def _add_blobs(dirs: dict[str, dict[str, _Entry]], blobs: dict[str, _Entry]) -> None:
+    for path, entry in blobs.items():
+        parent = _parent(path)
+        while parent not in dirs:
+            dirs[parent] = {}
+            parent = _parent(parent)
+        dirs[_parent(path)][PurePosixPath(path).name] = entry
+
+
+def _write_trees(
+    writer: _TreeWriter, dirs: dict[str, dict[str, _Entry]]
+) -> dict[str, str]:
+    """Write `dirs`, deepest first, each into its parent; returns their ids."""
+
+    tree_ids: dict[str, str] = {}
+    for d in sorted(dirs, key=_depth, reverse=True):
+        tree_ids[d] = writer.write(dirs[d])
+        if d:
+            name = PurePosixPath(d).name
+            dirs[_parent(d)][name] = _Entry(_TREE_MODE, "tree", tree_ids[d])
+    return tree_ids
+
+
+def commit_new_trees(
+    *,
+    repo_root: Path,
+    trees: list[NewTree],
+    message: str,
+    tags: Iterable[str] = (),
+) -> PlumbingCommit:
+    """Commit `trees` on top of HEAD, stage their files and create `tags`.
+
+    HEAD and the tags move together or not at all; if HEAD moved meanwhile
+    or a tag already exists, nothing changes (except for unreachable
+    objects) and RuntimeError is raised.
+    """
+
+    tree_paths = [PurePosixPath(t.path).as_posix().strip("/") for t in trees]
+    if len(set(tree_paths)) != len(tree_paths) or "" in tree_paths:
+        raise ValueError("New tree paths must be distinct repo subdirectories.")
+
+    # 1. Blobs of every file not known yet, in one process.
+    blobs = {
+        path: entry
+        for tree_blobs in _blob_entries(repo_root, trees, tree_paths)
+        for path, entry in tree_blobs.items()
+    }
+
+    # 2. The HEAD trees on the way from the root to each new directory.
+    ancestors: set[str] = set()
+    for path in tree_paths:
+        parent = _parent(path)
+        while True:
+            ancestors.add(parent)
+            if not parent:
+                break
+            parent = _parent(parent)
+    head, head_trees = _read_head_trees(repo_root, sorted(ancestors))
+
+    # 3. Trees, deepest first, each new or changed directory written once.
+    dirs: dict[str, dict[str, _Entry]] = {d: dict(head_trees[d]) for d in ancestors}
+    for path in tree_paths:
+        dirs[path] = {}
+    _add_blobs(dirs, blobs)
+    with (
+        trace.span("git mktree", "git", argv="mktree --batch"),
+        _TreeWriter(repo_root) as writer,
+    ):
+        tree_ids = _write_trees(writer, dirs)
+        writer.close()
+
+    # 4. The commit, then the index entries and finally the refs.
+    commit_args = ["commit-tree", tree_ids[""], "-F", "-"]
+    if head is not None:
+        commit_args[2:2] = ["-p", head]
+    commit = _git(commit_args, cwd=repo_root, stdin=message + "\n").stdout.strip()
+
+    index_info = "".join(f"{e.mode} {e.oid}\t{p}\n" for p, e in blobs.items())
+    _git(["update-index", "--add", "--index-info"], cwd=repo_root, stdin=index_info)
+
+    subject = (message.splitlines() or [""])[0]
+    ref_updates = [f"update HEAD {commit} {head}" if head else f"create HEAD {commit}"]
+    ref_updates += [f"create refs/tags/{tag} {commit}" for tag in tags]
+    try:
+        _git(
+            ["update-ref", "-m", f"commit: {subject}", "--stdin"],
+            cwd=repo_root,
+            stdin="".join(f"{u}\n" for u in ref_updates),
+        )
+    except RuntimeError:
+        _git(
+            ["update-index", "--force-remove", "-z", "--stdin"],
+            cwd=repo_root,
+            stdin="".join(f"{p}\0" for p in blobs),
+        )
+        raise
+
+    return PlumbingCommit(
+        commit=commit,
+        trees={path: tree_ids[path] for path in tree_paths},
+    )
+
+
+def tag_trees(
+    *,
+    repo_root: Path,
+    trees: list[NewTree],
+    messages: list[str],
+    tags: list[str],
+) -> list[PlumbingCommit]:
+    """Commit each of `trees` as a root tree of its own and tag it.
+
+    The commits have no parent, so `git show <tag>` shows just the snapshot,
+    and are reachable from their tag only: HEAD, the index and the working
+    tree are not touched. All tags are
+    created in one transaction; if one already exists, none is and
+    RuntimeError is raised.
+    """
+
+    if not len(trees) == len(messages) == len(tags):
+        raise ValueError("Every tree needs one message and one tag.")
+
+    tree_blobs = _blob_entries(repo_root, trees, [""] * len(trees))
+
+    roots: list[str] = []
+    with (
+        trace.span("git mktree", "git", argv="mktree --batch"),
+        _TreeWriter(repo_root) as writer,
+    ):
+        for blobs in tree_blobs:
+            dirs: dict[str, dict[str, _Entry]] = {"": {}}
+            _add_blobs(dirs, blobs)
+            roots.append(_write_trees(writer, dirs)[""])
+        writer.close()
+
+    commits: list[PlumbingCommit] = []
+    for tree, root, message in zip(trees, roots, messages, strict=True):
+        commit = _git(
+            ["commit-tree", root, "-F", "-"], cwd=repo_root, stdin=message + "\n"
+        ).stdout.strip()
+        commits.append(PlumbingCommit(commit=commit, trees={tree.path: root}))
+
+    _git(
+        ["update-ref", "--stdin"],
+        cwd=repo_root,
+        stdin="".join(
+            f"create refs/tags/{tag} {c.commit}\n"
+            for tag, c in zip(tags, commits, strict=True)
+        ),
+    )
+    return commits
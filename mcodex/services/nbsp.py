@@ -0,0 +1,216 @@
+"""In-process replacement for `vlna`: tie Czech one-letter words with `~`.
+
+Czech typography does not allow a one-letter preposition or conjunction
+("v Praze", "k mostu") at the end of a line; in LaTeX the following space is
+replaced by a tie. This module inserts the ties the way `vlna` does, while
+leaving math, verbatim-like environments,
+`\\verb` and comments untouched. Input is processed line by line, holding at
+most one pending line, so memory use does not grow with the document.
+"""
+
+from __future__ import annotations
+
+import re
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+DEFAULT_LETTERS = "KkSsVvZzOoUuAI"
+
+# Bump whenever the output for a given input may change; part of the step
+# cache key since there is no executable to fingerprint.
+TIE_RULES_VERSION = 1
+
+_PROTECTED_ENVS = frozenset(
+    {
+        # verbatim-like
+        "verbatim",
+        "verbatim*",
+        "Verbatim",
+        "lstlisting",
+        "minted",
+        "comment",
+        "Highlighting",
+        # math
+        "math",
+        "displaymath",
+        "equation",
+        "equation*",
+        "align",
+        "align*",
+        "alignat",
+        "alignat*",
+        "flalign",
+        "flalign*",
+        "gather",
+        "gather*",
+        "multline",
+        "multline*",
+        "eqnarray",
+        "eqnarray*",
+    }
+)
+
+_SPECIAL_RE = re.compile(
+    r"\\\\|\\%|\\\$"  # escaped backslash / percent / dollar: plain text
+    r"|(?P<comment>%)"
+    r"|(?P<display>\$\$)"
+    r"|(?P<inline>\$)"
+    r"|(?P<paren>\\\()"
+    r"|(?P<bracket>\\\[)"
+    r"|\\begin\{(?P<env>[A-Za-z]+\*?)\}"
+    r"|\\verb\*?(?P<delim>[^A-Za-z\s*])"
+)
+
+_MATH_END = {"display": "$$", "inline": "$", "paren": "\\)", "bracket": "\\]"}
+
+# Placeholder for protected characters: not whitespace, not a letter.
+_MASK = "\x01"
+
+
+def _tie_re(letters: str) -> re.Pattern[str]:
+    return re.compile(
+        r"(?<![^\s(\[{~])"  # start of line, whitespace or an opening bracket
+        rf"[{re.escape(letters)}]"
+        r"(?P<space>[ \t]+)"
+        r"(?=\S)"
+    )
+
+
+def _pending_re(letters: str) -> re.Pattern[str]:
+    return re.compile(rf"(?<![^\s(\[{{~])[{re.escape(letters)}][ \t]*$")
+
+
+class _Tier:
+    """Stateful per-line processor; state carries across lines."""
+
+    def __init__(self, letters: str) -> None:
+        self._tie = _tie_re(letters)
+        self._pending = _pending_re(letters)
+        # Terminator of the protected region we are in, or None.
+        self._until: str | None = None
+
+    def _mask(self, line: str) -> str:
+        """Return `line` with every protected character replaced by _MASK."""
+
+        out: list[str] = []
+        pos = 0
+        n = len(line)
+        verb = False
+
+        while pos < n:
+            if self._until is not None:
+                end = line.find(self._until, pos)
+                if end < 0:
+                    out.append(_MASK * (n - pos))
+                    break
+                stop = end + len(self._until)
+                out.append(_MASK * (stop - pos))
+                pos = stop
+                self._until = None
+                verb = False
+                continue
+
+            m = _SPECIAL_RE.search(line, pos)
+            if m is None:
+                out.append(line[pos:])
+                break
+
+            out.append(line[pos : m.start()])
+            kind = m.lastgroup
+            if kind is None:
+                out.append(m.group(0))
+                pos = m.end()
+                continue
+
+            if kind == "comment":
+                out.append(_MASK * (n - m.start()))
+                break
+
+            if kind == "env":
+                env = m.group("env")
+                if env not in _PROTECTED_ENVS:
+                    out.append(m.group(0))
+                    pos = m.end()
+                    continue
+                self._until = f"\\end{{{env}}}"
+            elif kind == "delim":
+                self._until = m.group("delim")
+                verb = True
+            else:
+                self._until = _MATH_END[kind]
+
+            out.append(_MASK * (m.end() - m.start()))
+            pos = m.end()
+
+        if verb:
+            # An unterminated \verb never spans lines.
+            self._until = None
+        return "".join(out)
+
+    def tie(self, line: str) -> tuple[str, bool]:
+        """Tie one line (without EOL). Returns (result, ends_with_letter)."""
+
+        masked = self._mask(line)
+        parts: list[str] = []
+        last = 0
+        for m in self._tie.finditer(masked):
+            start, end = m.span("space")
+            parts.append(line[last:start])
+            parts.append("~")
+            last = end
+        parts.append(line[last:])
+
+        # A trailing one-letter word is never followed by text on this line,
+        # so the substitution above cannot have touched it.
+        pending = self._until is None and bool(self._pending.search(masked))
+        return "".join(parts), pending
+
+
+def tie_lines(lines: Iterable[str], *, letters: str = DEFAULT_LETTERS) -> Iterator[str]:
+    """Yield `lines` with ties after one-letter words.
+
+    A one-letter word at the end of a line is joined with the first word of
+    the next non-blank line, as `vlna` does.
+    """
+
+    tier = _Tier(letters)
+    carry: str | None = None
+
+    for raw in lines:
+        body = raw.rstrip("\r\n")
+        eol = raw[len(body) :]
+
+        if carry is not None:
+            stripped = body.lstrip(" \t")
+            if not stripped or stripped.startswith("%"):
+                yield carry
+                carry = None
+            else:
+                body = stripped
+                prefix = carry.rstrip("\r\n").rstrip(" \t") + "~"
+                carry = None
+                tied, pending = tier.tie(body)
+                if pending:
+                    carry = prefix + tied.rstrip(" \t") + eol
+                    continue
+                yield prefix + tied + eol
+                continue
+
+        tied, pending = tier.tie(body)
+        if pending and eol:
+            carry = tied + eol
+            continue
+        yield tied + eol
+
+    if carry is not None:
+        yield carry
+
+
+def tie_file(src: Path, dst: Path, *, letters: str = DEFAULT_LETTERS) -> None:
+    """Stream `src` into `dst`, inserting ties after one-letter words."""
+
+    with (
+        src.open(encoding="utf-8", newline="") as fin,
+        dst.open("w", encoding="utf-8", newline="") as fout,
+    ):
+        fout.writelines(tie_lines(fin, letters=letters))
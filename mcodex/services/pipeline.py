@@ -1,74 +1,165 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
+import fcntl
 import importlib.resources
+import os
+import resource
 import shutil
-import subprocess
+import sys
 import tempfile
-from collections.abc import Callable
-from contextlib import ExitStack
-from dataclasses import dataclass
+import threading
+import time
+from collections.abc import Callable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import ExitStack, contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
 from pathlib import Path
+from typing import Any, Protocol
 
+from mcodex import trace
 from mcodex.config import (
     DEFAULT_PIPELINES,
+    SOURCE_INPUT,
     RepoConfigNotFoundError,
+    StepIO,
     find_repo_root,
     get_pipeline,
+    pipeline_step_io,
+    resolve_scratch_dir,
     validate_pipelines,
 )
+from mcodex.services.build_cache import (
+    WORKDIR_LOCK,
+    artifact_cache_key,
+    cached_artifact,
+    context_digest,
+    ensure_cache_dir,
+    latex_workdir,
+    output_cache_key,
+    restore_step,
+    source_digest,
+    step_cache_key,
+    store_artifact,
+    store_step,
+    tree_digest,
+)
 from mcodex.services.build_context import write_build_context
+from mcodex.services.fs import file_digest, link_or_copy, publish_file
+from mcodex.services.nbsp import DEFAULT_LETTERS, TIE_RULES_VERSION, tie_file
+from mcodex.services.process import AsyncRunner, run_command
+from mcodex.services.toolchain import Toolchain, load_toolchain
+
+
+@dataclass(frozen=True)
+class StepResult:
+    """How one step went.
+
+    `cpu` is user+system time of child processes reaped during the step and
+    `max_rss_kb` the child high-water mark (`ru_maxrss`) at its end, both
+    from `getrusage(RUSAGE_CHILDREN)`. When steps overlap, a child's CPU
+    time is counted towards every step running when it was reaped.
+    """
+
+    index: int
+    kind: str
+    cached: bool = False
+    wall: float = 0.0
+    cpu: float = 0.0
+    max_rss_kb: int = 0
 
 
 @dataclass(frozen=True)
 class PipelineResult:
+    """Outcome of `run_pipeline`.
+
+    `commands` lists only the commands that were (or, in a dry run, would be)
+    executed; steps served from the cache contribute no command.
+    """
+
     output_path: Path
     commands: list[list[str]]
+    outputs: list[Path] = field(default_factory=list)
+    # Outputs whose published file already had identical content.
+    unchanged: list[Path] = field(default_factory=list)
+    cached: bool = False
+    steps: list[StepResult] = field(default_factory=list)
+    pipeline: str = ""
+    wall: float = 0.0
+    # Version of each executable the pipeline runs, "missing" if not found.
+    tools: dict[str, str] = field(default_factory=dict)
+    log_dir: Path | None = None
+    # `source_digest()` of the sources; "" in a dry run.
+    source_digest: str = ""
+    # Scratch directory left in place by `keep_scratch=True`.
+    scratch_dir: Path | None = None
+
+    @property
+    def cached_steps(self) -> list[StepResult]:
+        return [s for s in self.steps if s.cached]
+
+
+class RunFn(Protocol):
+    """Runs `cmd` in `cwd` and raises on failure.
+
+    `timeout` (seconds) is passed only for steps that configure one, and
+    `log`, the file to stream output to, only when `run_pipeline` was given
+    a `log_dir`; runners without these features keep working otherwise.
+    """
 
+    def __call__(
+        self,
+        cmd: list[str],
+        cwd: Path,
+        /,
+        *,
+        timeout: float | None = ...,
+        log: Path | None = ...,
+    ) -> None: ...
 
-RunFn = Callable[[list[str], Path], None]
 
+def _rss_kb(maxrss: int) -> int:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS.
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
 
-def _require_executable(name: str) -> str:
-    path = shutil.which(name)
-    if path is None:
-        raise RuntimeError(
-            f"Required executable not found: {name}. "
-            "Install it and ensure it is on PATH."
-        )
-    return path
 
+@trace.traced("stage templates", "fs")
+def _stage_dir_contents(src_dir: Path, dst_dir: Path) -> None:
+    """Expose every file of `src_dir` below `dst_dir` without copying bytes.
 
-def _default_run(cmd: list[str], cwd: Path) -> None:
-    completed = subprocess.run(
-        cmd,
-        cwd=str(cwd),
-        text=True,
-        capture_output=True,
-        check=False,
-    )
-    if completed.returncode == 0:
-        return
+    Files are hardlinked, reflinked or symlinked where the filesystem allows
+    (see `link_or_copy`); only as a last resort are they copied.
+    """
+
+    if not src_dir.exists() or not src_dir.is_dir():
+        raise FileNotFoundError(f"Template directory not found: {src_dir}")
+
+    for item in src_dir.rglob("*"):
+        rel = item.relative_to(src_dir)
+        target = dst_dir / rel
+
+        if item.is_dir():
+            target.mkdir(parents=True, exist_ok=True)
+            continue
 
-    stdout = (completed.stdout or "").strip()
-    stderr = (completed.stderr or "").strip()
+        link_or_copy(item, target)
 
-    parts: list[str] = [f"Command failed: {' '.join(cmd)}"]
-    if stdout:
-        parts.append("--- stdout ---")
-        parts.append(stdout)
-    if stderr:
-        parts.append("--- stderr ---")
-        parts.append(stderr)
-    if not stdout and not stderr:
-        parts.append("(no output)")
 
-    raise RuntimeError("\n".join(parts))
+@trace.traced("sync templates", "fs")
+def _sync_dir_contents(src_dir: Path, dst_dir: Path) -> bool:
+    """Like `_stage_dir_contents`, but leave files that are already current.
 
+    A target is current if it is the template itself (hardlink or symlink) or
+    a copy with the same size and mtime, so unchanged templates keep looking
+    unchanged to latexmk. Returns whether any file was replaced.
+    """
 
-def _copy_dir_contents(src_dir: Path, dst_dir: Path) -> None:
     if not src_dir.exists() or not src_dir.is_dir():
         raise FileNotFoundError(f"Template directory not found: {src_dir}")
 
+    changed = False
     for item in src_dir.rglob("*"):
         rel = item.relative_to(src_dir)
         target = dst_dir / rel
@@ -77,8 +168,100 @@ def _copy_dir_contents(src_dir: Path, dst_dir: Path) -> None:
             target.mkdir(parents=True, exist_ok=True)
             continue
 
-        target.parent.mkdir(parents=True, exist_ok=True)
-        shutil.copyfile(item, target)
+        if target.exists():
+            src_st = item.stat()
+            dst_st = target.stat()
+            if (src_st.st_dev, src_st.st_ino) == (dst_st.st_dev, dst_st.st_ino):
+                continue
+            if (
+                src_st.st_size == dst_st.st_size
+                and src_st.st_mtime_ns == dst_st.st_mtime_ns
+            ):
+                continue
+
+        link_or_copy(item, target)
+        changed = True
+    return changed
+
+
+def _link_if_changed(src: Path, dst: Path) -> bool:
+    """Hand `src` over to `dst` by link, keeping `dst` if it already matches.
+
+    `src` lives in the temporary build directory, so `dst` never becomes a
+    symlink to it. Returns whether `dst` was replaced.
+    """
+
+    if dst.exists() and not dst.is_symlink():
+        if dst.samefile(src):
+            return False
+        same_size = dst.stat().st_size == src.stat().st_size
+        if same_size and file_digest(dst) == file_digest(src):
+            return False
+    link_or_copy(src, dst, allow_symlink=False)
+    return True
+
+
+# Digest (`context_digest`) of the context.tex in a persistent workdir.
+_CONTEXT_STAMP = ".context-digest"
+
+
+def _link_context(state: _PipelineRun, workdir: Path, *, changed: bool) -> None:
+    """Hand context.tex over to a persistent workdir unless it is current.
+
+    context.tex holds the build time, so it differs on every build. It is
+    replaced only when its context digest (everything but the build time)
+    changed or another LaTeX input did, so latexmk, which compares file
+    contents, finds nothing to do for an unchanged text.
+    """
+
+    stamp = workdir / _CONTEXT_STAMP
+    try:
+        current = stamp.read_text(encoding="utf-8") == state.context
+    except OSError:
+        current = False
+    if current and not changed and (workdir / "context.tex").is_file():
+        return
+    link_or_copy(
+        state.tmp / "context.tex", workdir / "context.tex", allow_symlink=False
+    )
+    stamp.write_text(state.context, encoding="utf-8")
+
+
+@contextmanager
+def _scratch_dir(parent: Path | None, *, keep: bool) -> Iterator[Path]:
+    path = Path(tempfile.mkdtemp(prefix="mcodex-build-", dir=parent))
+    try:
+        yield path
+    except Exception as e:
+        if keep:
+            e.add_note(f"Kept scratch directory: {path}")
+        raise
+    finally:
+        if not keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _locked_dir(path: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a directory shared between builds."""
+
+    while True:
+        path.mkdir(parents=True, exist_ok=True)
+        lock = path / WORKDIR_LOCK
+        with lock.open("w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # `artifacts gc` may have removed the directory while we waited.
+            try:
+                current = os.path.samestat(lock.stat(), os.fstat(f.fileno()))
+            except FileNotFoundError:
+                current = False
+            if not current:
+                continue
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            return
 
 
 def _repo_templates_root(source_dir: Path) -> Path | None:
@@ -129,6 +312,338 @@ def _latex_templates_dir(templates_root: Path) -> Path:
     return templates_root / "latex"
 
 
+@dataclass
+class _PipelineRun:
+    """State shared by the steps of a single pipeline execution."""
+
+    tmp: Path
+    source_dir: Path
+    templates_root: Path
+    runner: RunFn
+    toolchain: Toolchain
+    dry_run: bool
+    # Repo root when step caching is enabled, None otherwise.
+    cache_root: Path | None
+    # Persistent latexmk directory; None builds LaTeX in `tmp`.
+    workdir: Path | None = None
+    # Where each external step's output goes, as `<index>-<kind>.log`.
+    log_dir: Path | None = None
+    source: str = ""
+    context: str = ""
+    # Named step inputs/outputs (see `pipeline_step_io`) resolved to paths.
+    paths: dict[str, Path] = field(default_factory=dict)
+    commands: list[tuple[int, list[str]]] = field(default_factory=list)
+    steps: list[StepResult] = field(default_factory=list)
+    # latexmk steps share their working directory, so they run one at a time.
+    latex_lock: threading.Lock = field(default_factory=threading.Lock)
+
+
+def _execute_step(
+    state: _PipelineRun,
+    *,
+    index: int,
+    step: dict[str, Any],
+    cmd: list[str] | None,
+    cwd: Path,
+    outputs: list[Path],
+    inputs: Callable[[], dict[str, str]],
+    prepare: Callable[[], None] | None = None,
+    action: Callable[[], None] | None = None,
+) -> None:
+    """Run one step, or restore its outputs from the step cache.
+
+    External tools pass `cmd`; in-process steps pass `action` instead and
+    contribute no command to the result.
+    """
+
+    kind = str(step["kind"]).strip()
+    with trace.span(kind, "step", index=index):
+        started = time.perf_counter()
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        key: str | None = None
+        if state.cache_root is not None:
+            key = step_cache_key(
+                step=step, inputs=inputs(), tools=state.toolchain.fingerprints([step])
+            )
+            if restore_step(repo_root=state.cache_root, key=key, outputs=outputs):
+                state.steps.append(
+                    StepResult(
+                        index=index,
+                        kind=kind,
+                        cached=True,
+                        wall=time.perf_counter() - started,
+                    )
+                )
+                return
+
+        if cmd is not None:
+            state.commands.append((index, cmd))
+        if not state.dry_run:
+            if prepare is not None:
+                prepare()
+            if action is not None:
+                action()
+            if cmd is not None:
+                options: dict[str, Any] = {}
+                if step.get("timeout") is not None:
+                    options["timeout"] = float(step["timeout"])
+                if state.log_dir is not None:
+                    options["log"] = state.log_dir / f"{index}-{kind}.log"
+                state.runner(cmd, cwd, **options)
+            for out in outputs:
+                if not out.exists():
+                    raise RuntimeError(f"{kind} finished without producing {out.name}")
+            if key is not None and state.cache_root is not None:
+                store_step(repo_root=state.cache_root, key=key, outputs=outputs)
+
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        state.steps.append(
+            StepResult(
+                index=index,
+                kind=kind,
+                cached=False,
+                wall=time.perf_counter() - started,
+                cpu=(after.ru_utime - usage.ru_utime)
+                + (after.ru_stime - usage.ru_stime),
+                max_rss_kb=_rss_kb(after.ru_maxrss),
+            )
+        )
+
+
+def _pandoc_step(
+    state: _PipelineRun, index: int, step: dict[str, Any], io: StepIO
+) -> None:
+    pandoc = state.toolchain.require("pandoc")
+    to = str(step["to"]).strip()
+    from_ = str(step["from"]).strip()
+    tmp = state.tmp
+    (inp_name,) = io.inputs
+    inp = state.paths[inp_name]
+    out = tmp / io.outputs[0]
+
+    cmd = [
+        pandoc,
+        str(inp),
+        f"--from={from_}",
+        f"--to={to}",
+        f"--metadata-file={tmp / 'build_context.yaml'}",
+        *_pandoc_template_args(templates_root=state.templates_root, to=to),
+        *(
+            [f"--include-before-body={tmp / 'build_header.md'}"]
+            if to in {"pdf", "docx"}
+            else []
+        ),
+        "-o",
+        str(out),
+    ]
+
+    _execute_step(
+        state,
+        index=index,
+        step=step,
+        cmd=cmd,
+        cwd=state.source_dir,
+        outputs=[out],
+        inputs=lambda: {
+            "source": (state.source if inp_name == SOURCE_INPUT else file_digest(inp)),
+            "context": state.context,
+            "templates": tree_digest(state.templates_root / "pandoc"),
+        },
+    )
+    state.paths[io.outputs[0]] = out
+
+
+def _vlna_step(
+    state: _PipelineRun, index: int, step: dict[str, Any], io: StepIO
+) -> None:
+    vlna = state.toolchain.require("vlna")
+    inp = state.paths[io.inputs[0]]
+    out = state.tmp / io.outputs[0]
+    cmd = [
+        vlna,
+        "-f",
+        "-l",
+        "-m",
+        "-n",
+        str(inp),
+        str(out),
+    ]
+
+    _execute_step(
+        state,
+        index=index,
+        step=step,
+        cmd=cmd,
+        cwd=state.tmp,
+        outputs=[out],
+        inputs=lambda: {"input": file_digest(inp)},
+    )
+    state.paths[io.outputs[0]] = out
+
+
+def _nbsp_step(
+    state: _PipelineRun, index: int, step: dict[str, Any], io: StepIO
+) -> None:
+    inp = state.paths[io.inputs[0]]
+    out = state.tmp / io.outputs[0]
+    letters = str(step.get("letters") or DEFAULT_LETTERS).strip()
+
+    _execute_step(
+        state,
+        index=index,
+        step=step,
+        cmd=None,
+        cwd=state.tmp,
+        outputs=[out],
+        inputs=lambda: {"input": file_digest(inp), "rules": str(TIE_RULES_VERSION)},
+        action=lambda: tie_file(inp, out, letters=letters),
+    )
+    state.paths[io.outputs[0]] = out
+
+
+def _latexmk_step(
+    state: _PipelineRun, index: int, step: dict[str, Any], io: StepIO
+) -> None:
+    latexmk = state.toolchain.require("latexmk")
+    engine = str(step.get("engine") or "lualatex").strip()
+    main_name = str(step["main"]).strip()
+    tmp = state.tmp
+
+    body = state.paths[io.inputs[0]]
+    if not state.dry_run and not body.exists():
+        raise RuntimeError(f"latexmk step missing prior output file: {body}")
+
+    latex_dir = _latex_templates_dir(state.templates_root)
+    workdir = state.workdir or tmp
+
+    def _stage() -> None:
+        changed = False
+        if state.workdir is not None:
+            changed = _sync_dir_contents(latex_dir, workdir)
+        else:
+            _stage_dir_contents(latex_dir, workdir)
+        main = workdir / main_name
+        if not main.exists():
+            raise FileNotFoundError(
+                f"LaTeX main template not found after copying: {main}"
+            )
+        if body != workdir / "body.tex":
+            changed = _link_if_changed(body, workdir / "body.tex") or changed
+        if workdir != tmp:
+            _link_context(state, workdir, changed=changed)
+
+    cmd = [
+        latexmk,
+        "-pdf",
+        "-interaction=nonstopmode",
+        "-halt-on-error",
+        "-file-line-error",
+        "-e",
+        f"$pdflatex=q/{engine} %O %S/;",
+        str(main_name),
+    ]
+
+    built_pdf = workdir / io.outputs[0]
+    with state.latex_lock:
+        _execute_step(
+            state,
+            index=index,
+            step=step,
+            cmd=cmd,
+            cwd=workdir,
+            outputs=[built_pdf],
+            inputs=lambda: {
+                "body": file_digest(body),
+                "context": state.context,
+                "templates": tree_digest(latex_dir),
+            },
+            prepare=_stage,
+        )
+    state.paths[io.outputs[0]] = built_pdf
+
+
+StepRunner = Callable[[_PipelineRun, int, dict[str, Any], StepIO], None]
+
+_STEP_RUNNERS: dict[str, StepRunner] = {
+    "pandoc": _pandoc_step,
+    "vlna": _vlna_step,
+    "nbsp": _nbsp_step,
+    "latexmk": _latexmk_step,
+}
+
+
+def _publish(src: Path, dest: Path) -> bool:
+    with trace.span("publish", "fs", path=dest.name):
+        return publish_file(src, dest)
+
+
+def _terminal_outputs(graph: list[StepIO]) -> list[str]:
+    """Outputs no step consumes, in step order."""
+
+    consumed = {name for io in graph for name in io.inputs}
+    return [out for io in graph for out in io.outputs if out not in consumed]
+
+
+def _publish_paths(output_path: Path, terminals: list[str]) -> list[tuple[str, Path]]:
+    """Map terminal outputs to destinations; the last step's goes first."""
+
+    *extra, primary = terminals
+    published = [(primary, output_path)]
+    taken = {output_path}
+    for name in extra:
+        suffix = Path(name).suffix
+        dest = output_path.with_suffix(suffix)
+        if dest in taken:
+            dest = output_path.with_name(
+                f"{output_path.stem}_{Path(name).stem}{suffix}"
+            )
+        taken.add(dest)
+        published.append((name, dest))
+    return published
+
+
+def _run_graph(
+    state: _PipelineRun, steps: list[dict[str, Any]], graph: list[StepIO]
+) -> None:
+    """Run every step once its inputs exist, independent steps concurrently."""
+
+    producers = {out: i for i, io in enumerate(graph) for out in io.outputs}
+    deps = {
+        i: {producers[name] for name in io.inputs if name in producers}
+        for i, io in enumerate(graph)
+    }
+
+    def _run_one(index: int) -> None:
+        kind = str(steps[index]["kind"]).strip()
+        step_runner = _STEP_RUNNERS.get(kind)
+        if step_runner is None:
+            raise AssertionError(f"Unexpected step kind: {kind}")
+        step_runner(state, index, steps[index], graph[index])
+
+    done: set[int] = set()
+    running: dict[Future[None], int] = {}
+    with ThreadPoolExecutor(max_workers=len(steps)) as pool:
+
+        def _submit_ready() -> None:
+            active = set(running.values())
+            for i in range(len(steps)):
+                if i not in done and i not in active and deps[i] <= done:
+                    running[pool.submit(_run_one, i)] = i
+
+        _submit_ready()
+        while running:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                index = running.pop(fut)
+                # Re-raises the step's error; steps still running finish
+                # before the pool shuts down, nothing new is started.
+                fut.result()
+                done.add(index)
+            _submit_ready()
+
+
+@trace.traced("run_pipeline", "pipeline")
 def run_pipeline(
     *,
     pipeline_name: str,
@@ -137,6 +652,11 @@ def run_pipeline(
     dry_run: bool = False,
     run: RunFn | None = None,
     version_label: str = "worktree",
+    use_cache: bool = True,
+    persistent: bool = False,
+    built_at: datetime | None = None,
+    keep_scratch: bool = False,
+    log_dir: Path | None = None,
 ) -> PipelineResult:
     """Execute a configured pipeline.
 
@@ -145,161 +665,197 @@ def run_pipeline(
 
     Templates are resolved from `.mcodex/templates/...` when running inside a
     repo and from packaged defaults otherwise.
+
+    Steps form a graph through their named inputs and outputs; steps whose
+    inputs are ready run concurrently. Every output no other step consumes
+    is published: the one from the last step to `output_path`, the others
+    next to it under their own extension.
+
+    Inside a repo, outputs are cached under `.mcodex/cache/`: the published
+    artifacts keyed on all build inputs, and each step's outputs keyed on that
+    step's own inputs, so e.g. a LaTeX template change reruns only latexmk.
+
+    With `persistent=True` (inside a repo), latexmk runs in a directory under
+    `.mcodex/cache/work/` that survives between builds, so its own dependency
+    tracking can skip unnecessary LaTeX passes.
+
+    Intermediate files live in a scratch directory under `build.scratch_dir`
+    (or `MCODEX_SCRATCH_DIR`, e.g. /dev/shm), by default the system temp
+    directory. `keep_scratch=True` leaves it in place for inspection; its
+    path is the result's `scratch_dir`, or a note on the exception raised.
+
+    With `log_dir`, the output of every external tool run is streamed to
+    `<log_dir>/<index>-<kind>.log`; logs of an earlier run are removed first.
     """
 
+    started = time.perf_counter()
     source_dir = source_dir.expanduser().resolve()
     output_path = output_path.expanduser().resolve()
 
-    commands: list[list[str]] = []
-    runner = run or _default_run
+    runner = run or run_command
 
+    repo_root: Path | None
     try:
         repo_root = find_repo_root(source_dir)
         pipe = get_pipeline(pipeline_name, repo_root=repo_root)
     except RepoConfigNotFoundError:
+        repo_root = None
         validate_pipelines(DEFAULT_PIPELINES)
         pipe = DEFAULT_PIPELINES[pipeline_name]
 
     steps = pipe["steps"]
     validate_pipelines({pipeline_name: pipe})
+    graph = pipeline_step_io(steps)
+    published = _publish_paths(output_path, _terminal_outputs(graph))
 
     src_md = source_dir / "text.md"
     if not src_md.exists():
         raise FileNotFoundError(f"Source text not found: {src_md}")
 
+    cache_root = repo_root if use_cache and not dry_run else None
+    toolchain = load_toolchain(repo_root)
+
     with ExitStack() as stack:
         templates_root = _templates_root(source_dir, stack)
 
-        with tempfile.TemporaryDirectory(prefix="mcodex-build-") as td:
-            tmp = Path(td)
+        source = "" if dry_run else source_digest(source_dir)
+        cache_key: str | None = None
+        if cache_root is not None:
+            cache_key = artifact_cache_key(
+                source=source,
+                pipeline_name=pipeline_name,
+                pipeline=pipe,
+                version_label=version_label,
+                templates_root=templates_root,
+                tools=toolchain.fingerprints(steps),
+            )
+            entries = [
+                cached_artifact(
+                    repo_root=cache_root,
+                    key=output_cache_key(cache_key, name, primary=i == 0),
+                )
+                for i, (name, _) in enumerate(published)
+            ]
+            if all(entry is not None for entry in entries):
+                kept = [
+                    dest
+                    for entry, (_, dest) in zip(entries, published, strict=True)
+                    if entry is not None and not _publish(entry, dest)
+                ]
+                return PipelineResult(
+                    output_path=output_path,
+                    commands=[],
+                    outputs=[dest for _, dest in published],
+                    unchanged=kept,
+                    cached=True,
+                    steps=[
+                        StepResult(index=i, kind=str(s["kind"]).strip(), cached=True)
+                        for i, s in enumerate(steps)
+                    ],
+                    pipeline=pipeline_name,
+                    wall=time.perf_counter() - started,
+                    tools=toolchain.versions(steps),
+                    source_digest=source,
+                )
+
+        workdir: Path | None = None
+        if persistent and not dry_run and repo_root is not None:
+            ensure_cache_dir(repo_root)
+            workdir = latex_workdir(
+                repo_root=repo_root,
+                source_dir=source_dir,
+                pipeline_name=pipeline_name,
+            )
+            stack.enter_context(_locked_dir(workdir))
 
+        if log_dir is not None and not dry_run:
+            log_dir.mkdir(parents=True, exist_ok=True)
+            for stale in log_dir.glob("*.log"):
+                stale.unlink(missing_ok=True)
+        else:
+            log_dir = None
+
+        with _scratch_dir(resolve_scratch_dir(repo_root), keep=keep_scratch) as tmp:
             write_build_context(
                 tmp_dir=tmp,
                 source_dir=source_dir,
                 pipeline_name=pipeline_name,
                 version_label=version_label,
+                built_at=built_at,
+            )
+
+            state = _PipelineRun(
+                tmp=tmp,
+                source_dir=source_dir,
+                templates_root=templates_root,
+                runner=runner,
+                toolchain=toolchain,
+                dry_run=dry_run,
+                cache_root=cache_root,
+                workdir=workdir,
+                log_dir=log_dir,
+                source=source,
+                context=(
+                    context_digest(
+                        source_dir=source_dir,
+                        pipeline_name=pipeline_name,
+                        version_label=version_label,
+                    )
+                    if cache_root is not None or workdir is not None
+                    else ""
+                ),
+                paths={SOURCE_INPUT: src_md},
             )
 
-            env: dict[str, Path] = {
-                "source": src_md,
-            }
-
-            for step in steps:
-                kind = str(step["kind"]).strip()
-
-                if kind == "pandoc":
-                    pandoc = _require_executable("pandoc")
-                    to = str(step["to"]).strip()
-                    from_ = str(step["from"]).strip()
-
-                    if to in {"pdf", "docx"}:
-                        out = output_path
-                    else:
-                        out_name = str(step.get("output") or "body_raw.tex")
-                        out = tmp / out_name
-
-                    cmd = [
-                        pandoc,
-                        str(env["source"]),
-                        f"--from={from_}",
-                        f"--to={to}",
-                        f"--metadata-file={tmp / 'build_context.yaml'}",
-                        *_pandoc_template_args(templates_root=templates_root, to=to),
-                        *(
-                            [f"--include-before-body={tmp / 'build_header.md'}"]
-                            if to in {"pdf", "docx"}
-                            else []
-                        ),
-                        "-o",
-                        str(out),
-                    ]
-                    commands.append(cmd)
-                    if not dry_run:
-                        runner(cmd, source_dir)
-                    env["pandoc_out"] = out
-                    continue
-
-                if kind == "vlna":
-                    vlna = _require_executable("vlna")
-                    inp = tmp / str(step["input"]).strip()
-                    out = tmp / str(step["output"]).strip()
-                    cmd = [
-                        vlna,
-                        "-f",
-                        "-l",
-                        "-m",
-                        "-n",
-                        str(inp),
-                        str(out),
-                    ]
-                    commands.append(cmd)
-                    if not dry_run:
-                        runner(cmd, tmp)
-                    env["vlna_out"] = out
-                    continue
-
-                if kind == "latexmk":
-                    latexmk = _require_executable("latexmk")
-                    engine = str(step.get("engine") or "lualatex").strip()
-                    main_name = str(step["main"]).strip()
-
-                    body = env.get("vlna_out") or env.get("pandoc_out")
-                    if not isinstance(body, Path):
-                        raise RuntimeError(
-                            "latexmk step requires prior pandoc output (and vlna "
-                            "output, if configured)."
-                        )
-
-                    if not dry_run:
-                        if not body.exists():
-                            raise RuntimeError(
-                                f"latexmk step missing prior output file: {body}"
-                            )
-
-                        latex_dir = _latex_templates_dir(templates_root)
-                        _copy_dir_contents(latex_dir, tmp)
-
-                        main = tmp / main_name
-                        if not main.exists():
-                            raise FileNotFoundError(
-                                f"LaTeX main template not found after copying: {main}"
-                            )
-
-                        (tmp / "body.tex").write_text(
-                            body.read_text(encoding="utf-8"),
-                            encoding="utf-8",
-                        )
-
-                    cmd = [
-                        latexmk,
-                        "-pdf",
-                        "-interaction=nonstopmode",
-                        "-halt-on-error",
-                        "-file-line-error",
-                        "-e",
-                        f"$pdflatex=q/{engine} %O %S/;",
-                        str(main_name),
-                    ]
-                    commands.append(cmd)
-                    if not dry_run:
-                        runner(cmd, tmp)
-
-                    built_pdf = tmp / "main.pdf"
-                    if not dry_run and not built_pdf.exists():
-                        raise RuntimeError(
-                            "latexmk finished without producing main.pdf"
-                        )
-
-                    if not dry_run:
-                        output_path.parent.mkdir(parents=True, exist_ok=True)
-                        shutil.copyfile(built_pdf, output_path)
-                    continue
-
-                raise AssertionError(f"Unexpected step kind: {kind}")
-
-            if steps and str(steps[-1]["kind"]).strip() == "pandoc":
-                if not dry_run:
-                    output_path.parent.mkdir(parents=True, exist_ok=True)
-                    shutil.copyfile(env["pandoc_out"], output_path)
-
-    return PipelineResult(output_path=output_path, commands=commands)
+            _run_graph(state, steps, graph)
+
+            unchanged: list[Path] = []
+            if not dry_run:
+                unchanged = [
+                    dest
+                    for name, dest in published
+                    if not _publish(state.paths[name], dest)
+                ]
+
+        if cache_key is not None and cache_root is not None:
+            for i, (name, dest) in enumerate(published):
+                store_artifact(
+                    repo_root=cache_root,
+                    key=output_cache_key(cache_key, name, primary=i == 0),
+                    artifact=dest,
+                    tools=toolchain.versions(steps),
+                )
+
+    return PipelineResult(
+        output_path=output_path,
+        commands=[cmd for _, cmd in sorted(state.commands, key=lambda c: c[0])],
+        outputs=[dest for _, dest in published],
+        unchanged=unchanged,
+        steps=sorted(state.steps, key=lambda r: r.index),
+        pipeline=pipeline_name,
+        wall=time.perf_counter() - started,
+        tools=toolchain.versions(steps),
+        log_dir=log_dir,
+        source_digest=source,
+        scratch_dir=tmp if keep_scratch else None,
+    )
+
+
+async def run_pipeline_async(**kwargs: Any) -> PipelineResult:
+    """`run_pipeline` whose tools run as subprocesses of the current loop.
+
+    Takes the keyword arguments of `run_pipeline` except `run`. Many
+    pipelines can be awaited concurrently (e.g. with `asyncio.gather`) from
+    one event loop. Cancelling the awaiting task kills the running tools and
+    waits for the pipeline to clean up before the cancellation propagates.
+    """
+
+    runner = AsyncRunner(asyncio.get_running_loop())
+    task = asyncio.ensure_future(asyncio.to_thread(run_pipeline, run=runner, **kwargs))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        runner.cancel()
+        with contextlib.suppress(Exception):
+            await task
+        raise
@@ -36,10 +36,10 @@ def _format_step(step: dict[str, Any]) -> str:
         out_s = f" output={out}" if isinstance(out, str) and out.strip() else ""
         return f"pandoc {from_} -> {to}{out_s}"
 
-    if kind == "vlna":
+    if kind in {"vlna", "nbsp"}:
         inp = str(step.get("input") or "").strip()
         out = str(step.get("output") or "").strip()
-        return f"vlna {inp} -> {out}"
+        return f"{kind} {inp} -> {out}"
 
     if kind == "latexmk":
         engine = step.get("engine")
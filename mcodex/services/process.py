@@ -0,0 +1,379 @@
+"""Running external tools, blocking or on an asyncio event loop.
+
+Every command starts in its own session, hence its own process group, so a
+timeout or cancellation kills the tool together with whatever it spawned
+(latexmk runs pdflatex, biber, ...): SIGTERM first, SIGKILL after a grace
+period.
+
+Output (stdout and stderr, interleaved) is streamed to a log file, or to an
+anonymous temporary file, never into memory. A failure is reported with a
+bounded summary of it: the `file:line: error` lines LaTeX prints with
+`-file-line-error`, and the last lines of output.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import os
+import re
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from collections import deque
+from collections.abc import Coroutine, Iterator
+from pathlib import Path
+from types import TracebackType
+from typing import Any, BinaryIO
+
+from mcodex.errors import StepTimeoutError
+
+# How long a timed-out or cancelled process group gets to exit after SIGTERM.
+KILL_GRACE = 2.0
+
+# Bounds of the output quoted in a failure message.
+TAIL_LINES = 40
+_MAX_ERROR_LINES = 20
+_MAX_LINE_CHARS = 500
+
+# `-file-line-error` style messages, e.g. "./body.tex:12: Undefined control".
+_FILE_LINE_ERROR_RE = re.compile(r"^[^\s:][^:]*:\d+: ")
+
+
+def command_error(
+    cmd: list[str], output: BinaryIO, *, log: Path | None = None
+) -> RuntimeError:
+    """Summarize a failed command from its output, read once from the start."""
+
+    tail: deque[str] = deque(maxlen=TAIL_LINES)
+    errors: list[str] = []
+    output.seek(0)
+    for raw in output:
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        line = line[:_MAX_LINE_CHARS]
+        tail.append(line)
+        if len(errors) < _MAX_ERROR_LINES and _FILE_LINE_ERROR_RE.match(line):
+            errors.append(line)
+
+    parts: list[str] = [f"Command failed: {' '.join(cmd)}"]
+    if errors:
+        parts.append("--- errors ---")
+        parts.extend(errors)
+    while tail and not tail[0].strip():
+        tail.popleft()
+    if tail:
+        parts.append(f"--- last {len(tail)} lines ---")
+        parts.extend(tail)
+    else:
+        parts.append("(no output)")
+    if log is not None:
+        parts.append(f"Full log: {log}")
+
+    return RuntimeError("\n".join(parts))
+
+
+@contextlib.contextmanager
+def _output_file(log: Path | None) -> Iterator[BinaryIO]:
+    if log is None:
+        with tempfile.TemporaryFile() as f:
+            yield f
+        return
+    log.parent.mkdir(parents=True, exist_ok=True)
+    with log.open("w+b") as f:
+        yield f
+
+
+def _signal_group(pgid: int, sig: signal.Signals) -> None:
+    with contextlib.suppress(ProcessLookupError, PermissionError):
+        os.killpg(pgid, sig)
+
+
+# Process groups of the commands `capture_command` and `run_command` are
+# waiting for. Only plain set operations touch it, so a signal handler can
+# read it without taking a lock.
+_running_groups: set[int] = set()
+_cancelled = False
+
+
+def cancel_running_commands() -> None:
+    """Kill the blocking commands of this process, like `AsyncRunner.cancel`.
+
+    Every running command's process group gets SIGTERM, and SIGKILL if it is
+    still being waited for after `KILL_GRACE`. Those commands, and any
+    started later, fail with "Cancelled". Safe to call from a signal handler
+    (e.g. of a `watch` build child), since tools run in sessions of their own
+    and are out of reach of a signal sent to the caller's process group.
+    """
+
+    global _cancelled
+    _cancelled = True
+    for pgid in list(_running_groups):
+        _signal_group(pgid, signal.SIGTERM)
+    deadline = time.monotonic() + KILL_GRACE
+    while _running_groups and time.monotonic() < deadline:
+        time.sleep(0.01)
+    for pgid in list(_running_groups):
+        _signal_group(pgid, signal.SIGKILL)
+
+
+def _raise_if_cancelled(cmd: list[str]) -> None:
+    if _cancelled:
+        raise RuntimeError(f"Cancelled: {' '.join(cmd)}")
+
+
+@contextlib.contextmanager
+def _tracked(proc: subprocess.Popen[Any]) -> Iterator[None]:
+    _running_groups.add(proc.pid)
+    try:
+        yield
+    finally:
+        _running_groups.discard(proc.pid)
+
+
+def capture_command(
+    cmd: list[str], cwd: Path | None = None, *, timeout: float | None = None
+) -> subprocess.CompletedProcess[str]:
+    """Run `cmd` and return its exit status and output, whatever the status.
+
+    After `timeout` seconds the process group is killed and
+    `StepTimeoutError` raised.
+    """
+
+    _raise_if_cancelled(cmd)
+    proc = subprocess.Popen(
+        cmd,
+        cwd=None if cwd is None else str(cwd),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        start_new_session=True,
+    )
+    with _tracked(proc):
+        try:
+            _raise_if_cancelled(cmd)
+            stdout, stderr = proc.communicate(timeout=timeout)
+            _raise_if_cancelled(cmd)
+        except subprocess.TimeoutExpired:
+            _terminate(proc)
+            raise StepTimeoutError(cmd, float(timeout or 0)) from None
+        except BaseException:
+            _terminate(proc)
+            raise
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
+
+
+def run_command(
+    cmd: list[str],
+    cwd: Path,
+    *,
+    timeout: float | None = None,
+    log: Path | None = None,
+) -> None:
+    """Run `cmd` with its output going to `log`.
+
+    Raises `RuntimeError` summarizing the output on failure, or
+    `StepTimeoutError` after `timeout` seconds.
+    """
+
+    _raise_if_cancelled(cmd)
+    with _output_file(log) as out:
+        proc = subprocess.Popen(
+            cmd,
+            cwd=str(cwd),
+            stdin=subprocess.DEVNULL,
+            stdout=out,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+        with _tracked(proc):
+            try:
+                # Before: a cancel between the check above and `_tracked`
+                # did not see this command. After: `_terminate` also kills
+                # what the tool left running in its group.
+                _raise_if_cancelled(cmd)
+                proc.wait(timeout=timeout)
+                _raise_if_cancelled(cmd)
+            except subprocess.TimeoutExpired:
+                _terminate(proc)
+                raise StepTimeoutError(cmd, float(timeout or 0)) from None
+            except BaseException:
+                _terminate(proc)
+                raise
+
+        if proc.returncode != 0:
+            raise command_error(cmd, out, log=log)
+
+
+def _terminate(proc: subprocess.Popen[Any]) -> None:
+    _signal_group(proc.pid, signal.SIGTERM)
+    try:
+        proc.communicate(timeout=KILL_GRACE)
+    except subprocess.TimeoutExpired:
+        pass
+    # Children may outlive the group leader; make sure none are left.
+    _signal_group(proc.pid, signal.SIGKILL)
+    proc.communicate()
+
+
+async def run_command_async(
+    cmd: list[str],
+    cwd: Path,
+    *,
+    timeout: float | None = None,
+    log: Path | None = None,
+) -> None:
+    """Asyncio counterpart of `run_command`.
+
+    Cancelling the awaiting task kills the process group before the
+    cancellation propagates.
+    """
+
+    with _output_file(log) as out:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=str(cwd),
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=out,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+        )
+        try:
+            await asyncio.wait_for(proc.wait(), timeout)
+        except TimeoutError:
+            await _terminate_async(proc)
+            raise StepTimeoutError(cmd, float(timeout or 0)) from None
+        except BaseException:
+            await asyncio.shield(_terminate_async(proc))
+            raise
+
+        if proc.returncode != 0:
+            raise command_error(cmd, out, log=log)
+
+
+async def _terminate_async(proc: asyncio.subprocess.Process) -> None:
+    _signal_group(proc.pid, signal.SIGTERM)
+    with contextlib.suppress(TimeoutError):
+        await asyncio.wait_for(proc.wait(), KILL_GRACE)
+    _signal_group(proc.pid, signal.SIGKILL)
+    await proc.wait()
+
+
+class AsyncRunner:
+    """A pipeline `RunFn` that executes commands on an asyncio event loop.
+
+    It may be called from any thread other than the loop's own, e.g. from the
+    step threads of `run_pipeline`, so one loop drives the tools of many
+    concurrent pipelines. Without `loop`, a private loop runs in a daemon
+    thread until `close()`. `cancel()` kills every running command, whose
+    call fails once its process group is dead, and makes later calls fail
+    immediately.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        self._thread: threading.Thread | None = None
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=loop.run_forever, name="mcodex-async-runner", daemon=True
+            )
+            self._thread.start()
+        self._loop = loop
+        self._lock = threading.Lock()
+        # Tasks of the running commands; only touched on the loop.
+        self._tasks: set[asyncio.Task[None]] = set()
+        self._cancelled = False
+
+    def __call__(
+        self,
+        cmd: list[str],
+        cwd: Path,
+        *,
+        timeout: float | None = None,
+        log: Path | None = None,
+    ) -> None:
+        if self._thread is None and _running_loop() is self._loop:
+            raise RuntimeError("AsyncRunner cannot be called from its own loop.")
+
+        with self._lock:
+            if self._cancelled:
+                raise RuntimeError(f"Cancelled: {' '.join(cmd)}")
+            done: concurrent.futures.Future[None] = concurrent.futures.Future()
+            self._loop.call_soon_threadsafe(
+                self._start, run_command_async(cmd, cwd, timeout=timeout, log=log), done
+            )
+        try:
+            done.result()
+        except concurrent.futures.CancelledError:
+            raise RuntimeError(f"Cancelled: {' '.join(cmd)}") from None
+
+    def _start(
+        self, coro: Coroutine[Any, Any, None], done: concurrent.futures.Future[None]
+    ) -> None:
+        # On the loop. `done` is settled only once the task has finished, so
+        # a cancelled command's process group is dead and reaped before the
+        # caller goes on to remove its working directory.
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(functools.partial(self._finish, done))
+
+    def _finish(
+        self, done: concurrent.futures.Future[None], task: asyncio.Task[None]
+    ) -> None:
+        self._tasks.discard(task)
+        if task.cancelled():
+            done.cancel()
+        elif (exc := task.exception()) is not None:
+            done.set_exception(exc)
+        else:
+            done.set_result(None)
+
+    def _cancel_tasks(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+    def cancel(self) -> None:
+        with self._lock:
+            self._cancelled = True
+            # Runs after the `_start` of every call admitted before.
+            if not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._cancel_tasks)
+
+    def close(self) -> None:
+        self.cancel()
+        if self._thread is not None:
+            # Let cancelled commands finish killing their process groups.
+            asyncio.run_coroutine_threadsafe(_drain(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._thread = None
+
+    def __enter__(self) -> AsyncRunner:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        self.close()
+
+
+async def _drain() -> None:
+    current = asyncio.current_task()
+    tasks = [t for t in asyncio.all_tasks() if t is not current]
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _running_loop() -> asyncio.AbstractEventLoop | None:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
@@ -1,22 +1,47 @@
 from __future__ import annotations
 
+import os
 import re
 import shutil
 import subprocess
+import tarfile
+import tempfile
 from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from datetime import datetime
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 from typing import Any
 
 import yaml
 
-from mcodex.config import get_snapshot_commit_template
+from mcodex import trace
+from mcodex.config import (
+    find_repo_root,
+    get_snapshot_commit_template,
+    get_snapshot_mode,
+)
 from mcodex.metadata import load_metadata
+from mcodex.services.build_cache import ensure_cache_dir, tree_cache_entry
+from mcodex.services.fs import file_digest, link_or_copy, safe_rmtree
+from mcodex.services.git_plumbing import (
+    NewTree,
+    commit_new_trees,
+    group_by_dir,
+    staged_blobs,
+    tag_trees,
+    untracked_files,
+    worktree_files,
+)
+from mcodex.services.snapshot_index import (
+    LAZY_TRAILER,
+    STAGES,
+    SnapshotEntry,
+    load_snapshot_index,
+    record_snapshot,
+    snapshot_entry,
+)
 
-_STAGES: list[str] = ["draft", "preview", "rc", "final", "published"]
-_STAGE_INDEX: dict[str, int] = {s: i for i, s in enumerate(_STAGES)}
-
-_SNAP_RE = re.compile(r"^(?P<stage>[a-z]+)-(?P<num>[0-9]+)$")
 _LABEL_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
 
 
@@ -25,13 +50,14 @@ class GitRepoNotFoundError(RuntimeError):
 
 
 def _run_git(args: list[str], *, cwd: Path) -> subprocess.CompletedProcess[str]:
-    return subprocess.run(
-        ["git", *args],
-        cwd=cwd,
-        text=True,
-        capture_output=True,
-        check=False,
-    )
+    with trace.span(f"git {args[0]}", "git", argv=" ".join(args)):
+        return subprocess.run(
+            ["git", *args],
+            cwd=cwd,
+            text=True,
+            capture_output=True,
+            check=False,
+        )
 
 
 def _git_root_for(path: Path) -> Path:
@@ -45,34 +71,16 @@ def _snapshot_root(text_dir: Path) -> Path:
     return text_dir / ".snapshot"
 
 
-def _list_snapshot_dirs(text_dir: Path) -> list[Path]:
-    root = _snapshot_root(text_dir)
-    if not root.exists():
-        return []
-    return [p for p in root.iterdir() if p.is_dir() and p.name != ".gitkeep"]
-
-
 def _highest_stage_index(text_dir: Path) -> int | None:
-    highest: int | None = None
-    for p in _list_snapshot_dirs(text_dir):
-        m = _SNAP_RE.match(p.name)
-        if not m:
-            continue
-        stage = m.group("stage")
-        if stage not in _STAGE_INDEX:
-            continue
-        idx = _STAGE_INDEX[stage]
-        if highest is None or idx > highest:
-            highest = idx
-    return highest
+    return load_snapshot_index(text_dir).highest_stage
 
 
 def available_stages(*, text_dir: Path) -> list[str]:
     tdir = text_dir.expanduser().resolve()
     highest = _highest_stage_index(tdir)
     if highest is None:
-        return _STAGES[:]
-    return _STAGES[highest:]
+        return list(STAGES)
+    return list(STAGES[highest:])
 
 
 def current_stage(*, text_dir: Path) -> str | None:
@@ -80,19 +88,11 @@ def current_stage(*, text_dir: Path) -> str | None:
     highest = _highest_stage_index(tdir)
     if highest is None:
         return None
-    return _STAGES[highest]
+    return STAGES[highest]
 
 
 def _next_number_for_stage(text_dir: Path, stage: str) -> int:
-    nums: list[int] = []
-    for p in _list_snapshot_dirs(text_dir):
-        m = _SNAP_RE.match(p.name)
-        if not m:
-            continue
-        if m.group("stage") != stage:
-            continue
-        nums.append(int(m.group("num")))
-    return (max(nums) + 1) if nums else 1
+    return load_snapshot_index(text_dir).next_number(stage)
 
 
 def normalize_snapshot_label(*, text_dir: Path, label_or_stage: str) -> str:
@@ -105,25 +105,67 @@ def normalize_snapshot_label(*, text_dir: Path, label_or_stage: str) -> str:
     tdir = text_dir.expanduser().resolve()
     raw = str(label_or_stage).strip()
 
-    if raw in _STAGES:
+    if raw in STAGES:
         n = _next_number_for_stage(tdir, raw)
         return f"{raw}-{n}"
 
     return raw
 
 
+def _previous_snapshot(text_dir: Path) -> Path | None:
+    """The most recently created snapshot of a text, if any."""
+
+    latest = load_snapshot_index(text_dir).latest
+    return _snapshot_root(text_dir) / latest if latest else None
+
+
+def _same_file_content(src: Path, previous: Path) -> bool:
+    try:
+        a, b = src.stat(), previous.stat()
+    except OSError:
+        return False
+    if a.st_size != b.st_size or a.st_mode != b.st_mode:
+        return False
+    # Never trust a matching mtime: `cp -p`, `tar -x`, `touch -r` or an
+    # editor restoring it would get the wrong content shared.
+    return file_digest(src) == file_digest(previous)
+
+
+@trace.traced("copy text dir", "fs")
 def _copy_text_dir(
     *,
     src: Path,
     dst: Path,
     ignore_names: Iterable[str],
-) -> None:
-    ignored = set(ignore_names)
-
-    def _ignore(_: str, names: list[str]) -> set[str]:
-        return {n for n in names if n in ignored}
+    previous: Path | None = None,
+) -> list[str]:
+    """Copy `src` into the empty `dst`, sharing files unchanged since `previous`.
+
+    A file with the same size, mode and content as in the previous snapshot
+    is hardlinked (or reflinked) to that copy instead of copied again, so a
+    snapshot only takes the space of what changed. Snapshots are never
+    written in place, so sharing keeps them immutable. Returns the shared
+    paths, relative to `dst` (POSIX).
+    """
 
-    shutil.copytree(src, dst, ignore=_ignore, dirs_exist_ok=False)
+    ignored = set(ignore_names)
+    shared: list[str] = []
+    for dirpath, dirnames, filenames in os.walk(src, followlinks=True):
+        dirnames[:] = sorted(d for d in dirnames if d not in ignored)
+        rel_dir = Path(dirpath).relative_to(src)
+        for d in dirnames:
+            (dst / rel_dir / d).mkdir()
+        for name in filenames:
+            if name in ignored:
+                continue
+            rel = rel_dir / name
+            before = previous / rel if previous is not None else None
+            if before is not None and _same_file_content(src / rel, before):
+                link_or_copy(before, dst / rel, allow_symlink=False)
+                shared.append(rel.as_posix())
+            else:
+                shutil.copy2(src / rel, dst / rel)
+    return shared
 
 
 def _write_snapshot_yaml(
@@ -133,10 +175,11 @@ def _write_snapshot_yaml(
     note: str | None,
     git_tag: str,
     text_slug: str,
-) -> None:
+) -> SnapshotEntry:
+    created_at = datetime.now().astimezone().isoformat()
     payload: dict[str, Any] = {
         "label": label,
-        "created_at": datetime.now().astimezone().isoformat(),
+        "created_at": created_at,
         "text": {"slug": text_slug},
         "git": {
             "tag": git_tag,
@@ -144,10 +187,15 @@ def _write_snapshot_yaml(
     }
     if note:
         payload["note"] = note
+    # Never write through a file shared with an earlier snapshot.
+    path.unlink(missing_ok=True)
     path.write_text(
         yaml.safe_dump(payload, sort_keys=False, allow_unicode=True),
         encoding="utf-8",
     )
+    return snapshot_entry(
+        label=label, created_at=created_at, note=note or None, git_tag=git_tag
+    )
 
 
 def _format_commit_message(
@@ -174,7 +222,17 @@ def _extract_metadata_dict(result: Any) -> dict[str, Any]:
     return {}
 
 
-def snapshot_create(*, text_dir: Path, label: str, note: str | None) -> Path:
+@dataclass(frozen=True)
+class _SnapshotPlan:
+    text_dir: Path
+    slug: str
+    label: str
+    snap_dir: Path
+    tag: str
+    previous: Path | None
+
+
+def _plan_snapshot(text_dir: Path, label: str) -> _SnapshotPlan:
     tdir = text_dir.expanduser().resolve()
 
     safe_label = normalize_snapshot_label(text_dir=tdir, label_or_stage=label)
@@ -186,69 +244,331 @@ def snapshot_create(*, text_dir: Path, label: str, note: str | None) -> Path:
             "(must start with letter or digit)."
         )
 
-    repo_root = _git_root_for(tdir)
-
     meta_path = tdir / "metadata.yaml"
     meta = _extract_metadata_dict(load_metadata(meta_path))
     slug = str(meta.get("slug") or tdir.name)
 
-    root = _snapshot_root(tdir)
-    root.mkdir(parents=True, exist_ok=True)
-
-    snap_dir = root / safe_label
-    if snap_dir.exists():
+    snap_dir = _snapshot_root(tdir) / safe_label
+    if snap_dir.exists() or load_snapshot_index(tdir).get(safe_label) is not None:
         raise FileExistsError(f"Snapshot already exists: {snap_dir}")
 
-    tag = f"mcodex/{slug}/{safe_label}"
+    return _SnapshotPlan(
+        text_dir=tdir,
+        slug=slug,
+        label=safe_label,
+        snap_dir=snap_dir,
+        tag=f"mcodex/{slug}/{safe_label}",
+        previous=_previous_snapshot(tdir),
+    )
 
-    # Copy the whole text directory into the snapshot directory.
-    # Ignore snapshot root itself to avoid recursion.
-    _copy_text_dir(src=tdir, dst=snap_dir, ignore_names=[root.name, ".git"])
 
-    _write_snapshot_yaml(
-        path=snap_dir / "snapshot.yaml",
-        label=safe_label,
+def _copy_snapshot(
+    plan: _SnapshotPlan, *, note: str | None, created: list[_SnapshotPlan]
+) -> tuple[list[str], SnapshotEntry]:
+    root = _snapshot_root(plan.text_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    plan.snap_dir.mkdir()
+    created.append(plan)
+
+    # Copy the whole text directory into the snapshot directory, sharing
+    # unchanged files with the previous snapshot. Ignore snapshot root itself
+    # to avoid recursion.
+    shared = _copy_text_dir(
+        src=plan.text_dir,
+        dst=plan.snap_dir,
+        ignore_names=[root.name, ".git"],
+        previous=plan.previous,
+    )
+    entry = _write_snapshot_yaml(
+        path=plan.snap_dir / "snapshot.yaml",
+        label=plan.label,
         note=note,
-        git_tag=tag,
-        text_slug=slug,
+        git_tag=plan.tag,
+        text_slug=plan.slug,
     )
+    return shared, entry
+
 
-    # Git commit + tag.
-    rel_snap_dir = snap_dir.relative_to(repo_root)
+def _plan_tags(plans: list[_SnapshotPlan]) -> list[str]:
+    tags = [plan.tag for plan in plans]
+    duplicates = sorted({t for t in tags if tags.count(t) > 1})
+    if duplicates:
+        raise ValueError(f"Texts share a slug, tags would clash: {duplicates}")
+    return tags
 
-    add_cp = _run_git(["add", str(rel_snap_dir)], cwd=repo_root)
-    if add_cp.returncode != 0:
-        raise RuntimeError(
-            f"Git add failed:\nout: {add_cp.stdout}\nerr: {add_cp.stderr}\n"
+
+def _create_snapshots(
+    *,
+    repo_root: Path,
+    plans: list[_SnapshotPlan],
+    note: str | None,
+    message: str,
+    jobs: int | None = None,
+) -> None:
+    """Copy, commit and tag the planned snapshots together.
+
+    The copies run in parallel threads; all snapshot directories go into one
+    commit and all tags are created with it. If anything fails, the new
+    snapshot directories are removed again and HEAD, the index and the tags
+    are left as they were.
+    """
+
+    tags = _plan_tags(plans)
+    created: list[_SnapshotPlan] = []
+    try:
+        workers = min(len(plans), jobs or os.cpu_count() or 1)
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+            futures = [
+                pool.submit(_copy_snapshot, plan, note=note, created=created)
+                for plan in plans
+            ]
+            copies = [f.result() for f in futures]
+
+        # Commit the snapshot directories and tag them with git plumbing:
+        # only the new paths are hashed and staged, the rest of the repo is
+        # not scanned.
+        rel_dirs = [p.snap_dir.relative_to(repo_root).as_posix() for p in plans]
+        files = group_by_dir(
+            untracked_files(repo_root=repo_root, paths=rel_dirs), rel_dirs
+        )
+        # Shared files are already in Git as part of the previous snapshot;
+        # like the hardlinks, reusing their blobs relies on snapshots never
+        # changing.
+        previous = {
+            plan.label: plan.previous.relative_to(repo_root).as_posix()
+            for plan, (shared, _) in zip(plans, copies, strict=True)
+            if shared and plan.previous is not None
+        }
+        staged = staged_blobs(repo_root=repo_root, paths=set(previous.values()))
+
+        trees: list[NewTree] = []
+        for plan, rel_dir, (shared, _) in zip(plans, rel_dirs, copies, strict=True):
+            blobs = staged.get(previous.get(plan.label, ""), {})
+            trees.append(
+                NewTree(
+                    path=rel_dir,
+                    files={rel: repo_root / f for rel, f in files[rel_dir].items()},
+                    blobs={rel: blobs[rel] for rel in shared if rel in blobs},
+                )
+            )
+        commit_new_trees(repo_root=repo_root, trees=trees, message=message, tags=tags)
+    except BaseException:
+        for plan in created:
+            safe_rmtree(
+                plan.snap_dir,
+                allowed_roots=[_snapshot_root(plan.text_dir)],
+                ignore_errors=True,
+            )
+        raise
+
+    for plan, (_, entry) in zip(plans, copies, strict=True):
+        record_snapshot(plan.text_dir, entry)
+
+
+def _create_lazy_snapshots(
+    *, repo_root: Path, plans: list[_SnapshotPlan], note: str | None
+) -> None:
+    """Tag the current files of each text as a tree of its own, without copies.
+
+    Every text gets a commit whose root tree holds its files (what a copy
+    would contain) plus `snapshot.yaml`. The commits are reachable from
+    their tags only, so HEAD, the index and the working tree stay as they
+    are; all tags are created together or not at all.
+    """
+
+    tags = _plan_tags(plans)
+    rel_dirs = [p.text_dir.relative_to(repo_root).as_posix() for p in plans]
+    files = group_by_dir(worktree_files(repo_root=repo_root, paths=rel_dirs), rel_dirs)
+    ignored = {".snapshot", ".git"}
+
+    with tempfile.TemporaryDirectory(prefix="mcodex-snapshot-") as tmp:
+        trees: list[NewTree] = []
+        entries: list[SnapshotEntry] = []
+        messages: list[str] = []
+        for i, (plan, rel_dir) in enumerate(zip(plans, rel_dirs, strict=True)):
+            meta_file = Path(tmp) / str(i) / "snapshot.yaml"
+            meta_file.parent.mkdir()
+            entries.append(
+                _write_snapshot_yaml(
+                    path=meta_file,
+                    label=plan.label,
+                    note=note,
+                    git_tag=plan.tag,
+                    text_slug=plan.slug,
+                )
+            )
+            text_files = {
+                rel: repo_root / f
+                for rel, f in files[rel_dir].items()
+                if not ignored & set(PurePosixPath(rel).parts)
+            }
+            text_files["snapshot.yaml"] = meta_file
+            trees.append(NewTree(path=rel_dir, files=text_files))
+            message = _format_commit_message(
+                repo_root=repo_root, slug=plan.slug, label=plan.label, note=note
+            )
+            messages.append(f"{message}\n\n{LAZY_TRAILER}: lazy")
+        commits = tag_trees(
+            repo_root=repo_root, trees=trees, messages=messages, tags=tags
         )
 
+    for plan, rel_dir, entry, commit in zip(
+        plans, rel_dirs, entries, commits, strict=True
+    ):
+        _snapshot_root(plan.text_dir).mkdir(parents=True, exist_ok=True)
+        record_snapshot(plan.text_dir, replace(entry, tree=commit.trees[rel_dir]))
+
+
+def _extract_tree_archive(tar: tarfile.TarFile, dest: Path) -> None:
+    """Extract a `git archive` stream, refusing members that leave `dest`."""
+
+    if hasattr(tarfile, "data_filter"):
+        tar.extractall(dest, filter="data")
+        return
+    # Python before 3.11.4 has no extraction filters: check by hand what the
+    # "data" filter would (a Git tree holds only files, dirs and symlinks).
+    root = dest.resolve()
+    for member in tar:
+        path = PurePosixPath(member.name)
+        if path.is_absolute() or ".." in path.parts:
+            raise tarfile.TarError(f"Unsafe path in archive: {member.name}")
+        if member.issym():
+            link = PurePosixPath(member.linkname)
+            resolved = (root / path.parent / link).resolve()
+            if link.is_absolute() or not resolved.is_relative_to(root):
+                raise tarfile.TarError(
+                    f"Link leaves the archive: {member.name} -> {member.linkname}"
+                )
+        elif not (member.isfile() or member.isdir()):
+            raise tarfile.TarError(f"Unsupported member in archive: {member.name}")
+        member.mode &= 0o755
+        tar.extract(member, dest)
+
+
+def materialize_snapshot(*, text_dir: Path, entry: SnapshotEntry) -> Path:
+    """Files of a lazy snapshot, extracted from Git on first use.
+
+    The tree is streamed through `git archive` into
+    `.mcodex/cache/trees/<xx>/<tree>/`, shared by every text, ref and build
+    that needs the same tree, and evicted by `artifacts gc` like other cache
+    entries.
+    """
+
+    if entry.tree is None:
+        raise ValueError(f"Snapshot {entry.label} is not lazy.")
+    repo_root = find_repo_root(text_dir)
+    target = tree_cache_entry(repo_root, entry.tree)
+    if target.is_dir():
+        os.utime(target)
+        return target
+
+    ensure_cache_dir(repo_root)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=target.parent, prefix=".tmp-"))
+    try:
+        # From a subdirectory, git archive would only export that path.
+        git_root = _git_root_for(text_dir)
+        with trace.span("git archive", "git", argv=f"archive {entry.tree}"):
+            proc = subprocess.Popen(
+                ["git", "archive", "--format=tar", entry.tree],
+                cwd=git_root,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            assert proc.stdout is not None and proc.stderr is not None
+            failure: tarfile.TarError | None = None
+            try:
+                with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+                    _extract_tree_archive(tar, tmp)
+            except tarfile.TarError as e:
+                failure = e
+            finally:
+                proc.stdout.close()
+                err = proc.stderr.read().decode("utf-8", errors="replace")
+                proc.wait()
+        if proc.returncode != 0:
+            raise RuntimeError(f"git archive failed:\nerr: {err}")
+        if failure is not None:
+            raise RuntimeError(f"Cannot extract snapshot {entry.label}: {failure}")
+        try:
+            os.rename(tmp, target)
+        except OSError:
+            # Materialized concurrently by another build.
+            if not target.is_dir():
+                raise
+    finally:
+        safe_rmtree(tmp, allowed_roots=[target.parent], ignore_errors=True)
+    return target
+
+
+def snapshot_create(*, text_dir: Path, label: str, note: str | None) -> Path:
+    """Snapshot a text; returns the snapshot directory.
+
+    With `snapshot.mode: lazy` only the tag is created and the returned
+    directory does not exist (see `materialize_snapshot`).
+    """
+
+    tdir = text_dir.expanduser().resolve()
+    plan = _plan_snapshot(tdir, label)
+    repo_root = _git_root_for(tdir)
     msg = _format_commit_message(
         repo_root=repo_root,
-        slug=slug,
-        label=safe_label,
+        slug=plan.slug,
+        label=plan.label,
         note=note,
     )
+    if get_snapshot_mode(repo_root) == "lazy":
+        _create_lazy_snapshots(repo_root=repo_root, plans=[plan], note=note)
+    else:
+        _create_snapshots(repo_root=repo_root, plans=[plan], note=note, message=msg)
+    return plan.snap_dir
 
-    commit_cp = _run_git(["commit", "-m", msg], cwd=repo_root)
-    if commit_cp.returncode != 0:
-        raise RuntimeError(
-            f"Git commit failed:\nout: {commit_cp.stdout}\nerr: {commit_cp.stderr}\n"
-        )
 
-    tag_cp = _run_git(["tag", tag], cwd=repo_root)
-    if tag_cp.returncode != 0:
-        raise RuntimeError(
-            f"Git tag failed:\nout: {tag_cp.stdout}\nerr: {tag_cp.stderr}\n"
-        )
+def snapshot_create_many(
+    *,
+    text_dirs: list[Path],
+    label: str,
+    note: str | None,
+    jobs: int | None = None,
+) -> list[Path]:
+    """Snapshot several texts of one repo in a single commit.
+
+    `label` is a stage (each text gets its own next number) or an explicit
+    label. Every text is checked before anything is copied; the commit and
+    all `mcodex/<slug>/<label>` tags are created together or not at all.
+    """
 
-    return snap_dir
+    if not text_dirs:
+        return []
+    plans = [_plan_snapshot(tdir, label) for tdir in text_dirs]
+    repo_root = _git_root_for(plans[0].text_dir)
+    for plan in plans:
+        if not plan.text_dir.is_relative_to(repo_root):
+            raise ValueError(
+                f"Text is not in the repository {repo_root}: {plan.text_dir}"
+            )
+
+    lines = [
+        _format_commit_message(
+            repo_root=repo_root, slug=plan.slug, label=plan.label, note=note
+        )
+        for plan in plans
+    ]
+    msg = f"Snapshot: {len(plans)} texts / {label}\n\n" + "\n".join(lines)
+    if get_snapshot_mode(repo_root) == "lazy":
+        _create_lazy_snapshots(repo_root=repo_root, plans=plans, note=note)
+    else:
+        _create_snapshots(
+            repo_root=repo_root, plans=plans, note=note, message=msg, jobs=jobs
+        )
+    return [plan.snap_dir for plan in plans]
 
 
 def snapshot_list(*, text_dir: Path) -> None:
     tdir = text_dir.expanduser().resolve()
-    items = sorted(_list_snapshot_dirs(tdir), key=lambda p: p.name)
-    if not items:
+    labels = load_snapshot_index(tdir).labels
+    if not labels:
         print("No snapshots found.")
         return
-    for p in items:
-        print(p.name)
+    for label in labels:
+        print(label)
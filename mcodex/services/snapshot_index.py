@@ -0,0 +1,382 @@
+"""Per-text index of snapshots, kept in `.snapshot/index.yaml`.
+
+The index lists every snapshot directory with the fields of its
+`snapshot.yaml` (label, stage, number, created_at, note, git tag), so the
+questions asked on every command ("latest draft", "next rc number",
+"highest stage reached") are dictionary lookups instead of a scan of the
+snapshot directory plus a regex match per entry.
+
+`snapshot_create` adds its entry and rewrites the file atomically. The file
+is a cache: it is kept out of Git, and whenever it is missing, unreadable
+or does not list exactly the snapshot directories (another branch, a
+removed snapshot, a concurrent `snapshot_create`) it is rebuilt from the
+directories. Within a process the loaded index is reused until the
+snapshot directory itself changes.
+
+Lazy snapshots have no directory: their entry carries the id of the tagged
+tree instead. When the index is rebuilt they are found again from the
+`mcodex/<slug>/*` tags whose commit has the `Mcodex-Snapshot: lazy`
+trailer, also for a text without `.snapshot/` (a clone of a repository
+that only ever had lazy snapshots).
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import yaml
+
+from mcodex.services.git_plumbing import tag_state, tagged_commits
+
+INDEX_NAME = "index.yaml"
+_INDEX_VERSION = 1
+# Trailer marking the commits of lazy snapshots.
+LAZY_TRAILER = "Mcodex-Snapshot"
+_GITIGNORE = "/index.yaml\n/.index-*.tmp\n/.gitignore\n"
+
+STAGES: tuple[str, ...] = ("draft", "preview", "rc", "final", "published")
+_STAGE_INDEX: dict[str, int] = {s: i for i, s in enumerate(STAGES)}
+
+_SNAP_RE = re.compile(r"^(?P<stage>[a-z]+)-(?P<num>[0-9]+)$")
+
+
+def parse_snapshot_label(label: str) -> tuple[str, int] | None:
+    """Stage and number of a `<stage>-<n>` label, None for other labels."""
+
+    m = _SNAP_RE.match(label)
+    return (m.group("stage"), int(m.group("num"))) if m else None
+
+
+def stage_index(label_or_stage: str) -> int | None:
+    """Position of a stage ("rc") or `<stage>-<n>` label in the stage order.
+
+    Returns None for labels that are not tied to a known stage.
+    """
+
+    parsed = parse_snapshot_label(label_or_stage)
+    return _STAGE_INDEX.get(parsed[0] if parsed else label_or_stage)
+
+
+@dataclass(frozen=True)
+class SnapshotEntry:
+    label: str
+    # Set for `<stage>-<n>` labels only.
+    stage: str | None = None
+    number: int | None = None
+    created_at: str = ""
+    note: str | None = None
+    git_tag: str | None = None
+    # Set for lazy snapshots, which exist only as a tagged Git tree.
+    tree: str | None = None
+
+
+@dataclass(frozen=True)
+class SnapshotIndex:
+    """The snapshots of one text, with the lookups derived from them."""
+
+    entries: tuple[SnapshotEntry, ...] = ()
+    # stage -> label of its highest-numbered snapshot
+    latest_by_stage: dict[str, str] = field(default_factory=dict)
+    # Position in the stage order of the furthest stage with a snapshot.
+    highest_stage: int | None = None
+    # Label of the most recently created snapshot with a directory.
+    latest: str | None = None
+    by_label: dict[str, SnapshotEntry] = field(default_factory=dict)
+
+    @property
+    def labels(self) -> list[str]:
+        return [e.label for e in self.entries]
+
+    def get(self, label: str) -> SnapshotEntry | None:
+        return self.by_label.get(label)
+
+    def latest_of_stage(self, stage: str) -> str | None:
+        return self.latest_by_stage.get(stage)
+
+    def next_number(self, stage: str) -> int:
+        label = self.latest_by_stage.get(stage)
+        if label is None:
+            return 1
+        parsed = parse_snapshot_label(label)
+        assert parsed is not None
+        return parsed[1] + 1
+
+
+def snapshot_entry(
+    *,
+    label: str,
+    created_at: str = "",
+    note: str | None = None,
+    git_tag: str | None = None,
+    tree: str | None = None,
+) -> SnapshotEntry:
+    parsed = parse_snapshot_label(label)
+    return SnapshotEntry(
+        label=label,
+        stage=parsed[0] if parsed else None,
+        number=parsed[1] if parsed else None,
+        created_at=created_at,
+        note=note,
+        git_tag=git_tag,
+        tree=tree,
+    )
+
+
+def _timestamp(created_at: str) -> float:
+    try:
+        return datetime.fromisoformat(created_at).timestamp()
+    except ValueError:
+        return 0.0
+
+
+def build_index(entries: list[SnapshotEntry]) -> SnapshotIndex:
+    ordered = tuple(sorted(entries, key=lambda e: e.label))
+    latest_by_stage: dict[str, str] = {}
+    numbers: dict[str, int] = {}
+    highest: int | None = None
+    for e in ordered:
+        if e.stage is None or e.number is None:
+            continue
+        if e.number >= numbers.get(e.stage, 0):
+            numbers[e.stage] = e.number
+            latest_by_stage[e.stage] = e.label
+        idx = _STAGE_INDEX.get(e.stage)
+        if idx is not None and (highest is None or idx > highest):
+            highest = idx
+    dated = [
+        (_timestamp(e.created_at), e.label)
+        for e in ordered
+        if e.created_at and e.tree is None
+    ]
+    latest = max(dated)[1] if dated else None
+    return SnapshotIndex(
+        entries=ordered,
+        latest_by_stage=latest_by_stage,
+        highest_stage=highest,
+        latest=latest,
+        by_label={e.label: e for e in ordered},
+    )
+
+
+# Snapshot root -> (its mtime and link count when loaded, or the state of
+# the text's tags if it does not exist, index).
+_loaded: dict[Path, tuple[object, SnapshotIndex]] = {}
+
+
+def _dir_stamp(root: Path) -> tuple[int, int] | None:
+    try:
+        st = root.stat()
+    except FileNotFoundError:
+        return None
+    # The link count changes with every subdirectory added or removed, even
+    # within one mtime tick.
+    return (st.st_mtime_ns, st.st_nlink)
+
+
+def _snapshot_dir_names(root: Path) -> set[str]:
+    with os.scandir(root) as it:
+        return {e.name for e in it if e.is_dir() and e.name != ".gitkeep"}
+
+
+def _read_snapshot_yaml(snap_dir: Path) -> SnapshotEntry:
+    try:
+        data = yaml.safe_load((snap_dir / "snapshot.yaml").read_text("utf-8"))
+    except (OSError, yaml.YAMLError):
+        data = None
+    if not isinstance(data, dict):
+        return snapshot_entry(label=snap_dir.name)
+    git = data.get("git")
+    tag = git.get("tag") if isinstance(git, dict) else None
+    return snapshot_entry(
+        label=snap_dir.name,
+        created_at=str(data.get("created_at") or ""),
+        note=str(data["note"]) if data.get("note") else None,
+        git_tag=str(tag) if tag else None,
+    )
+
+
+def _read_index_file(root: Path) -> list[SnapshotEntry] | None:
+    try:
+        data = yaml.safe_load((root / INDEX_NAME).read_text("utf-8"))
+    except (OSError, yaml.YAMLError):
+        return None
+    if not isinstance(data, dict) or data.get("version") != _INDEX_VERSION:
+        return None
+    raw = data.get("snapshots")
+    if not isinstance(raw, list):
+        return None
+    entries: list[SnapshotEntry] = []
+    for item in raw:
+        if not isinstance(item, dict) or not isinstance(item.get("label"), str):
+            return None
+        entries.append(
+            snapshot_entry(
+                label=item["label"],
+                created_at=str(item.get("created_at") or ""),
+                note=str(item["note"]) if item.get("note") else None,
+                git_tag=str(item["git_tag"]) if item.get("git_tag") else None,
+                tree=str(item["tree"]) if item.get("tree") else None,
+            )
+        )
+    return entries
+
+
+def _write_index_file(root: Path, index: SnapshotIndex) -> None:
+    """Replace the index file atomically; a read-only tree just keeps none."""
+
+    snapshots: list[dict[str, Any]] = []
+    for e in index.entries:
+        item: dict[str, Any] = {"label": e.label}
+        if e.stage is not None:
+            item["stage"] = e.stage
+            item["number"] = e.number
+        item["created_at"] = e.created_at
+        if e.note:
+            item["note"] = e.note
+        if e.git_tag:
+            item["git_tag"] = e.git_tag
+        if e.tree:
+            item["tree"] = e.tree
+        snapshots.append(item)
+    payload = {"version": _INDEX_VERSION, "snapshots": snapshots}
+
+    try:
+        gitignore = root / ".gitignore"
+        if not gitignore.exists():
+            gitignore.write_text(_GITIGNORE, encoding="utf-8")
+        fd, tmp_name = tempfile.mkstemp(dir=root, prefix=".index-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                yaml.safe_dump(payload, f, sort_keys=False, allow_unicode=True)
+            os.replace(tmp_name, root / INDEX_NAME)
+        finally:
+            Path(tmp_name).unlink(missing_ok=True)
+    except OSError:
+        pass
+
+
+def _tag_prefix(text_dir: Path) -> str | None:
+    """`mcodex/<slug>/`, the prefix of the tags of a text."""
+
+    try:
+        meta = yaml.safe_load((text_dir / "metadata.yaml").read_text("utf-8"))
+    except (OSError, yaml.YAMLError):
+        return None
+    slug = str((meta if isinstance(meta, dict) else {}).get("slug") or text_dir.name)
+    return f"mcodex/{slug}/"
+
+
+def _lazy_from_tags(text_dir: Path) -> list[SnapshotEntry]:
+    """Lazy snapshots of a text, from its `mcodex/<slug>/` tags."""
+
+    prefix = _tag_prefix(text_dir)
+    if prefix is None:
+        return []
+    try:
+        commits = tagged_commits(cwd=text_dir, prefix=prefix, trailer=LAZY_TRAILER)
+    except (OSError, RuntimeError):
+        return []
+    return [
+        snapshot_entry(
+            label=c.tag.removeprefix(prefix),
+            created_at=c.created_at,
+            git_tag=c.tag,
+            tree=c.tree,
+        )
+        for c in commits
+        if c.trailer == "lazy"
+    ]
+
+
+def _refresh(
+    root: Path,
+    known: dict[str, SnapshotEntry],
+    *,
+    lazy: list[SnapshotEntry] | None = None,
+    write: bool = False,
+) -> SnapshotIndex:
+    """Index the snapshot directories, reading `snapshot.yaml` of unknown ones.
+
+    Lazy snapshots are taken from `lazy` if given, else from `known`.
+    """
+
+    names = _snapshot_dir_names(root)
+    copies = {label: e for label, e in known.items() if e.tree is None}
+    if lazy is None:
+        lazy = [e for e in known.values() if e.tree is not None]
+    index = build_index(
+        [copies.get(name) or _read_snapshot_yaml(root / name) for name in names]
+        + [e for e in lazy if e.label not in names]
+    )
+    if write or set(copies) != names:
+        _write_index_file(root, index)
+    stamp = _dir_stamp(root)
+    if stamp is not None:
+        _loaded[root] = (stamp, index)
+    return index
+
+
+def _from_tags_only(
+    root: Path, text_dir: Path, *, force: bool = False
+) -> SnapshotIndex:
+    """Index of a text without `.snapshot/` (e.g. a clone of lazy snapshots).
+
+    Kept until the text's tags may have changed, which is told from the ref
+    files; git runs only if such tags may exist. Nothing is written: reading
+    must not create the directory.
+    """
+
+    prefix = _tag_prefix(text_dir)
+    state = None if prefix is None else tag_state(cwd=text_dir, prefix=prefix)
+    stamp = ("tags", None if state is None else state.stamp)
+    loaded = _loaded.get(root)
+    if not force and loaded is not None and loaded[0] == stamp:
+        return loaded[1]
+    # Ask git unless the ref files rule the tags out.
+    lazy = (
+        [] if state is not None and not state.may_exist else _lazy_from_tags(text_dir)
+    )
+    index = build_index(lazy)
+    _loaded[root] = (stamp, index)
+    return index
+
+
+def load_snapshot_index(text_dir: Path) -> SnapshotIndex:
+    """The snapshot index of a text, rebuilt if missing or stale."""
+
+    root = text_dir / ".snapshot"
+    stamp = _dir_stamp(root)
+    if stamp is None:
+        return _from_tags_only(root, text_dir)
+    loaded = _loaded.get(root)
+    if loaded is not None and loaded[0] == stamp:
+        return loaded[1]
+    entries = _read_index_file(root)
+    if entries is None:
+        return _refresh(root, {}, lazy=_lazy_from_tags(text_dir), write=True)
+    return _refresh(root, {e.label: e for e in entries})
+
+
+def refresh_snapshot_index(text_dir: Path) -> SnapshotIndex:
+    """Reload the lazy snapshots of a text from its tags (e.g. after a fetch)."""
+
+    root = text_dir / ".snapshot"
+    if _dir_stamp(root) is None:
+        return _from_tags_only(root, text_dir, force=True)
+    known = {e.label: e for e in _read_index_file(root) or []}
+    return _refresh(root, known, lazy=_lazy_from_tags(text_dir), write=True)
+
+
+def record_snapshot(text_dir: Path, entry: SnapshotEntry) -> SnapshotIndex:
+    """Add a newly created snapshot to the index of its text."""
+
+    root = text_dir / ".snapshot"
+    known = {e.label: e for e in _read_index_file(root) or []}
+    known[entry.label] = entry
+    return _refresh(root, known, write=True)
@@ -0,0 +1,21 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+from mcodex.config import get_text_prefix
+
+
+def discover_text_dirs(*, repo_root: Path) -> list[Path]:
+    """List text directories in a repo, sorted by name.
+
+    A text directory is a direct child of the repo root whose name starts with
+    the configured `text_prefix` and which contains `metadata.yaml`.
+    """
+
+    root = repo_root.expanduser().resolve()
+    prefix = get_text_prefix(repo_root=root)
+    return sorted(
+        p
+        for p in root.iterdir()
+        if p.name.startswith(prefix) and (p / "metadata.yaml").is_file()
+    )
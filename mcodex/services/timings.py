@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+import json
+from dataclasses import asdict
+from pathlib import Path
+from typing import Any
+
+from mcodex.services.pipeline import PipelineResult
+
+
+def _format_rss(kb: int) -> str:
+    return f"{kb / 1024:.1f} MiB" if kb else "-"
+
+
+def format_timings(results: list[PipelineResult]) -> str:
+    """Render per-step timings of pipeline runs as a fixed-width table."""
+
+    headers = ("PIPELINE", "STEP", "KIND", "WALL", "CPU", "MAX RSS")
+    rows: list[tuple[str, ...]] = []
+    for r in results:
+        for s in r.steps:
+            rows.append(
+                (
+                    r.pipeline,
+                    str(s.index),
+                    s.kind,
+                    f"{s.wall:.2f}s",
+                    "cached" if s.cached else f"{s.cpu:.2f}s",
+                    "-" if s.cached else _format_rss(s.max_rss_kb),
+                )
+            )
+        rows.append((r.pipeline, "total", "", f"{r.wall:.2f}s", "", ""))
+
+    widths = [
+        max([len(headers[i]), *(len(row[i]) for row in rows)])
+        for i in range(len(headers))
+    ]
+    return "\n".join(
+        "  ".join(cell.ljust(w) for cell, w in zip(row, widths, strict=True)).rstrip()
+        for row in [headers, *rows]
+    )
+
+
+def timings_payload(results: list[PipelineResult]) -> list[dict[str, Any]]:
+    """Return timings as JSON-serialisable data, one entry per pipeline run."""
+
+    return [
+        {
+            "pipeline": r.pipeline,
+            "output": str(r.output_path),
+            "cached": r.cached,
+            "wall": r.wall,
+            "steps": [asdict(s) for s in r.steps],
+        }
+        for r in results
+    ]
+
+
+def write_timings_json(path: Path, results: list[PipelineResult]) -> None:
+    path = path.expanduser()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(
+        json.dumps(timings_payload(results), indent=2) + "\n", encoding="utf-8"
+    )
@@ -0,0 +1,222 @@
+"""Resolve pipeline executables once and remember what they are.
+
+A toolchain manifest maps each tool name to its resolved path, size, mtime
+and `--version` line. Inside a repo it is kept in
+`.mcodex/cache/toolchain.json`, so later builds and `mcodex doctor` reuse it
+instead of scanning PATH and running `--version` again. The manifest is
+dropped when PATH or the mtime of a PATH directory changes (a tool was
+installed or removed), and a single entry is re-probed when its binary
+changes size or mtime.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any
+
+from mcodex.config import repo_cache_path
+from mcodex.errors import StepTimeoutError
+from mcodex.services.build_cache import ensure_cache_dir
+from mcodex.services.process import capture_command
+
+_SCHEMA = 1
+_MANIFEST_NAME = "toolchain.json"
+_PROBE_TIMEOUT = 10.0
+
+_STEP_EXECUTABLES: dict[str, tuple[str, ...]] = {
+    "pandoc": ("pandoc",),
+    "vlna": ("vlna",),
+    "latexmk": ("latexmk",),
+}
+
+
+@dataclass(frozen=True)
+class Tool:
+    name: str
+    # None when the tool is not on PATH.
+    path: str | None
+    size: int = 0
+    mtime_ns: int = 0
+    # First line of `<tool> --version`, "" when it could not be determined.
+    version: str = ""
+
+    @property
+    def fingerprint(self) -> str:
+        """Identity for cache keys; changes when the tool does."""
+
+        if self.path is None:
+            return "missing"
+        return f"{self.path}:{self.size}:{self.mtime_ns}:{self.version}"
+
+
+def step_executables(steps: list[dict[str, Any]]) -> list[str]:
+    """Names of the executables `steps` run, sorted."""
+
+    names: set[str] = set()
+    for step in steps:
+        kind = str(step.get("kind") or "").strip()
+        names.update(_STEP_EXECUTABLES.get(kind, ()))
+        if kind == "latexmk":
+            names.add(str(step.get("engine") or "lualatex").strip())
+    return sorted(names)
+
+
+def _path_state() -> dict[str, Any]:
+    path = os.environ.get("PATH", os.defpath)
+    dirs: dict[str, int] = {}
+    for entry in path.split(os.pathsep):
+        try:
+            dirs[entry] = os.stat(entry or ".").st_mtime_ns
+        except OSError:
+            dirs[entry] = 0
+    return {"path": path, "dirs": dirs}
+
+
+def _probe_version(path: str) -> str:
+    try:
+        completed = capture_command([path, "--version"], timeout=_PROBE_TIMEOUT)
+    except (OSError, StepTimeoutError):
+        return ""
+    if completed.returncode != 0:
+        return ""
+    for line in (completed.stdout + "\n" + completed.stderr).splitlines():
+        if line.strip():
+            return line.strip()
+    return ""
+
+
+def _probe(name: str) -> Tool:
+    path = shutil.which(name)
+    if path is None:
+        return Tool(name=name, path=None)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return Tool(name=name, path=path)
+    return Tool(
+        name=name,
+        path=path,
+        size=st.st_size,
+        mtime_ns=st.st_mtime_ns,
+        version=_probe_version(path),
+    )
+
+
+def _unchanged(tool: Tool) -> bool:
+    if tool.path is None:
+        return False
+    try:
+        st = os.stat(tool.path)
+    except OSError:
+        return False
+    return st.st_size == tool.size and st.st_mtime_ns == tool.mtime_ns
+
+
+class Toolchain:
+    """Resolved executables, shared by all builds of a process."""
+
+    def __init__(self, repo_root: Path | None) -> None:
+        self._repo_root = repo_root
+        self._lock = threading.Lock()
+        self._env: dict[str, Any] = {}
+        self._tools: dict[str, Tool] = {}
+
+    @property
+    def manifest_path(self) -> Path | None:
+        if self._repo_root is None:
+            return None
+        return repo_cache_path(self._repo_root) / _MANIFEST_NAME
+
+    def _load(self) -> None:
+        manifest = self.manifest_path
+        if manifest is None or not manifest.is_file():
+            return
+        try:
+            data = json.loads(manifest.read_text(encoding="utf-8"))
+            if data.get("schema") != _SCHEMA or data.get("env") != self._env:
+                return
+            self._tools = {name: Tool(**entry) for name, entry in data["tools"].items()}
+        except (OSError, ValueError, TypeError, KeyError, AttributeError):
+            self._tools = {}
+
+    def _save(self) -> None:
+        if self._repo_root is None:
+            return
+        manifest = ensure_cache_dir(self._repo_root) / _MANIFEST_NAME
+        payload = {
+            "schema": _SCHEMA,
+            "env": self._env,
+            "tools": {name: asdict(t) for name, t in sorted(self._tools.items())},
+        }
+        tmp = manifest.with_name(f".{manifest.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(payload, indent=2) + "\n", encoding="utf-8")
+        os.replace(tmp, manifest)
+
+    def revalidate(self) -> None:
+        """Forget every tool if PATH changed since the manifest was written."""
+
+        env = _path_state()
+        with self._lock:
+            if env != self._env:
+                self._env = env
+                self._tools = {}
+                self._load()
+
+    def get(self, name: str, *, refresh: bool = False) -> Tool:
+        with self._lock:
+            tool = self._tools.get(name)
+            if tool is not None and not refresh and _unchanged(tool):
+                return tool
+            tool = _probe(name)
+            # Tools that are missing or cannot be stat'ed are looked up again
+            # next time rather than remembered.
+            if _unchanged(tool):
+                self._tools[name] = tool
+                self._save()
+            return tool
+
+    def require(self, name: str) -> str:
+        """Return the path of `name`, or raise if it is not installed."""
+
+        tool = self.get(name)
+        if tool.path is None:
+            raise RuntimeError(
+                f"Required executable not found: {name}. "
+                "Install it and ensure it is on PATH."
+            )
+        return tool.path
+
+    def fingerprints(self, steps: list[dict[str, Any]]) -> dict[str, str]:
+        """Identify the executables `steps` would run, for cache keys."""
+
+        return {name: self.get(name).fingerprint for name in step_executables(steps)}
+
+    def versions(self, steps: list[dict[str, Any]]) -> dict[str, str]:
+        """Version line of each executable `steps` would run."""
+
+        return {
+            name: tool.version if tool.path is not None else "missing"
+            for name in step_executables(steps)
+            for tool in [self.get(name)]
+        }
+
+
+_toolchains: dict[Path | None, Toolchain] = {}
+_toolchains_lock = threading.Lock()
+
+
+def load_toolchain(repo_root: Path | None) -> Toolchain:
+    """Return the process-wide toolchain of `repo_root` (None: no manifest)."""
+
+    key = repo_root.expanduser().resolve() if repo_root is not None else None
+    with _toolchains_lock:
+        toolchain = _toolchains.get(key)
+        if toolchain is None:
+            toolchain = _toolchains[key] = Toolchain(key)
+    toolchain.revalidate()
+    return toolchain
@@ -0,0 +1,354 @@
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import multiprocessing
+import os
+import select
+import signal
+import struct
+import sys
+import time
+from collections.abc import Callable, Iterable
+from datetime import datetime
+from pathlib import Path
+from types import FrameType
+from typing import Protocol
+
+from mcodex.config import RepoConfigNotFoundError, find_repo_root
+from mcodex.services.build import build_pipelines
+from mcodex.services.process import KILL_GRACE, cancel_running_commands
+
+# inotify(7) constants.
+_IN_MODIFY = 0x00000002
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_MOVE_SELF = 0x00000800
+_IN_ISDIR = 0x40000000
+
+_WATCH_MASK = (
+    _IN_MODIFY
+    | _IN_ATTRIB
+    | _IN_CLOSE_WRITE
+    | _IN_MOVED_FROM
+    | _IN_MOVED_TO
+    | _IN_CREATE
+    | _IN_DELETE
+    | _IN_DELETE_SELF
+    | _IN_MOVE_SELF
+)
+_EVENT_HEADER = struct.Struct("iIII")
+
+DEFAULT_DEBOUNCE = 0.3
+# How long a cancelled build gets to kill its tools and remove its files.
+_CLEANUP_TIMEOUT = 3 * KILL_GRACE
+DEFAULT_POLL_INTERVAL = 0.5
+
+
+class Watcher(Protocol):
+    def wait(self, timeout: float | None) -> bool:
+        """Block until something changed (True) or `timeout` expired (False)."""
+        ...
+
+    def close(self) -> None: ...
+
+
+def _is_ignored(name: str) -> bool:
+    # Hidden entries (.snapshot, editor swap files) and backup files.
+    return name.startswith(".") or name.endswith("~")
+
+
+def watch_roots(text_dir: Path) -> list[tuple[Path, bool]]:
+    """Return `(directory, recursive)` pairs that affect a build of `text_dir`.
+
+    The text directory itself is watched non-recursively (so `.snapshot/` is
+    ignored); `.mcodex/templates/` is watched recursively inside a repo.
+    """
+
+    tdir = text_dir.expanduser().resolve()
+    roots: list[tuple[Path, bool]] = [(tdir, False)]
+    try:
+        repo_root = find_repo_root(tdir)
+    except RepoConfigNotFoundError:
+        return roots
+
+    templates = repo_root / ".mcodex" / "templates"
+    if templates.is_dir():
+        roots.append((templates, True))
+    return roots
+
+
+def _iter_dirs(root: Path, recursive: bool) -> Iterable[Path]:
+    yield root
+    if not recursive:
+        return
+    for dirpath, dirnames, _ in os.walk(root):
+        dirnames[:] = [d for d in dirnames if not _is_ignored(d)]
+        for d in dirnames:
+            yield Path(dirpath) / d
+
+
+class PollingWatcher:
+    """Portable watcher comparing file sizes and mtimes at a fixed interval."""
+
+    def __init__(
+        self,
+        roots: list[tuple[Path, bool]],
+        *,
+        interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        self._roots = roots
+        self._interval = interval
+        self._state = self._scan()
+
+    def _scan(self) -> dict[Path, tuple[int, int]]:
+        state: dict[Path, tuple[int, int]] = {}
+        for root, recursive in self._roots:
+            for d in _iter_dirs(root, recursive):
+                try:
+                    entries = list(os.scandir(d))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if _is_ignored(entry.name) or not entry.is_file():
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    state[Path(entry.path)] = (st.st_size, st.st_mtime_ns)
+        return state
+
+    def wait(self, timeout: float | None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            current = self._scan()
+            if current != self._state:
+                self._state = current
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(self._interval, remaining))
+            else:
+                time.sleep(self._interval)
+
+    def close(self) -> None:
+        return None
+
+
+class InotifyWatcher:
+    """Linux watcher using inotify(7) through ctypes."""
+
+    def __init__(self, roots: list[tuple[Path, bool]]) -> None:
+        libc_name = ctypes.util.find_library("c") or "libc.so.6"
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd: int = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_init1 failed: {os.strerror(err)}")
+
+        self._recursive: dict[int, bool] = {}
+        self._paths: dict[int, Path] = {}
+        try:
+            for root, recursive in roots:
+                for d in _iter_dirs(root, recursive):
+                    self._add(d, recursive)
+        except OSError:
+            self.close()
+            raise
+
+    def _add(self, directory: Path, recursive: bool) -> None:
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, f"inotify_add_watch failed for {directory}")
+        self._recursive[wd] = recursive
+        self._paths[wd] = directory
+
+    def wait(self, timeout: float | None) -> bool:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        return self._drain()
+
+    def _drain(self) -> bool:
+        changed = False
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return False
+
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            raw_name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+
+            name = os.fsdecode(raw_name)
+            if name and _is_ignored(name):
+                continue
+            changed = True
+
+            if (
+                mask & _IN_ISDIR
+                and mask & (_IN_CREATE | _IN_MOVED_TO)
+                and self._recursive.get(wd)
+            ):
+                new_dir = self._paths[wd] / name
+                if new_dir.is_dir():
+                    self._add(new_dir, True)
+
+        return changed
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def make_watcher(text_dir: Path) -> Watcher:
+    """Use inotify where available and fall back to polling otherwise."""
+
+    roots = watch_roots(text_dir)
+    if sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(roots)
+
+
+def _debounce(watcher: Watcher, quiet: float) -> None:
+    """Swallow further events until nothing happened for `quiet` seconds."""
+
+    while watcher.wait(quiet):
+        pass
+
+
+def _cancel_build(signum: int, frame: FrameType | None) -> None:
+    signal.signal(signum, signal.SIG_IGN)
+    cancel_running_commands()
+    # Unwind instead of dying, so the build removes its scratch directory
+    # and any half-written output.
+    raise SystemExit(128 + signum)
+
+
+def _build_in_child(
+    text_dir: Path,
+    ref: str,
+    pipelines: list[str],
+    use_cache: bool,
+    persistent: bool,
+) -> None:
+    # Own process group, so a cancel also reaches helpers such as git. The
+    # tools run in sessions of their own (see process.py) and are killed by
+    # the handler.
+    os.setpgrp()
+    signal.signal(signal.SIGTERM, _cancel_build)
+    try:
+        outs = build_pipelines(
+            text_dir=text_dir,
+            ref=ref,
+            pipelines=pipelines,
+            use_cache=use_cache,
+            persistent=persistent,
+            jobs=1,
+        )
+    except Exception as e:
+        print(str(e), file=sys.stderr, flush=True)
+        raise SystemExit(2) from None
+    for out in outs:
+        print(out, flush=True)
+
+
+def _cancel(proc: multiprocessing.Process) -> None:
+    if proc.pid is not None and proc.is_alive():
+        try:
+            os.killpg(proc.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            proc.terminate()
+        # The child stops its tools and cleans up; a stuck one is killed.
+        proc.join(_CLEANUP_TIMEOUT)
+        if proc.is_alive():
+            proc.kill()
+    proc.join()
+
+
+def _stamp() -> str:
+    return datetime.now().strftime("%H:%M:%S")
+
+
+def watch(
+    *,
+    text_dir: Path,
+    ref: str = ".",
+    pipelines: list[str],
+    use_cache: bool = True,
+    persistent: bool = False,
+    debounce: float = DEFAULT_DEBOUNCE,
+    watcher: Watcher | None = None,
+    log: Callable[[str], None] = print,
+) -> None:
+    """Rebuild `text_dir` whenever its sources or the repo templates change.
+
+    Bursts of writes are debounced. A change that lands while a build is
+    running cancels that build (including its tool subprocesses) and starts a
+    new one. Runs until interrupted.
+    """
+
+    tdir = text_dir.expanduser().resolve()
+    w = watcher or make_watcher(tdir)
+    proc: multiprocessing.Process | None = None
+    started = 0.0
+
+    def _start() -> multiprocessing.Process:
+        p = multiprocessing.Process(
+            target=_build_in_child,
+            args=(tdir, ref, pipelines, use_cache, persistent),
+            daemon=True,
+        )
+        p.start()
+        if p.pid is not None:
+            # Also set from the parent to close the race with os.setpgrp().
+            try:
+                os.setpgid(p.pid, p.pid)
+            except OSError:
+                pass
+        return p
+
+    log(f"[{_stamp()}] watching {tdir} (Ctrl-C to stop)")
+    try:
+        proc = _start()
+        started = time.monotonic()
+        while True:
+            changed = w.wait(0.2 if proc is not None else None)
+
+            if proc is not None and not proc.is_alive():
+                elapsed = time.monotonic() - started
+                status = "built" if proc.exitcode == 0 else "build failed"
+                log(f"[{_stamp()}] {status} in {elapsed:.2f}s")
+                proc = None
+
+            if not changed:
+                continue
+
+            _debounce(w, debounce)
+            if proc is not None and proc.is_alive():
+                _cancel(proc)
+                log(f"[{_stamp()}] change detected, previous build cancelled")
+            else:
+                log(f"[{_stamp()}] change detected, rebuilding")
+            proc = _start()
+            started = time.monotonic()
+    finally:
+        if proc is not None:
+            _cancel(proc)
+        w.close()
@@ -0,0 +1,184 @@
+"""Chrome trace-event recording for a whole mcodex command.
+
+Enabled by `MCODEX_TRACE=<file>` or `--trace=<file>`. Spans are recorded as
+complete ("X") events and written as trace-event JSON on `finish()`, ready
+for chrome://tracing or https://ui.perfetto.dev. Worker processes inherit the
+setting through the environment and append their spans to `<file>.<pid>.part`
+files, which the owning process merges into the final trace.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, ParamSpec, TypeVar
+
+ENV_VAR = "MCODEX_TRACE"
+_OWNER_ENV_VAR = "MCODEX_TRACE_OWNER"
+
+P = ParamSpec("P")
+R = TypeVar("R")
+
+_lock = threading.Lock()
+_events: list[dict[str, Any]] = []
+_local = threading.local()
+_path: Path | None = None
+_owner_pid: int | None = None
+
+
+def start(path: Path) -> None:
+    """Start recording spans of this process (and its workers) for `path`."""
+
+    global _path, _owner_pid
+    _path = path.expanduser().resolve()
+    _owner_pid = os.getpid()
+    os.environ[ENV_VAR] = str(_path)
+    os.environ[_OWNER_ENV_VAR] = str(_owner_pid)
+    for stale in _part_files(_path):
+        stale.unlink(missing_ok=True)
+
+
+def enabled() -> bool:
+    return _path is not None
+
+
+def _part_files(path: Path) -> list[Path]:
+    return sorted(path.parent.glob(f"{path.name}.*.part"))
+
+
+def _depth() -> int:
+    # A forked worker inherits the forking thread's nesting; start over.
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.depth = 0
+    depth: int = _local.depth
+    return depth
+
+
+def _now_us() -> float:
+    # CLOCK_MONOTONIC is system-wide, so worker timestamps line up.
+    return time.monotonic_ns() / 1000
+
+
+@contextmanager
+def span(name: str, cat: str = "mcodex", **args: Any) -> Iterator[None]:
+    """Record the duration of the enclosed block; free when tracing is off."""
+
+    if _path is None:
+        yield
+        return
+
+    depth = _depth()
+    _local.depth = depth + 1
+    begin = _now_us()
+    try:
+        yield
+    finally:
+        _local.depth = depth
+        event: dict[str, Any] = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": begin,
+            "dur": _now_us() - begin,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+        }
+        if args:
+            event["args"] = {k: str(v) for k, v in args.items()}
+        with _lock:
+            _events.append(event)
+        if depth == 0 and os.getpid() != _owner_pid:
+            _flush_part()
+
+
+def traced(
+    name: str, cat: str = "mcodex"
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Decorator form of `span`."""
+
+    def decorator(fn: Callable[P, R]) -> Callable[P, R]:
+        @functools.wraps(fn)
+        def wrapper(*args: P.args, **kwargs: P.kwargs) -> R:
+            if _path is None:
+                return fn(*args, **kwargs)
+            with span(name, cat):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def _take_own_events() -> list[dict[str, Any]]:
+    # Forked workers inherit the parent's buffer; keep only our own events.
+    pid = os.getpid()
+    with _lock:
+        mine = [e for e in _events if e["pid"] == pid]
+        _events.clear()
+    return mine
+
+
+def _flush_part() -> None:
+    assert _path is not None
+    events = _take_own_events()
+    if not events:
+        return
+    part = _path.with_name(f"{_path.name}.{os.getpid()}.part")
+    with part.open("a", encoding="utf-8") as f:
+        for event in events:
+            f.write(json.dumps(event) + "\n")
+
+
+def finish() -> Path | None:
+    """Write the trace file (owner process only) and stop recording."""
+
+    global _path
+    path = _path
+    if path is None:
+        return None
+    if os.getpid() != _owner_pid:
+        _flush_part()
+        return None
+
+    events = _take_own_events()
+    parts = _part_files(path)
+    for part in parts:
+        for line in part.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                events.append(json.loads(line))
+
+    events.sort(key=lambda e: e["ts"])
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(
+        json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}) + "\n",
+        encoding="utf-8",
+    )
+    os.replace(tmp, path)
+    for part in parts:
+        part.unlink(missing_ok=True)
+
+    _path = None
+    os.environ.pop(ENV_VAR, None)
+    os.environ.pop(_OWNER_ENV_VAR, None)
+    return path
+
+
+def _init_from_env() -> None:
+    # Worker processes started with "spawn" re-import this module.
+    global _path, _owner_pid
+    raw = os.environ.get(ENV_VAR)
+    owner = os.environ.get(_OWNER_ENV_VAR)
+    if raw and owner and owner.isdigit():
+        _path = Path(raw)
+        _owner_pid = int(owner)
+
+
+_init_from_env()
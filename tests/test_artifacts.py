@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services import toolchain as toolchain_mod
+from mcodex.services.artifacts import (
+    ArtifactRecord,
+    append_records,
+    artifacts_list,
+    latest_records,
+    manifest_path,
+)
+from mcodex.services.build import build_pipeline_results
+
+
+@pytest.fixture
+def repo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(toolchain_mod, "_toolchains", {})
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pandoc = bin_dir / "pandoc"
+    pandoc.write_text(
+        "#!/bin/sh\n"
+        'if [ "$1" = --version ]; then echo "pandoc 3.1"; exit 0; fi\n'
+        'while [ $# -gt 0 ]; do [ "$1" = -o ] && out="$2"; shift; done\n'
+        'echo built > "$out"\n',
+        encoding="utf-8",
+    )
+    pandoc.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+
+    repo_root = tmp_path / "repo"
+    (repo_root / ".mcodex").mkdir(parents=True)
+    (repo_root / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "pipelines": {
+                    "docx": {
+                        "steps": [{"kind": "pandoc", "from": "markdown", "to": "docx"}]
+                    }
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    text_dir = repo_root / "text_story"
+    text_dir.mkdir()
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    (text_dir / "metadata.yaml").write_text(
+        yaml.safe_dump(
+            {"metadata_version": 1, "id": "x", "title": "T", "slug": "story"}
+        ),
+        encoding="utf-8",
+    )
+    return repo_root
+
+
+def test_builds_append_to_the_manifest(repo: Path) -> None:
+    text_dir = repo / "text_story"
+    build_pipeline_results(text_dir=text_dir, ref=".", pipelines=["docx"])
+    build_pipeline_results(text_dir=text_dir, ref=".", pipelines=["docx"])
+
+    artifacts = repo / "artifacts"
+    lines = manifest_path(artifacts).read_text(encoding="utf-8").splitlines()
+    first, second = (json.loads(line) for line in lines)
+    assert first["path"] == "story_worktree.docx"
+    assert first["text"] == "story"
+    assert first["version"] == "worktree"
+    assert first["pipeline"] == "docx"
+    assert first["tools"] == {"pandoc": "pandoc 3.1"}
+    assert first["size"] == len("built\n")
+    assert len(first["source_digest"]) == 64
+    assert not first["cached"]
+    assert second["cached"]
+    assert second["source_digest"] == first["source_digest"]
+
+    (latest,) = latest_records(artifacts)
+    assert latest.cached
+
+
+def test_torn_and_foreign_lines_are_skipped(tmp_path: Path) -> None:
+    record = ArtifactRecord(
+        path="a.pdf",
+        text="a",
+        version="v1",
+        pipeline="pdf",
+        source_digest="d",
+        built_at="2026-01-01T00:00:00+00:00",
+    )
+    append_records(tmp_path, [record])
+    with manifest_path(tmp_path).open("a", encoding="utf-8") as f:
+        f.write('{"unknown": 1}\n{"path": "b.pdf", "te')
+
+    assert latest_records(tmp_path) == [record]
+
+    later = ArtifactRecord(**{**record.__dict__, "path": "c.pdf"})
+    append_records(tmp_path, [later])
+    assert latest_records(tmp_path) == [record, later]
+
+
+def test_list_reads_only_the_manifest(
+    repo: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    build_pipeline_results(text_dir=repo / "text_story", ref=".", pipelines=["docx"])
+    (repo / "artifacts" / "story_worktree.docx").unlink()
+    monkeypatch.chdir(repo)
+
+    artifacts_list()
+    out = capsys.readouterr().out.splitlines()
+    assert out[0].split() == [
+        "ARTIFACT",
+        "TEXT",
+        "VERSION",
+        "PIPELINE",
+        "BUILT",
+        "WALL",
+        "SOURCE",
+    ]
+    assert out[1].startswith("story_worktree.docx  story  worktree  docx")
+
+    artifacts_list(as_json=True)
+    (entry,) = json.loads(capsys.readouterr().out)
+    assert entry["tools"] == {"pandoc": "pandoc 3.1"}
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import fcntl
+import os
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services.artifacts import ArtifactRecord, append_records, latest_records
+from mcodex.services.artifacts_gc import (
+    IN_USE_GRACE,
+    artifacts_gc,
+    collect_garbage,
+    parse_size,
+)
+from mcodex.services.build_cache import cached_artifact, store_artifact
+
+DAY = 86400.0
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo_root = tmp_path / "repo"
+    (repo_root / ".mcodex").mkdir(parents=True)
+    (repo_root / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump({"gc": {"protect_stage": "rc"}}), encoding="utf-8"
+    )
+    return repo_root
+
+
+def _artifact(repo: Path, text: str, version: str, *, age_days: float) -> Path:
+    """A 1000-byte artifact with a log, built `age_days` ago."""
+
+    artifacts = repo / "artifacts"
+    path = artifacts / f"{text}_{version}.pdf"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x" * 1000)
+    log = artifacts / "logs" / f"{text}_{version}" / "pdf" / "0-pandoc.log"
+    log.parent.mkdir(parents=True)
+    log.write_bytes(b"l" * 100)
+
+    built = time.time() - age_days * DAY
+    for p in (path, log):
+        os.utime(p, (built, built))
+    append_records(
+        artifacts,
+        [
+            ArtifactRecord(
+                path=path.name,
+                text=text,
+                version=version,
+                pipeline="pdf",
+                source_digest="d",
+                built_at=datetime.fromtimestamp(built, UTC).isoformat(),
+            )
+        ],
+    )
+    return path
+
+
+def test_evicts_least_recently_used_until_within_budget(repo: Path) -> None:
+    oldest = _artifact(repo, "a", "draft-1", age_days=3)
+    older = _artifact(repo, "b", "worktree", age_days=2)
+    newest = _artifact(repo, "a", "worktree", age_days=1)
+
+    report = collect_garbage(repo_root=repo, max_size=1500)
+
+    assert report.evicted == [oldest.name, older.name]
+    assert report.reclaimed == 2200
+    assert report.size_after == 1100
+    assert not oldest.exists() and not older.exists() and newest.exists()
+    assert not (repo / "artifacts" / "logs" / "a_draft-1").exists()
+    assert [r.path for r in latest_records(repo / "artifacts")] == [newest.name]
+
+
+def test_protected_stages_kept_latest_and_fresh_builds_survive(repo: Path) -> None:
+    rc = _artifact(repo, "a", "rc-1", age_days=5)
+    final = _artifact(repo, "a", "final-1", age_days=5)
+    draft = _artifact(repo, "a", "draft-1", age_days=6)
+    latest_b = _artifact(repo, "b", "worktree", age_days=3)
+    fresh = _artifact(repo, "c", "worktree", age_days=IN_USE_GRACE / DAY / 2)
+
+    report = collect_garbage(repo_root=repo, max_size=0, keep_latest_per_text=1)
+
+    assert report.evicted == [draft.name]
+    assert report.size_after > report.max_size
+    assert rc.exists() and final.exists() and latest_b.exists() and fresh.exists()
+
+
+def test_cache_entries_are_evicted_by_last_hit(repo: Path) -> None:
+    src = repo / "out.pdf"
+    src.write_bytes(b"c" * 500)
+    for key in ("aa" * 32, "bb" * 32):
+        store_artifact(repo_root=repo, key=key, artifact=src, tools={"pandoc": "3"})
+    old = time.time() - DAY
+    for entry in (repo / ".mcodex" / "cache" / "builds").rglob("*"):
+        os.utime(entry, (old, old))
+    # A hit makes an entry recently used again.
+    assert cached_artifact(repo_root=repo, key="aa" * 32) is not None
+
+    report = collect_garbage(
+        repo_root=repo, max_size=0, now=time.time() + 2 * IN_USE_GRACE
+    )
+
+    assert report.evicted_cache_entries == 2
+    assert report.size_after == 0
+    assert cached_artifact(repo_root=repo, key="bb" * 32) is None
+    assert not list((repo / ".mcodex" / "cache" / "builds").rglob("*.tools.json"))
+
+
+def test_persistent_latex_workdirs_are_evicted_by_last_build(repo: Path) -> None:
+    work = repo / ".mcodex" / "cache" / "work"
+    dirs = {}
+    for age_days, name in ((3, "text_a"), (1, "text_b")):
+        workdir = work / name / "pdf"
+        workdir.mkdir(parents=True)
+        (workdir / "main.aux").write_bytes(b"a" * 400)
+        (workdir / ".lock").write_text("", encoding="utf-8")
+        built = time.time() - age_days * DAY
+        for p in (workdir / "main.aux", workdir / ".lock", workdir):
+            os.utime(p, (built, built))
+        dirs[name] = workdir
+
+    report = collect_garbage(repo_root=repo, max_size=500)
+
+    assert report.size_before == 800
+    assert report.evicted_cache_entries == 1
+    assert report.size_after == 400
+    assert not dirs["text_a"].exists() and dirs["text_b"].is_dir()
+
+
+def test_latex_workdir_of_running_build_is_kept(repo: Path) -> None:
+    work = repo / ".mcodex" / "cache" / "work"
+    for age_days, name in ((3, "text_a"), (2, "text_b")):
+        workdir = work / name / "pdf"
+        workdir.mkdir(parents=True)
+        (workdir / "main.aux").write_bytes(b"a" * 400)
+        (workdir / ".lock").write_text("", encoding="utf-8")
+        built = time.time() - age_days * DAY
+        for p in (workdir / "main.aux", workdir / ".lock", workdir):
+            os.utime(p, (built, built))
+
+    # A build has held text_a's lock for longer than the grace period.
+    with (work / "text_a" / "pdf" / ".lock").open("r") as held:
+        fcntl.flock(held, fcntl.LOCK_EX)
+        report = collect_garbage(repo_root=repo, max_size=500)
+
+    assert report.evicted_cache_entries == 1
+    assert (work / "text_a" / "pdf" / "main.aux").exists()
+    assert not (work / "text_b" / "pdf").exists()
+
+
+def test_replaced_artifact_is_not_deleted(
+    repo: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    path = _artifact(repo, "a", "draft-1", age_days=3)
+
+    from mcodex.services import artifacts_gc as gc_mod
+
+    real_evict = gc_mod._evict
+
+    def evict_after_rebuild(unit: object, *, roots: list[Path]) -> int:
+        path.write_bytes(b"rebuilt")
+        return real_evict(unit, roots=roots)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(gc_mod, "_evict", evict_after_rebuild)
+    report = collect_garbage(repo_root=repo, max_size=0)
+
+    assert report.evicted == []
+    assert path.read_bytes() == b"rebuilt"
+    assert [r.path for r in latest_records(repo / "artifacts")] == [path.name]
+
+
+def test_parse_size_and_report(
+    repo: Path, monkeypatch: pytest.MonkeyPatch, capsys: pytest.CaptureFixture[str]
+) -> None:
+    assert parse_size("1048576") == 1 << 20
+    assert parse_size("500M") == 500 << 20
+    assert parse_size("2GiB") == 2 << 30
+    with pytest.raises(ValueError, match="Invalid size"):
+        parse_size("lots")
+
+    _artifact(repo, "a", "draft-1", age_days=3)
+    monkeypatch.chdir(repo)
+    artifacts_gc(max_size=0)
+    out = capsys.readouterr().out
+    assert "Evicted: a_draft-1.pdf" in out
+    assert "Reclaimed 1.1 KiB (1100 bytes)" in out
@@ -1,12 +1,17 @@
 from __future__ import annotations
 
-import subprocess
 from pathlib import Path
 
 import pytest
 import yaml
 
-from mcodex.services.build import build_pdf
+from mcodex.services import build as build_mod
+from mcodex.services.build import (
+    build_pdf,
+    build_pipeline_results,
+    build_pipelines,
+    resolve_pipeline_names,
+)
 
 
 def _write_min_text_dir(text_dir: Path) -> None:
@@ -35,15 +40,8 @@ def test_build_pdf_worktree(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) ->
 
     monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
 
-    def fake_run(
-        cmd: list[str],
-        cwd: str | None = None,
-        text: bool | None = None,
-        capture_output: bool | None = None,
-        check: bool | None = None,
-    ) -> subprocess.CompletedProcess[str]:
-        _ = text, capture_output, check
-        cwd_path = Path(cwd or ".")
+    def fake_run(cmd: list[str], cwd: Path, **options: object) -> None:
+        cwd_path = cwd
 
         if cmd and cmd[0].endswith("pandoc"):
             out = Path(cmd[cmd.index("-o") + 1])
@@ -58,9 +56,7 @@ def test_build_pdf_worktree(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) ->
         if cmd and cmd[0].endswith("latexmk"):
             (cwd_path / "main.pdf").write_text("%PDF", encoding="utf-8")
 
-        return subprocess.CompletedProcess(cmd, 0, stdout="", stderr="")
-
-    monkeypatch.setattr("subprocess.run", fake_run)
+    monkeypatch.setattr("mcodex.services.pipeline.run_command", fake_run)
 
     out = build_pdf(text_dir=tdir, version=".")
 
@@ -84,15 +80,8 @@ def test_build_pdf_snapshot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) ->
 
     monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
 
-    def fake_run(
-        cmd: list[str],
-        cwd: str | None = None,
-        text: bool | None = None,
-        capture_output: bool | None = None,
-        check: bool | None = None,
-    ) -> subprocess.CompletedProcess[str]:
-        _ = text, capture_output, check
-        cwd_path = Path(cwd or ".")
+    def fake_run(cmd: list[str], cwd: Path, **options: object) -> None:
+        cwd_path = cwd
 
         if cmd and cmd[0].endswith("pandoc"):
             out = Path(cmd[cmd.index("-o") + 1])
@@ -107,9 +96,7 @@ def test_build_pdf_snapshot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) ->
         if cmd and cmd[0].endswith("latexmk"):
             (cwd_path / "main.pdf").write_text("%PDF", encoding="utf-8")
 
-        return subprocess.CompletedProcess(cmd, 0, stdout="", stderr="")
-
-    monkeypatch.setattr("subprocess.run", fake_run)
+    monkeypatch.setattr("mcodex.services.pipeline.run_command", fake_run)
 
     out = build_pdf(text_dir=tdir, version="draft-1")
 
@@ -117,3 +104,88 @@ def test_build_pdf_snapshot(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) ->
     assert out.name == "story_draft-1.pdf"
     assert out.parent.name == "artifacts"
     assert out.parent.parent == tmp_path
+
+
+def test_build_pipelines_produces_one_artifact_per_pipeline(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tdir = tmp_path / "story"
+    _write_min_text_dir(tdir)
+
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+
+    contexts: list[str] = []
+
+    def fake_run(cmd: list[str], cwd: Path, **options: object) -> None:
+        meta = next(a for a in cmd if a.startswith("--metadata-file="))
+        contexts.append(Path(meta.split("=", 1)[1]).read_text(encoding="utf-8"))
+        out = Path(cmd[cmd.index("-o") + 1])
+        out.write_text(cmd[cmd.index("-o") - 1], encoding="utf-8")
+
+    monkeypatch.setattr("mcodex.services.pipeline.run_command", fake_run)
+
+    outs = build_pipelines(
+        text_dir=tdir,
+        ref=".",
+        pipelines=["docx", "latex", "pdf_pandoc"],
+        jobs=1,
+    )
+
+    assert [p.name for p in outs] == [
+        "story_worktree.docx",
+        "story_worktree.tex",
+        "story_worktree.pdf",
+    ]
+    assert all(p.exists() for p in outs)
+
+    built_at = {yaml.safe_load(c)["build"]["built_at"] for c in contexts}
+    assert len(built_at) == 1
+
+
+def test_resolve_pipeline_names_expands_lists_and_all(tmp_path: Path) -> None:
+    tdir = tmp_path / "story"
+    _write_min_text_dir(tdir)
+
+    assert resolve_pipeline_names("pdf", text_dir=tdir) == ["pdf"]
+    assert resolve_pipeline_names(" pdf, DOCX ,pdf", text_dir=tdir) == [
+        "pdf",
+        "docx",
+    ]
+    assert set(resolve_pipeline_names("all", text_dir=tdir)) == {
+        "pdf",
+        "pdf_pandoc",
+        "docx",
+        "latex",
+    }
+
+
+def test_build_pipelines_disambiguates_shared_extensions() -> None:
+    names = build_mod._artifact_names(
+        slug="story", version_label="draft-1", pipelines=["pdf_pandoc", "pdf", "docx"]
+    )
+
+    assert names == {
+        "pdf_pandoc": "story_draft-1_pdf_pandoc.pdf",
+        "pdf": "story_draft-1.pdf",
+        "docx": "story_draft-1.docx",
+    }
+
+
+def test_build_logs_go_under_artifacts(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tdir = tmp_path / "story"
+    _write_min_text_dir(tdir)
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+    logs: list[object] = []
+
+    def fake_run(cmd: list[str], cwd: Path, **options: object) -> None:
+        logs.append(options.get("log"))
+        Path(cmd[cmd.index("-o") + 1]).write_text("docx", encoding="utf-8")
+
+    monkeypatch.setattr("mcodex.services.pipeline.run_command", fake_run)
+
+    (result,) = build_pipeline_results(text_dir=tdir, ref=".", pipelines=["docx"])
+
+    assert result.log_dir == tmp_path / "artifacts" / "logs" / "story_worktree" / "docx"
+    assert logs == [result.log_dir / "0-pandoc.log"]
@@ -0,0 +1,116 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services.build import resolve_ref_patterns
+from mcodex.services.build_batch import build_all, build_refs, format_build_reports
+from mcodex.services.texts import discover_text_dirs
+
+
+def _write_repo_config(repo_root: Path) -> None:
+    cfg = repo_root / ".mcodex" / "config.yaml"
+    cfg.parent.mkdir(parents=True, exist_ok=True)
+    cfg.write_text("{}\n", encoding="utf-8")
+
+
+def _write_text_dir(text_dir: Path, *, slug: str) -> None:
+    text_dir.mkdir(parents=True, exist_ok=True)
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    (text_dir / "metadata.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "metadata_version": 1,
+                "id": "x",
+                "title": "T",
+                "slug": slug,
+                "created_at": "2026-01-03T00:00:00+01:00",
+                "authors": [],
+            },
+            sort_keys=False,
+            allow_unicode=True,
+        ),
+        encoding="utf-8",
+    )
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo_root = tmp_path / "repo"
+    _write_repo_config(repo_root)
+    _write_text_dir(repo_root / "text_b", slug="b")
+    _write_text_dir(repo_root / "text_a", slug="a")
+    (repo_root / "text_c").mkdir()
+    (repo_root / "notes").mkdir()
+
+    snap = repo_root / "text_a" / ".snapshot" / "draft-1"
+    _write_text_dir(snap, slug="a")
+    return repo_root
+
+
+def test_discover_text_dirs_uses_prefix_and_metadata(repo: Path) -> None:
+    assert [p.name for p in discover_text_dirs(repo_root=repo)] == [
+        "text_a",
+        "text_b",
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_build_all_reports_each_text(repo: Path, jobs: int) -> None:
+    reports = build_all(repo_root=repo, ref=".", pipeline="noop", jobs=jobs)
+
+    assert [r.text_dir.name for r in reports] == ["text_a", "text_b"]
+    assert all(r.ok for r in reports)
+    assert (repo / "artifacts" / "a_worktree.pdf").exists()
+    assert (repo / "artifacts" / "b_worktree.pdf").exists()
+
+
+def test_build_all_failure_does_not_abort_others(repo: Path) -> None:
+    reports = build_all(repo_root=repo, ref="draft", pipeline="noop", jobs=1)
+
+    by_name = {r.text_dir.name: r for r in reports}
+    assert by_name["text_a"].ok
+    assert not by_name["text_b"].ok
+    assert by_name["text_b"].error == "Snapshot not found: draft"
+
+    table = format_build_reports(reports)
+    assert "FAILED" in table
+    assert "1/2 builds succeeded." in table
+
+
+def test_resolve_ref_patterns_expands_globs_and_stages(repo: Path) -> None:
+    tdir = repo / "text_a"
+    for label in ["draft-2", "draft-10", "rc-1", "rc-2", "sent"]:
+        _write_text_dir(tdir / ".snapshot" / label, slug="a")
+
+    assert resolve_ref_patterns(text_dir=tdir, patterns="draft-*,rc") == [
+        "draft-1",
+        "draft-2",
+        "draft-10",
+        "rc-2",
+    ]
+    assert resolve_ref_patterns(text_dir=tdir, patterns=".,sent,rc-1,rc-*") == [
+        ".",
+        "sent",
+        "rc-1",
+        "rc-2",
+    ]
+
+    with pytest.raises(FileNotFoundError, match="No snapshots match"):
+        resolve_ref_patterns(text_dir=tdir, patterns="final-*")
+    with pytest.raises(FileNotFoundError, match="Snapshot not found"):
+        resolve_ref_patterns(text_dir=tdir, patterns="final")
+
+
+def test_build_refs_builds_every_matching_snapshot(repo: Path) -> None:
+    tdir = repo / "text_a"
+    _write_text_dir(tdir / ".snapshot" / "draft-2", slug="a")
+
+    reports = build_refs(text_dir=tdir, refs="draft-*,.", pipeline="noop", jobs=2)
+
+    assert [r.ref for r in reports] == ["draft-1", "draft-2", "."]
+    assert all(r.ok for r in reports)
+    for name in ["a_draft-1.pdf", "a_draft-2.pdf", "a_worktree.pdf"]:
+        assert (repo / "artifacts" / name).exists()
@@ -0,0 +1,347 @@
+from __future__ import annotations
+
+from datetime import UTC, datetime
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services.pipeline import run_pipeline
+
+
+def _write_repo_config(repo_root: Path) -> None:
+    cfg_path = repo_root / ".mcodex" / "config.yaml"
+    cfg_path.parent.mkdir(parents=True, exist_ok=True)
+    cfg_path.write_text(
+        yaml.safe_dump(
+            {
+                "pipelines": {
+                    "docx": {
+                        "steps": [
+                            {"kind": "pandoc", "from": "markdown", "to": "docx"},
+                        ]
+                    },
+                    "pdf": {
+                        "steps": [
+                            {
+                                "kind": "pandoc",
+                                "from": "markdown",
+                                "to": "latex",
+                                "output": "body_raw.tex",
+                            },
+                            {
+                                "kind": "vlna",
+                                "input": "body_raw.tex",
+                                "output": "body.tex",
+                            },
+                            {"kind": "latexmk", "main": "main.tex"},
+                        ]
+                    },
+                }
+            },
+            sort_keys=False,
+        ),
+        encoding="utf-8",
+    )
+    latex = repo_root / ".mcodex" / "templates" / "latex"
+    latex.mkdir(parents=True, exist_ok=True)
+    (latex / "main.tex").write_text("\\input{body.tex}\n", encoding="utf-8")
+
+
+def _write_text_source(source_dir: Path) -> None:
+    source_dir.mkdir(parents=True, exist_ok=True)
+    (source_dir / "text.md").write_text("# Title\n", encoding="utf-8")
+    (source_dir / "metadata.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "metadata_version": 1,
+                "id": "x",
+                "title": "T",
+                "slug": "demo",
+                "created_at": "2026-01-03T00:00:00+01:00",
+                "authors": [],
+            },
+            sort_keys=False,
+            allow_unicode=True,
+        ),
+        encoding="utf-8",
+    )
+
+
+class _FakeRun:
+    def __init__(self) -> None:
+        self.calls: list[list[str]] = []
+
+    def __call__(self, cmd: list[str], cwd: Path) -> None:
+        self.calls.append(cmd)
+        tool = Path(cmd[0]).name
+        if tool == "pandoc":
+            out = Path(cmd[cmd.index("-o") + 1])
+        elif tool == "vlna":
+            out = Path(cmd[-1])
+        else:
+            out = cwd / "main.pdf"
+        out.write_text(f"build {len(self.calls)}", encoding="utf-8")
+
+    def tools(self) -> list[str]:
+        return [Path(c[0]).name for c in self.calls]
+
+
+@pytest.fixture
+def repo(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    repo_root = tmp_path / "repo"
+    _write_repo_config(repo_root)
+    _write_text_source(repo_root / "text_demo")
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+    return repo_root
+
+
+def test_unchanged_inputs_reuse_cached_artifact(repo: Path) -> None:
+    run = _FakeRun()
+    out = repo / "artifacts" / "demo_worktree.docx"
+
+    first = run_pipeline(
+        pipeline_name="docx", source_dir=repo / "text_demo", output_path=out, run=run
+    )
+    out.unlink()
+    second = run_pipeline(
+        pipeline_name="docx", source_dir=repo / "text_demo", output_path=out, run=run
+    )
+
+    assert not first.cached
+    assert second.cached
+    assert len(run.calls) == 1
+    assert out.read_text(encoding="utf-8") == "build 1"
+    assert (repo / ".mcodex" / "cache" / ".gitignore").exists()
+
+
+def test_changed_source_or_template_misses_cache(repo: Path) -> None:
+    run = _FakeRun()
+    src = repo / "text_demo"
+    out = repo / "artifacts" / "demo_worktree.docx"
+
+    run_pipeline(pipeline_name="docx", source_dir=src, output_path=out, run=run)
+
+    (src / "text.md").write_text("# Changed\n", encoding="utf-8")
+    result = run_pipeline(
+        pipeline_name="docx", source_dir=src, output_path=out, run=run
+    )
+    assert not result.cached
+
+    ref = repo / ".mcodex" / "templates" / "pandoc" / "reference.docx"
+    ref.parent.mkdir(parents=True, exist_ok=True)
+    ref.write_bytes(b"fake-docx")
+    result = run_pipeline(
+        pipeline_name="docx", source_dir=src, output_path=out, run=run
+    )
+    assert not result.cached
+    assert len(run.calls) == 3
+
+
+def test_use_cache_false_always_runs(repo: Path) -> None:
+    run = _FakeRun()
+    src = repo / "text_demo"
+    out = repo / "artifacts" / "demo_worktree.docx"
+
+    for _ in range(2):
+        result = run_pipeline(
+            pipeline_name="docx",
+            source_dir=src,
+            output_path=out,
+            run=run,
+            use_cache=False,
+        )
+        assert not result.cached
+
+    assert len(run.calls) == 2
+
+
+def test_template_change_reruns_only_latexmk(repo: Path) -> None:
+    run = _FakeRun()
+    src = repo / "text_demo"
+    out = repo / "artifacts" / "demo_worktree.pdf"
+
+    first = run_pipeline(pipeline_name="pdf", source_dir=src, output_path=out, run=run)
+    assert first.cached_steps == []
+    assert run.tools() == ["pandoc", "vlna", "latexmk"]
+
+    main = repo / ".mcodex" / "templates" / "latex" / "main.tex"
+    main.write_text("% new layout\n\\input{body.tex}\n", encoding="utf-8")
+
+    second = run_pipeline(pipeline_name="pdf", source_dir=src, output_path=out, run=run)
+
+    assert not second.cached
+    assert [s.kind for s in second.cached_steps] == ["pandoc", "vlna"]
+    assert run.tools() == ["pandoc", "vlna", "latexmk", "latexmk"]
+    assert len(second.commands) == 1
+
+
+def test_persistent_workdir_keeps_latex_state(repo: Path) -> None:
+    run = _FakeRun()
+    src = repo / "text_demo"
+    out = repo / "artifacts" / "demo_worktree.pdf"
+
+    run_pipeline(
+        pipeline_name="pdf", source_dir=src, output_path=out, run=run, persistent=True
+    )
+
+    workdir = repo / ".mcodex" / "cache" / "work" / "text_demo" / "pdf"
+    assert [Path(c[0]).name for c in run.calls][-1] == "latexmk"
+    (workdir / "main.aux").write_text("aux", encoding="utf-8")
+    body_mtime = (workdir / "body.tex").stat().st_mtime_ns
+
+    main = repo / ".mcodex" / "templates" / "latex" / "main.tex"
+    main.write_text("% new layout\n\\input{body.tex}\n", encoding="utf-8")
+    result = run_pipeline(
+        pipeline_name="pdf", source_dir=src, output_path=out, run=run, persistent=True
+    )
+
+    assert [s.kind for s in result.cached_steps] == ["pandoc", "vlna"]
+    assert (workdir / "main.aux").exists()
+    assert (workdir / "body.tex").stat().st_mtime_ns == body_mtime
+    assert (workdir / "main.tex").read_text(encoding="utf-8").startswith("% new")
+    assert out.read_text(encoding="utf-8") == "build 4"
+
+
+def test_unchanged_persistent_build_leaves_latex_inputs_alone(repo: Path) -> None:
+    body = ["first"]
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        tool = Path(cmd[0]).name
+        if tool == "pandoc":
+            Path(cmd[cmd.index("-o") + 1]).write_text(body[0], encoding="utf-8")
+        elif tool == "vlna":
+            Path(cmd[-1]).write_text(body[0], encoding="utf-8")
+        else:
+            (cwd / "main.pdf").write_text("pdf", encoding="utf-8")
+
+    workdir = repo / ".mcodex" / "cache" / "work" / "text_demo" / "pdf"
+
+    def build(day: int) -> dict[str, tuple[int, int]]:
+        run_pipeline(
+            pipeline_name="pdf",
+            source_dir=repo / "text_demo",
+            output_path=repo / "artifacts" / "demo_worktree.pdf",
+            run=run,
+            use_cache=False,
+            persistent=True,
+            built_at=datetime(2026, 1, day, tzinfo=UTC),
+        )
+        return {
+            p.name: (p.stat().st_ino, p.stat().st_mtime_ns)
+            for p in workdir.glob("*.tex")
+        }
+
+    first = build(1)
+    assert build(2) == first
+    context = workdir / "context.tex"
+    assert "2026-01-01" in context.read_text(encoding="utf-8")
+
+    # When latexmk has to run anyway, the build time is brought up to date.
+    body[0] = "second"
+    build(3)
+    assert "2026-01-03" in context.read_text(encoding="utf-8")
+
+
+def test_nbsp_step_runs_in_process(repo: Path) -> None:
+    cfg_path = repo / ".mcodex" / "config.yaml"
+    cfg = yaml.safe_load(cfg_path.read_text(encoding="utf-8"))
+    cfg["pipelines"]["pdf"]["steps"][1]["kind"] = "nbsp"
+    cfg_path.write_text(yaml.safe_dump(cfg, sort_keys=False), encoding="utf-8")
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        tool = Path(cmd[0]).name
+        if tool == "pandoc":
+            out = Path(cmd[cmd.index("-o") + 1])
+            out.write_text("Jdu v lese\n", encoding="utf-8")
+        else:
+            body = (cwd / "body.tex").read_text(encoding="utf-8")
+            (cwd / "main.pdf").write_text(body, encoding="utf-8")
+
+    out = repo / "artifacts" / "demo_worktree.pdf"
+    result = run_pipeline(
+        pipeline_name="pdf", source_dir=repo / "text_demo", output_path=out, run=run
+    )
+
+    assert [Path(c[0]).name for c in result.commands] == ["pandoc", "latexmk"]
+    assert [s.kind for s in result.steps] == ["pandoc", "nbsp", "latexmk"]
+    assert out.read_text(encoding="utf-8") == "Jdu v~lese\n"
+
+
+def test_latex_templates_and_body_are_linked_not_copied(repo: Path) -> None:
+    template = repo / ".mcodex" / "templates" / "latex" / "main.tex"
+    seen: dict[str, bool] = {}
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        tool = Path(cmd[0]).name
+        if tool == "pandoc":
+            Path(cmd[cmd.index("-o") + 1]).write_text("raw", encoding="utf-8")
+        elif tool == "vlna":
+            Path(cmd[-1]).write_text("body", encoding="utf-8")
+        else:
+            seen["template"] = (cwd / "main.tex").samefile(template)
+            seen["body"] = (cwd / "body.tex").read_text(encoding="utf-8") == "body"
+            (cwd / "main.pdf").write_text("pdf", encoding="utf-8")
+
+    run_pipeline(
+        pipeline_name="pdf",
+        source_dir=repo / "text_demo",
+        output_path=repo / "artifacts" / "demo_worktree.pdf",
+        run=run,
+        use_cache=False,
+    )
+
+    assert seen == {"template": True, "body": True}
+    assert template.read_text(encoding="utf-8") == "\\input{body.tex}\n"
+
+
+def test_identical_rebuild_leaves_artifact_untouched(repo: Path) -> None:
+    def run(cmd: list[str], cwd: Path) -> None:
+        Path(cmd[cmd.index("-o") + 1]).write_text("same", encoding="utf-8")
+
+    src = repo / "text_demo"
+    out = repo / "artifacts" / "demo_worktree.docx"
+
+    first = run_pipeline(pipeline_name="docx", source_dir=src, output_path=out, run=run)
+    assert first.unchanged == []
+    mtime = out.stat().st_mtime_ns
+    inode = out.stat().st_ino
+
+    (src / "text.md").write_text("# Edited, same output\n", encoding="utf-8")
+    second = run_pipeline(
+        pipeline_name="docx", source_dir=src, output_path=out, run=run
+    )
+    cached = run_pipeline(
+        pipeline_name="docx", source_dir=src, output_path=out, run=run
+    )
+
+    assert not second.cached
+    assert second.unchanged == [out]
+    assert cached.cached
+    assert cached.unchanged == [out]
+    assert out.stat().st_mtime_ns == mtime
+    assert out.stat().st_ino == inode
+    assert list(out.parent.glob(".*.tmp")) == []
+
+
+def test_changed_artifact_is_replaced_atomically(repo: Path) -> None:
+    calls = 0
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        Path(cmd[cmd.index("-o") + 1]).write_text(f"v{calls}", encoding="utf-8")
+
+    src = repo / "text_demo"
+    out = repo / "artifacts" / "demo_worktree.docx"
+    run_pipeline(pipeline_name="docx", source_dir=src, output_path=out, run=run)
+    inode = out.stat().st_ino
+
+    calls = 1
+    (src / "text.md").write_text("# Edited\n", encoding="utf-8")
+    result = run_pipeline(
+        pipeline_name="docx", source_dir=src, output_path=out, run=run
+    )
+
+    assert result.unchanged == []
+    assert out.read_text(encoding="utf-8") == "v1"
+    # A rename, not an in-place rewrite: readers of the old file are unaffected.
+    assert out.stat().st_ino != inode
@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import socket
+import threading
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import pytest
+import yaml
+
+from mcodex.services.build_server import (
+    BuildRequest,
+    BuildServer,
+    open_server,
+    request_build,
+)
+
+
+def _write_text_dir(text_dir: Path) -> None:
+    text_dir.mkdir(parents=True, exist_ok=True)
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    (text_dir / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": "x", "title": "T", "slug": "s"}),
+        encoding="utf-8",
+    )
+
+
+@pytest.fixture
+def text_dir(tmp_path: Path) -> Path:
+    text_dir = tmp_path / "text_s"
+    _write_text_dir(text_dir)
+    return text_dir
+
+
+def _request(text_dir: Path) -> BuildRequest:
+    return BuildRequest(text_dir=text_dir, ref=".", pipelines=("pdf",))
+
+
+def test_identical_requests_share_one_execution(text_dir: Path) -> None:
+    release = threading.Event()
+    calls: list[BuildRequest] = []
+
+    def execute(request: BuildRequest) -> dict[str, Any]:
+        calls.append(request)
+        release.wait(timeout=10)
+        return {"outputs": [f"out{len(calls)}"], "unchanged": []}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        server = BuildServer(executor=pool, execute=execute)
+        first, coalesced_first = server.submit(_request(text_dir))
+        second, coalesced_second = server.submit(_request(text_dir))
+        other, coalesced_other = server.submit(
+            BuildRequest(text_dir=text_dir, ref=".", pipelines=("docx",))
+        )
+        release.set()
+
+        assert (coalesced_first, coalesced_second, coalesced_other) == (
+            False,
+            True,
+            False,
+        )
+        assert second is first
+        assert first.result() == second.result()
+        other.result()
+        assert len(calls) == 2
+
+        # Once finished, the same request runs again.
+        again, coalesced = server.submit(_request(text_dir))
+        assert not coalesced
+        again.result()
+        assert len(calls) == 3
+
+
+def test_changed_sources_are_not_coalesced(text_dir: Path) -> None:
+    release = threading.Event()
+
+    def execute(request: BuildRequest) -> dict[str, Any]:
+        release.wait(timeout=10)
+        return {"outputs": [], "unchanged": []}
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        server = BuildServer(executor=pool, execute=execute)
+        first, _ = server.submit(_request(text_dir))
+        (text_dir / "text.md").write_text("edited", encoding="utf-8")
+        second, coalesced = server.submit(_request(text_dir))
+        release.set()
+
+        assert not coalesced
+        assert second is not first
+        first.result()
+        second.result()
+
+
+@pytest.fixture
+def socket_path(tmp_path: Path) -> Iterator[Path]:
+    path = tmp_path / "s.sock"
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        server = open_server(path, BuildServer(executor=pool))
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield path
+        finally:
+            server.shutdown()
+            server.server_close()
+
+
+def test_server_streams_events_and_result(socket_path: Path, text_dir: Path) -> None:
+    events: list[dict[str, Any]] = []
+    done = request_build(
+        socket_path=socket_path,
+        text_dir=text_dir,
+        ref=".",
+        pipeline="noop",
+        on_event=events.append,
+    )
+
+    assert events == [{"event": "queued", "coalesced": False}]
+    out = Path(done["outputs"][0])
+    assert out.read_text(encoding="utf-8").startswith("noop build: s / worktree")
+    assert socket_path.stat().st_mode & 0o077 == 0
+
+
+def test_server_reports_errors(socket_path: Path, tmp_path: Path) -> None:
+    with pytest.raises(RuntimeError, match="No metadata.yaml"):
+        request_build(
+            socket_path=socket_path, text_dir=tmp_path, ref=".", pipeline="pdf"
+        )
+
+
+def test_source_resolution_failure_is_reported(
+    text_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def broken_source(**_: Any) -> None:
+        raise RuntimeError("git archive failed")
+
+    monkeypatch.setattr(
+        "mcodex.services.build_server.resolve_build_source", broken_source
+    )
+    events: list[dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        BuildServer(executor=pool).handle(
+            {"op": "build", "text_dir": str(text_dir), "pipeline": "pdf"},
+            events.append,
+        )
+
+    assert events == [{"event": "error", "message": "git archive failed"}]
+
+
+def test_client_reports_unreachable_server(tmp_path: Path, text_dir: Path) -> None:
+    with pytest.raises(RuntimeError, match="not reachable"):
+        request_build(
+            socket_path=tmp_path / "missing.sock",
+            text_dir=text_dir,
+            ref=".",
+            pipeline="pdf",
+        )
+
+
+def test_stale_socket_is_replaced_but_live_one_is_not(socket_path: Path) -> None:
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(RuntimeError, match="already listening"):
+            open_server(socket_path, BuildServer(executor=pool))
+
+        stale = socket_path.with_name("stale.sock")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.bind(str(stale))
+        server = open_server(stale, BuildServer(executor=pool))
+        server.server_close()
@@ -4,7 +4,13 @@ from pathlib import Path
 
 import pytest
 
-from mcodex.services.fs import TEST_ROOT_MARKER, ensure_test_root_marker, safe_rmtree
+from mcodex.services.fs import (
+    TEST_ROOT_MARKER,
+    ensure_test_root_marker,
+    link_or_copy,
+    safe_rmtree,
+    safe_unlink,
+)
 
 
 def test_safe_rmtree_refuses_without_marker(tmp_path: Path) -> None:
@@ -48,3 +54,71 @@ def test_safe_rmtree_allows_allowed_roots_without_marker(tmp_path: Path) -> None
 
     safe_rmtree(target, allowed_roots=[root], marker_name=TEST_ROOT_MARKER)
     assert not target.exists()
+
+
+def test_safe_unlink_stays_under_allowed_roots(tmp_path: Path) -> None:
+    root = tmp_path / "allowed"
+    root.mkdir()
+    outside = tmp_path / "outside.txt"
+    outside.write_text("keep", encoding="utf-8")
+    link = root / "link"
+    link.symlink_to(outside)
+
+    with pytest.raises(RuntimeError):
+        safe_unlink(outside, allowed_roots=[root])
+    with pytest.raises(RuntimeError):
+        safe_unlink(root, allowed_roots=[root])
+
+    assert safe_unlink(link, allowed_roots=[root])
+    assert outside.read_text(encoding="utf-8") == "keep"
+
+
+def test_safe_unlink_keeps_a_replaced_file(tmp_path: Path) -> None:
+    target = tmp_path / "a.pdf"
+    target.write_text("old", encoding="utf-8")
+    seen = target.stat()
+    replacement = tmp_path / "new.pdf"
+    replacement.write_text("new!", encoding="utf-8")
+    replacement.replace(target)
+
+    assert not safe_unlink(target, allowed_roots=[tmp_path], expected=seen)
+    assert target.read_text(encoding="utf-8") == "new!"
+    assert safe_unlink(target, allowed_roots=[tmp_path], expected=target.stat())
+    assert not safe_unlink(target, allowed_roots=[tmp_path])
+
+
+def test_link_or_copy_replaces_target_without_writing_through(tmp_path: Path) -> None:
+    src = tmp_path / "template.tex"
+    src.write_text("template", encoding="utf-8")
+    dst = tmp_path / "work" / "template.tex"
+
+    assert link_or_copy(src, dst) == "hardlink"
+    assert dst.samefile(src)
+
+    other = tmp_path / "other.tex"
+    other.write_text("other", encoding="utf-8")
+    link_or_copy(other, dst)
+
+    assert dst.read_text(encoding="utf-8") == "other"
+    assert src.read_text(encoding="utf-8") == "template"
+
+
+def test_link_or_copy_falls_back_when_linking_fails(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    src = tmp_path / "a.txt"
+    src.write_text("a", encoding="utf-8")
+
+    def _fail(*_: object) -> None:
+        raise OSError("cross-device link")
+
+    monkeypatch.setattr("os.link", _fail)
+    monkeypatch.setattr("mcodex.services.fs._reflink", _fail)
+
+    assert link_or_copy(src, tmp_path / "sym.txt") == "symlink"
+    assert (tmp_path / "sym.txt").is_symlink()
+
+    assert link_or_copy(src, tmp_path / "copy.txt", allow_symlink=False) == "copy"
+    assert not (tmp_path / "copy.txt").is_symlink()
+    assert (tmp_path / "copy.txt").read_text(encoding="utf-8") == "a"
+    assert list(tmp_path.glob(".*.tmp")) == []
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services.git_plumbing import NewTree, commit_new_trees
+from mcodex.services.snapshot import snapshot_create
+
+
+def _git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), *args], text=True, capture_output=True, check=True
+    ).stdout
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.name", "Test")
+    _git(repo, "config", "user.email", "test@example.com")
+    (repo / ".gitignore").write_text("*.aux\n", encoding="utf-8")
+    (repo / ".mcodex").mkdir()
+    (repo / ".mcodex" / "config.yaml").write_text("{}\n", encoding="utf-8")
+    (repo / "text_t").mkdir()
+    (repo / "text_t" / "text.md").write_text("hello", encoding="utf-8")
+    (repo / "text_t" / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": "x", "title": "T", "slug": "t"}),
+        encoding="utf-8",
+    )
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-q", "-m", "init")
+    return repo
+
+
+def test_snapshot_commit_contains_only_the_snapshot(repo: Path) -> None:
+    tdir = repo / "text_t"
+    (tdir / "build.aux").write_text("ignored", encoding="utf-8")
+    (repo / "unrelated.txt").write_text("staged", encoding="utf-8")
+    _git(repo, "add", "unrelated.txt")
+
+    snapshot_create(text_dir=tdir, label="draft-1", note="first")
+
+    changed = _git(repo, "show", "--name-only", "--format=%s", "HEAD").split()
+    assert changed[-3:] == [
+        "text_t/.snapshot/draft-1/metadata.yaml",
+        "text_t/.snapshot/draft-1/snapshot.yaml",
+        "text_t/.snapshot/draft-1/text.md",
+    ]
+    assert _git(repo, "rev-parse", "mcodex/t/draft-1") == _git(
+        repo, "rev-parse", "HEAD"
+    )
+    assert _git(repo, "show", "HEAD:text_t/.snapshot/draft-1/text.md") == "hello"
+    # The snapshot is in the index and clean; the staged file stays staged
+    # and the ignored copy stays ignored.
+    status = _git(repo, "status", "--porcelain").splitlines()
+    assert "A  unrelated.txt" in status
+    assert not [line for line in status if "text_t" in line]
+    assert (tdir / ".snapshot" / "draft-1" / "build.aux").is_file()
+    assert "commit: Snapshot: t / draft-1" in _git(repo, "reflog", "-1")
+
+
+def test_several_trees_in_one_commit(repo: Path) -> None:
+    src = repo / "src"
+    src.mkdir()
+    (src / "a.txt").write_text("a", encoding="utf-8")
+    (src / "run.sh").write_text("#!/bin/sh\n", encoding="utf-8")
+    (src / "run.sh").chmod(0o755)
+
+    result = commit_new_trees(
+        repo_root=repo,
+        trees=[
+            NewTree(path="text_t/.snapshot/rc-1", files={"a.txt": src / "a.txt"}),
+            NewTree(
+                path="text_u/.snapshot/rc-1",
+                files={"sub/a.txt": src / "a.txt", "run.sh": src / "run.sh"},
+            ),
+        ],
+        message="Snapshot rc",
+        tags=["mcodex/t/rc-1", "mcodex/u/rc-1"],
+    )
+
+    assert _git(repo, "rev-parse", "HEAD").strip() == result.commit
+    assert _git(repo, "rev-list", "--count", "HEAD").strip() == "2"
+    assert _git(repo, "ls-tree", "-r", "--name-only", "HEAD").split() == [
+        ".gitignore",
+        ".mcodex/config.yaml",
+        "text_t/.snapshot/rc-1/a.txt",
+        "text_t/metadata.yaml",
+        "text_t/text.md",
+        "text_u/.snapshot/rc-1/run.sh",
+        "text_u/.snapshot/rc-1/sub/a.txt",
+    ]
+    assert "100755" in _git(repo, "ls-tree", "HEAD", "text_u/.snapshot/rc-1/run.sh")
+    assert (
+        _git(repo, "rev-parse", "HEAD:text_u/.snapshot/rc-1").strip()
+        == result.trees["text_u/.snapshot/rc-1"]
+    )
+    for tag in ("mcodex/t/rc-1", "mcodex/u/rc-1"):
+        assert _git(repo, "rev-parse", tag).strip() == result.commit
+
+
+def test_existing_tag_leaves_head_and_index_alone(repo: Path) -> None:
+    _git(repo, "tag", "mcodex/t/rc-1")
+    head = _git(repo, "rev-parse", "HEAD")
+    (repo / "a.txt").write_text("a", encoding="utf-8")
+
+    with pytest.raises(RuntimeError, match="update-ref"):
+        commit_new_trees(
+            repo_root=repo,
+            trees=[
+                NewTree(path="text_t/.snapshot/rc-1", files={"a.txt": repo / "a.txt"})
+            ],
+            message="Snapshot rc",
+            tags=["mcodex/t/rc-1"],
+        )
+
+    assert _git(repo, "rev-parse", "HEAD") == head
+    assert _git(repo, "diff", "--cached", "--name-only") == ""
+
+
+def test_first_commit_of_an_unborn_branch(tmp_path: Path) -> None:
+    repo = tmp_path / "fresh"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.name", "Test")
+    _git(repo, "config", "user.email", "test@example.com")
+    (repo / "a.txt").write_text("a", encoding="utf-8")
+
+    commit_new_trees(
+        repo_root=repo,
+        trees=[NewTree(path="s", files={"a.txt": repo / "a.txt"})],
+        message="first",
+    )
+
+    assert _git(repo, "log", "--format=%s").split() == ["first"]
+    assert _git(repo, "ls-files").split() == ["s/a.txt"]
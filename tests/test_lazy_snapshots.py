@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import io
+import subprocess
+import tarfile
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services import snapshot_index as index_mod
+from mcodex.services.artifacts_gc import IN_USE_GRACE, collect_garbage
+from mcodex.services.build import resolve_build_source
+from mcodex.services.snapshot import _extract_tree_archive, snapshot_create
+from mcodex.services.snapshot_index import load_snapshot_index
+
+
+def _git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), *args], text=True, capture_output=True, check=True
+    ).stdout
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.name", "Test")
+    _git(repo, "config", "user.email", "test@example.com")
+    (repo / ".gitignore").write_text("*.aux\n", encoding="utf-8")
+    (repo / ".mcodex").mkdir()
+    (repo / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump({"snapshot": {"mode": "lazy"}}), encoding="utf-8"
+    )
+    tdir = repo / "text_t"
+    (tdir / "img").mkdir(parents=True)
+    (tdir / ".snapshot").mkdir()
+    (tdir / ".snapshot" / ".gitkeep").write_text("", encoding="utf-8")
+    (tdir / "text.md").write_text("hello", encoding="utf-8")
+    (tdir / "img" / "cover.png").write_bytes(b"\x89PNG")
+    (tdir / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": "x", "title": "T", "slug": "t"}),
+        encoding="utf-8",
+    )
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-q", "-m", "init")
+    return repo
+
+
+def test_lazy_snapshot_is_a_tag_only(repo: Path) -> None:
+    tdir = repo / "text_t"
+    (tdir / "build.aux").write_text("ignored", encoding="utf-8")
+    (tdir / "text.md").write_text("edited, not committed", encoding="utf-8")
+    head = _git(repo, "rev-parse", "HEAD")
+
+    snap = snapshot_create(text_dir=tdir, label="draft", note="first")
+    snapshot_create(text_dir=tdir, label="draft", note=None)
+
+    assert snap.name == "draft-1" and not snap.exists()
+    assert _git(repo, "rev-parse", "HEAD") == head
+    assert _git(repo, "status", "--porcelain", "--", "text_t") == " M text_t/text.md\n"
+    tag = "mcodex/t/draft-1"
+    assert _git(repo, "ls-tree", "-r", "--name-only", tag).split() == [
+        "img/cover.png",
+        "metadata.yaml",
+        "snapshot.yaml",
+        "text.md",
+    ]
+    assert _git(repo, "show", f"{tag}:text.md") == "edited, not committed"
+    assert "Mcodex-Snapshot: lazy" in _git(repo, "log", "-1", "--format=%B", tag)
+    # A root commit: `git show <tag>` lists the snapshot, not a diff to HEAD.
+    assert _git(repo, "rev-list", "--count", tag).strip() == "1"
+
+    entry = load_snapshot_index(tdir).get("draft-1")
+    assert entry is not None
+    assert entry.tree == _git(repo, "rev-parse", f"{tag}^{{tree}}").strip()
+    assert entry.note == "first"
+    assert load_snapshot_index(tdir).latest_of_stage("draft") == "draft-2"
+
+
+def test_clone_lists_and_builds_from_tags(repo: Path, tmp_path: Path) -> None:
+    snapshot_create(text_dir=repo / "text_t", label="draft", note=None)
+    clone = tmp_path / "clone"
+    subprocess.run(
+        ["git", "clone", "-q", str(repo), str(clone)], check=True, capture_output=True
+    )
+    tdir = clone / "text_t"
+
+    assert load_snapshot_index(tdir).labels == ["draft-1"]
+    source = resolve_build_source(text_dir=tdir, version="draft")
+    assert source.version_label == "draft-1"
+    assert source.source_dir.parent.parent == clone / ".mcodex" / "cache" / "trees"
+    assert (source.source_dir / "text.md").read_text(encoding="utf-8") == "hello"
+    assert resolve_build_source(text_dir=tdir, version="draft-1") == source
+
+    # A snapshot fetched later is found from its tag.
+    (repo / "text_t" / "text.md").write_text("second", encoding="utf-8")
+    snapshot_create(text_dir=repo / "text_t", label="draft", note=None)
+    _git(clone, "fetch", "-q", "--tags")
+    second = resolve_build_source(text_dir=tdir, version="draft-2")
+    assert (second.source_dir / "text.md").read_text(encoding="utf-8") == "second"
+
+    report = collect_garbage(
+        repo_root=clone, max_size=0, now=time.time() + 2 * IN_USE_GRACE
+    )
+    assert report.evicted_cache_entries == 2
+    assert not source.source_dir.exists()
+
+
+def test_clone_without_snapshot_dir_sees_lazy_snapshots(
+    repo: Path, tmp_path: Path
+) -> None:
+    _git(repo, "rm", "-q", "text_t/.snapshot/.gitkeep")
+    _git(repo, "commit", "-q", "-m", "no snapshot dir")
+    snapshot_create(text_dir=repo / "text_t", label="draft", note=None)
+    clone = tmp_path / "clone"
+    subprocess.run(
+        ["git", "clone", "-q", str(repo), str(clone)], check=True, capture_output=True
+    )
+    tdir = clone / "text_t"
+    assert not (tdir / ".snapshot").exists()
+
+    assert load_snapshot_index(tdir).labels == ["draft-1"]
+    source = resolve_build_source(text_dir=tdir, version="draft")
+    assert (source.source_dir / "text.md").read_text(encoding="utf-8") == "hello"
+
+    (repo / "text_t" / "text.md").write_text("second", encoding="utf-8")
+    snapshot_create(text_dir=repo / "text_t", label="draft", note=None)
+    _git(clone, "fetch", "-q", "--tags")
+    second = resolve_build_source(text_dir=tdir, version="draft-2")
+    assert (second.source_dir / "text.md").read_text(encoding="utf-8") == "second"
+    assert not (tdir / ".snapshot").exists()
+
+
+def test_index_without_snapshot_dir_follows_the_tags(
+    repo: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    _git(repo, "rm", "-q", "text_t/.snapshot/.gitkeep")
+    _git(repo, "commit", "-q", "-m", "no snapshot dir")
+    clone = tmp_path / "clone"
+    subprocess.run(
+        ["git", "clone", "-q", str(repo), str(clone)], check=True, capture_output=True
+    )
+    tdir = clone / "text_t"
+    calls: list[str] = []
+    real = index_mod.tagged_commits
+
+    def counting(**kwargs: object) -> object:
+        calls.append(str(kwargs["prefix"]))
+        return real(**kwargs)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(index_mod, "tagged_commits", counting)
+
+    # No tag of the text yet: git is not even asked.
+    assert load_snapshot_index(tdir).labels == []
+    assert calls == []
+
+    # A long-lived process sees tags fetched later, loose or packed.
+    snapshot_create(text_dir=repo / "text_t", label="draft", note=None)
+    _git(clone, "fetch", "-q", "--tags")
+    assert load_snapshot_index(tdir).labels == ["draft-1"]
+    _git(clone, "pack-refs", "--all")
+    snapshot_create(text_dir=repo / "text_t", label="draft", note=None)
+    _git(clone, "fetch", "-q", "--tags")
+    _git(clone, "pack-refs", "--all")
+    assert load_snapshot_index(tdir).labels == ["draft-1", "draft-2"]
+    assert not (tdir / ".snapshot").exists()
+
+    # Unchanged refs: the cached index is reused.
+    del calls[:]
+    load_snapshot_index(tdir)
+    assert calls == []
+
+
+def test_copy_snapshots_and_lazy_ones_share_the_index(repo: Path) -> None:
+    tdir = repo / "text_t"
+    config = repo / ".mcodex" / "config.yaml"
+    config.write_text(yaml.safe_dump({"snapshot": {"mode": "copy"}}), "utf-8")
+    snapshot_create(text_dir=tdir, label="draft", note=None)
+    config.write_text(yaml.safe_dump({"snapshot": {"mode": "lazy"}}), "utf-8")
+    snapshot_create(text_dir=tdir, label="draft", note=None)
+
+    index_mod._loaded.clear()
+    (tdir / ".snapshot" / "index.yaml").unlink()
+    index = load_snapshot_index(tdir)
+    assert index.labels == ["draft-1", "draft-2"]
+    assert [e.tree is not None for e in index.entries] == [False, True]
+    assert resolve_build_source(text_dir=tdir, version="draft-1").source_dir == (
+        tdir / ".snapshot" / "draft-1"
+    )
+
+
+def test_materialize_without_tar_filters(
+    repo: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # Python before 3.11.4 has no `tarfile.data_filter`.
+    monkeypatch.delattr(tarfile, "data_filter")
+    tdir = repo / "text_t"
+    (tdir / "cover.png").symlink_to("img/cover.png")
+    snapshot_create(text_dir=tdir, label="draft", note=None)
+    source = resolve_build_source(text_dir=tdir, version="draft-1")
+    assert (source.source_dir / "text.md").read_text(encoding="utf-8") == "hello"
+    assert (source.source_dir / "cover.png").read_bytes() == b"\x89PNG"
+
+    for name, link in [("../evil", None), ("/evil", None), ("evil", "../../x")]:
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w") as tar:
+            member = tarfile.TarInfo(name)
+            if link is not None:
+                member.type, member.linkname = tarfile.SYMTYPE, link
+            tar.addfile(member, io.BytesIO())
+        buf.seek(0)
+        dest = tmp_path / "out"
+        dest.mkdir(exist_ok=True)
+        with (
+            tarfile.open(fileobj=buf, mode="r|") as tar,
+            pytest.raises(tarfile.TarError),
+        ):
+            _extract_tree_archive(tar, dest)
+        assert not list(dest.iterdir())
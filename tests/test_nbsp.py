@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+from pathlib import Path
+
+import pytest
+
+from mcodex.config import validate_pipelines
+from mcodex.services.nbsp import tie_file, tie_lines
+
+
+def _tie(text: str) -> str:
+    return "".join(tie_lines(text.splitlines(keepends=True)))
+
+
+def test_ties_one_letter_words() -> None:
+    assert _tie("Jdu v Praze k mostu.\n") == "Jdu v~Praze k~mostu.\n"
+    assert _tie("(s tebou) [z lesa] A pak\n") == "(s~tebou) [z~lesa] A~pak\n"
+
+
+def test_leaves_other_words_alone() -> None:
+    assert _tie("a pak i nyní ov je\n") == "a pak i nyní ov je\n"
+    assert _tie("v~Praze\n") == "v~Praze\n"
+
+
+def test_joins_across_line_break_but_not_paragraphs() -> None:
+    assert _tie("Byl jsem v\n  Brně.\n") == "Byl jsem v~Brně.\n"
+    assert _tie("Konec v\n\nDalší\n") == "Konec v\n\nDalší\n"
+
+
+def test_skips_math_verbatim_and_comments() -> None:
+    text = (
+        "$a v b$ a \\(v y\\) a \\verb|v x| % v komentu\n"
+        "$$\n"
+        "v x\n"
+        "$$\n"
+        "\\begin{verbatim}\n"
+        "v x\n"
+        "\\end{verbatim} o tom\n"
+        "cena 100\\% a v tom\n"
+    )
+    assert _tie(text) == text.replace("o tom", "o~tom").replace("v tom", "v~tom")
+
+
+def test_tie_file_and_custom_letters(tmp_path: Path) -> None:
+    src = tmp_path / "in.tex"
+    dst = tmp_path / "out.tex"
+    src.write_text("a pak v lese\r\n", encoding="utf-8")
+
+    tie_file(src, dst, letters="a")
+
+    assert dst.read_bytes() == b"a~pak v lese\r\n"
+
+
+def test_validate_pipelines_accepts_nbsp_step() -> None:
+    pandoc = {"kind": "pandoc", "from": "markdown", "to": "latex", "output": "a.tex"}
+    validate_pipelines(
+        {
+            "tex": {
+                "steps": [pandoc, {"kind": "nbsp", "input": "a.tex", "output": "b.tex"}]
+            }
+        }
+    )
+    with pytest.raises(ValueError):
+        validate_pipelines(
+            {"tex": {"steps": [pandoc, {"kind": "nbsp", "input": "a.tex"}]}}
+        )
@@ -0,0 +1,118 @@
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Any
+
+import pytest
+import yaml
+
+from mcodex.config import StepIO, pipeline_step_io, validate_pipelines
+from mcodex.services.pipeline import run_pipeline
+
+_LATEX = {"kind": "pandoc", "from": "markdown", "to": "latex", "output": "raw.tex"}
+_DOCX = {"kind": "pandoc", "from": "markdown", "to": "docx"}
+
+
+def _pipe(*steps: dict[str, Any]) -> dict[str, Any]:
+    return {"p": {"steps": list(steps)}}
+
+
+def test_step_io_defaults_follow_linear_wiring() -> None:
+    graph = pipeline_step_io(
+        [
+            _LATEX,
+            {"kind": "vlna", "input": "raw.tex", "output": "body.tex"},
+            _DOCX,
+            {"kind": "latexmk", "main": "book.tex"},
+        ]
+    )
+    assert graph == [
+        StepIO(inputs=("source",), outputs=("raw.tex",)),
+        StepIO(inputs=("raw.tex",), outputs=("body.tex",)),
+        StepIO(inputs=("source",), outputs=("output.docx",)),
+        StepIO(inputs=("body.tex",), outputs=("book.pdf",)),
+    ]
+
+
+def test_validate_rejects_missing_input() -> None:
+    with pytest.raises(ValueError, match="not produced"):
+        validate_pipelines(
+            _pipe(_LATEX, {"kind": "nbsp", "input": "nope.tex", "output": "b.tex"})
+        )
+
+    with pytest.raises(ValueError, match="no input"):
+        validate_pipelines(_pipe({"kind": "latexmk", "main": "main.tex"}))
+
+
+def test_validate_rejects_duplicate_outputs_and_cycles() -> None:
+    with pytest.raises(ValueError, match="already produced"):
+        validate_pipelines(_pipe(_LATEX, {**_LATEX, "to": "html"}))
+
+    with pytest.raises(ValueError, match="cycle"):
+        validate_pipelines(
+            _pipe(
+                {"kind": "nbsp", "input": "b.tex", "output": "a.tex"},
+                {"kind": "nbsp", "input": "a.tex", "output": "b.tex"},
+            )
+        )
+
+
+def test_independent_branches_run_concurrently(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = tmp_path / "repo"
+    (repo / ".mcodex").mkdir(parents=True)
+    (repo / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "pipelines": {
+                    "book": {
+                        "steps": [
+                            _LATEX,
+                            {"kind": "nbsp", "input": "raw.tex", "output": "body.tex"},
+                            _DOCX,
+                            {"kind": "latexmk", "main": "main.tex"},
+                        ]
+                    }
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    latex = repo / ".mcodex" / "templates" / "latex"
+    latex.mkdir(parents=True)
+    (latex / "main.tex").write_text("\\input{body.tex}\n", encoding="utf-8")
+    src = repo / "text_demo"
+    src.mkdir()
+    (src / "text.md").write_text("# T\n", encoding="utf-8")
+    (src / "metadata.yaml").write_text(
+        "metadata_version: 1\nid: x\ntitle: T\nslug: demo\nauthors: []\n",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+
+    # Both pandoc steps must be in flight at once to pass the barrier.
+    barrier = threading.Barrier(2, timeout=5)
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        if Path(cmd[0]).name == "pandoc":
+            barrier.wait()
+            out = Path(cmd[cmd.index("-o") + 1])
+            out.write_text("v lese", encoding="utf-8")
+        else:
+            (cwd / "main.pdf").write_text("pdf", encoding="utf-8")
+
+    out = repo / "artifacts" / "demo_worktree.pdf"
+    result = run_pipeline(
+        pipeline_name="book", source_dir=src, output_path=out, run=run
+    )
+
+    assert result.outputs == [out, out.with_suffix(".docx")]
+    assert out.read_text(encoding="utf-8") == "pdf"
+    assert out.with_suffix(".docx").read_text(encoding="utf-8") == "v lese"
+    assert [s.index for s in result.steps] == [0, 1, 2, 3]
+
+    again = run_pipeline(pipeline_name="book", source_dir=src, output_path=out, run=run)
+    assert again.cached
+    assert again.outputs == result.outputs
@@ -5,6 +5,7 @@ from pathlib import Path
 import yaml
 
 from mcodex.services import pipeline as pipeline_mod
+from mcodex.services.toolchain import Toolchain
 
 
 def _write_repo_config(repo_root: Path, pipelines: dict) -> None:
@@ -56,7 +57,7 @@ def test_pandoc_docx_uses_repo_reference_doc(monkeypatch, tmp_path: Path) -> Non
     ref.parent.mkdir(parents=True, exist_ok=True)
     ref.write_bytes(b"fake-docx")
 
-    monkeypatch.setattr(pipeline_mod, "_require_executable", lambda name: name)
+    monkeypatch.setattr(Toolchain, "require", lambda self, name: name)
 
     out = repo_root / "artifacts" / "out.docx"
     result = pipeline_mod.run_pipeline(
@@ -91,7 +92,7 @@ def test_pandoc_pdf_uses_repo_template_tex(monkeypatch, tmp_path: Path) -> None:
     tex.parent.mkdir(parents=True, exist_ok=True)
     tex.write_text("% fake template\n", encoding="utf-8")
 
-    monkeypatch.setattr(pipeline_mod, "_require_executable", lambda name: name)
+    monkeypatch.setattr(Toolchain, "require", lambda self, name: name)
 
     out = repo_root / "artifacts" / "out.pdf"
     result = pipeline_mod.run_pipeline(
@@ -124,7 +125,7 @@ def test_pandoc_does_not_add_template_args_when_files_missing(
     )
     _write_text_source(text_dir)
 
-    monkeypatch.setattr(pipeline_mod, "_require_executable", lambda name: name)
+    monkeypatch.setattr(Toolchain, "require", lambda self, name: name)
 
     out = repo_root / "artifacts" / "out.docx"
     result = pipeline_mod.run_pipeline(
@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.config import validate_pipelines
+from mcodex.errors import StepTimeoutError
+from mcodex.services.build_cache import step_cache_key
+from mcodex.services.pipeline import run_pipeline, run_pipeline_async
+from mcodex.services.process import AsyncRunner, run_command, run_command_async
+
+# Starts a grandchild and records its pid, like latexmk starting pdflatex.
+_SPAWN = "sleep 30 & echo $! > child.pid; wait"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return False
+    # A zombie is dead, merely not reaped yet.
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+def _dies(pid: int) -> bool:
+    # A killed process exits asynchronously; give the kernel a moment.
+    deadline = time.monotonic() + 5
+    while _alive(pid):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _child_pid(cwd: Path) -> int:
+    pid_file = cwd / "child.pid"
+    for _ in range(100):
+        if pid_file.is_file() and pid_file.read_text(encoding="utf-8").strip():
+            return int(pid_file.read_text(encoding="utf-8"))
+        time.sleep(0.02)
+    raise AssertionError("child.pid was not written")
+
+
+def test_run_command_reports_failure_output(tmp_path: Path) -> None:
+    with pytest.raises(RuntimeError, match="--- last 2 lines ---\nout\nboom"):
+        run_command(["sh", "-c", "echo out; echo boom >&2; exit 3"], tmp_path)
+
+
+def test_run_command_timeout_kills_process_group(tmp_path: Path) -> None:
+    started = time.monotonic()
+    with pytest.raises(StepTimeoutError, match="timed out after 0.3s"):
+        run_command(["sh", "-c", _SPAWN], tmp_path, timeout=0.3)
+
+    assert time.monotonic() - started < 10
+    assert _dies(_child_pid(tmp_path))
+
+
+def test_async_command_cancellation_kills_process_group(tmp_path: Path) -> None:
+    async def scenario() -> None:
+        task = asyncio.create_task(run_command_async(["sh", "-c", _SPAWN], tmp_path))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert _dies(_child_pid(tmp_path))
+
+
+def test_async_runner_is_a_run_fn_for_threads(tmp_path: Path) -> None:
+    errors: list[BaseException] = []
+
+    with AsyncRunner() as runner:
+
+        def call(i: int) -> None:
+            try:
+                runner(["sh", "-c", f"echo {i} > out{i}"], tmp_path)
+            except BaseException as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        with pytest.raises(StepTimeoutError):
+            runner(["sleep", "30"], tmp_path, timeout=0.2)
+
+    assert errors == []
+    assert sorted(p.name for p in tmp_path.glob("out*")) == [
+        f"out{i}" for i in range(8)
+    ]
+
+
+def test_async_runner_cancel_fails_running_and_later_calls(tmp_path: Path) -> None:
+    errors: list[BaseException] = []
+    leader_alive: list[bool] = []
+    runner = AsyncRunner()
+
+    def call() -> None:
+        # The shell ignores SIGTERM, so the kill takes the whole grace period.
+        script = f"trap '' TERM; echo $$ > leader.pid; {_SPAWN}"
+        try:
+            runner(["sh", "-c", script], tmp_path)
+        except BaseException as e:
+            errors.append(e)
+            pid = int((tmp_path / "leader.pid").read_text(encoding="utf-8"))
+            leader_alive.append(_alive(pid))
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    child = _child_pid(tmp_path)
+    runner.cancel()
+    thread.join(timeout=10)
+    runner.close()
+
+    assert not thread.is_alive()
+    assert len(errors) == 1 and "Cancelled" in str(errors[0])
+    # The call returns only once the killed command has been reaped.
+    assert leader_alive == [False]
+    assert _dies(child)
+    with pytest.raises(RuntimeError, match="Cancelled"):
+        runner(["true"], tmp_path)
+
+
+def test_validate_step_timeout() -> None:
+    step = {"kind": "pandoc", "from": "markdown", "to": "docx"}
+    validate_pipelines({"p": {"steps": [{**step, "timeout": 2.5}]}})
+    for bad in (0, -1, "60", True):
+        with pytest.raises(ValueError, match="timeout"):
+            validate_pipelines({"p": {"steps": [{**step, "timeout": bad}]}})
+
+
+def test_timeout_is_not_part_of_step_cache_key() -> None:
+    step = {"kind": "pandoc", "from": "markdown", "to": "docx"}
+    assert step_cache_key(step=step, inputs={}, tools={}) == step_cache_key(
+        step={**step, "timeout": 60}, inputs={}, tools={}
+    )
+
+
+def _write_text_dir(text_dir: Path) -> None:
+    text_dir.mkdir(parents=True, exist_ok=True)
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    (text_dir / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": "x", "title": "T", "slug": "s"}),
+        encoding="utf-8",
+    )
+
+
+def test_step_timeout_reaches_runner(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+    repo = tmp_path / "repo"
+    (repo / ".mcodex").mkdir(parents=True)
+    (repo / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "pipelines": {
+                    "docx": {
+                        "steps": [
+                            {
+                                "kind": "pandoc",
+                                "from": "markdown",
+                                "to": "docx",
+                                "timeout": 42,
+                            }
+                        ]
+                    }
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    _write_text_dir(repo / "text_s")
+    seen: list[float | None] = []
+
+    def run(cmd: list[str], cwd: Path, *, timeout: float | None = None) -> None:
+        seen.append(timeout)
+        Path(cmd[cmd.index("-o") + 1]).write_text("x", encoding="utf-8")
+
+    run_pipeline(
+        pipeline_name="docx",
+        source_dir=repo / "text_s",
+        output_path=repo / "out.docx",
+        run=run,
+        use_cache=False,
+    )
+    assert seen == [42.0]
+
+
+@pytest.fixture
+def fake_pandoc(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "pandoc"
+    script.write_text(
+        "#!/bin/sh\n"
+        'if [ "$1" = --version ]; then echo "pandoc 3.1"; exit 0; fi\n'
+        'while [ $# -gt 0 ]; do [ "$1" = -o ] && out="$2"; shift; done\n'
+        'if [ -n "$FAKE_PANDOC_HANG" ]; then\n'
+        '  sleep 30 & echo $! > "$FAKE_PANDOC_HANG"; wait\n'
+        "fi\n"
+        'if [ -n "$out" ]; then echo fake > "$out"; fi\n',
+        encoding="utf-8",
+    )
+    script.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    # Whatever the fake is asked to write stays out of the checkout.
+    monkeypatch.chdir(tmp_path)
+    return bin_dir
+
+
+def test_many_pipelines_share_one_event_loop(tmp_path: Path, fake_pandoc: Path) -> None:
+    texts = [tmp_path / f"text_{i}" for i in range(6)]
+    for text in texts:
+        _write_text_dir(text)
+
+    async def scenario() -> list[Path]:
+        results = await asyncio.gather(
+            *(
+                run_pipeline_async(
+                    pipeline_name="docx",
+                    source_dir=text,
+                    output_path=tmp_path / f"{text.name}.docx",
+                )
+                for text in texts
+            )
+        )
+        return [r.output_path for r in results]
+
+    outputs = asyncio.run(scenario())
+    assert [p.read_text(encoding="utf-8") for p in outputs] == ["fake\n"] * 6
+
+
+def test_cancelling_async_pipeline_kills_its_tools(
+    tmp_path: Path, fake_pandoc: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("FAKE_PANDOC_HANG", str(tmp_path / "child.pid"))
+    _write_text_dir(tmp_path / "text_s")
+
+    async def scenario() -> None:
+        task = asyncio.create_task(
+            run_pipeline_async(
+                pipeline_name="docx",
+                source_dir=tmp_path / "text_s",
+                output_path=tmp_path / "s.docx",
+            )
+        )
+        await asyncio.to_thread(_child_pid, tmp_path)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    assert _dies(_child_pid(tmp_path))
+    assert not (tmp_path / "s.docx").exists()
+
+
+def test_failure_message_is_bounded_and_full_output_is_logged(tmp_path: Path) -> None:
+    log = tmp_path / "logs" / "2-latexmk.log"
+    script = (
+        'i=0; while [ $i -lt 5000 ]; do echo "line $i"; i=$((i+1)); done; '
+        "echo './body.tex:12: Undefined control sequence.' >&2; "
+        "echo 'main.tex:3: Emergency stop.'; echo trailer; exit 1"
+    )
+    with pytest.raises(RuntimeError) as excinfo:
+        run_command(["sh", "-c", script], tmp_path, log=log)
+
+    message = str(excinfo.value)
+    lines = message.splitlines()
+    assert lines[1:4] == [
+        "--- errors ---",
+        "./body.tex:12: Undefined control sequence.",
+        "main.tex:3: Emergency stop.",
+    ]
+    assert lines[-2] == "trailer"
+    assert lines[-1] == f"Full log: {log}"
+    assert "line 4000" not in message
+    assert len(lines) < 60
+
+    logged = log.read_text(encoding="utf-8").splitlines()
+    assert logged[0] == "line 0"
+    assert len(logged) == 5003
+
+
+def test_pipeline_logs_each_tool_run(tmp_path: Path, fake_pandoc: Path) -> None:
+    _write_text_dir(tmp_path / "text_s")
+    log_dir = tmp_path / "logs"
+    log_dir.mkdir()
+    (log_dir / "9-latexmk.log").write_text("stale", encoding="utf-8")
+
+    result = run_pipeline(
+        pipeline_name="docx",
+        source_dir=tmp_path / "text_s",
+        output_path=tmp_path / "s.docx",
+        log_dir=log_dir,
+    )
+
+    assert result.log_dir == log_dir
+    assert sorted(p.name for p in log_dir.iterdir()) == ["0-pandoc.log"]
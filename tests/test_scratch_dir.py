@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.config import SCRATCH_DIR_ENV_VAR, resolve_scratch_dir
+from mcodex.services.pipeline import PipelineResult, run_pipeline
+
+
+def _write_repo(repo: Path, build: dict[str, str] | None = None) -> None:
+    (repo / ".mcodex").mkdir(parents=True)
+    cfg = {
+        "pipelines": {
+            "docx": {"steps": [{"kind": "pandoc", "from": "markdown", "to": "docx"}]}
+        }
+    }
+    if build is not None:
+        cfg["build"] = build
+    (repo / ".mcodex" / "config.yaml").write_text(yaml.safe_dump(cfg), encoding="utf-8")
+    text = repo / "text_demo"
+    text.mkdir()
+    (text / "text.md").write_text("# T\n", encoding="utf-8")
+    (text / "metadata.yaml").write_text(
+        "metadata_version: 1\nid: x\ntitle: T\nslug: demo\nauthors: []\n",
+        encoding="utf-8",
+    )
+
+
+@pytest.fixture(autouse=True)
+def _no_env_override(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv(SCRATCH_DIR_ENV_VAR, raising=False)
+
+
+def test_resolve_scratch_dir_from_config_and_env(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = tmp_path / "repo"
+    _write_repo(repo, build={"scratch_dir": "scratch"})
+
+    assert resolve_scratch_dir(repo) == (repo / "scratch").resolve()
+    assert (repo / "scratch").is_dir()
+    assert resolve_scratch_dir(None) is None
+
+    monkeypatch.setenv(SCRATCH_DIR_ENV_VAR, str(tmp_path / "shm"))
+    assert resolve_scratch_dir(repo) == (tmp_path / "shm").resolve()
+
+
+def test_build_runs_in_scratch_dir_and_can_keep_it(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo = tmp_path / "repo"
+    _write_repo(repo)
+    scratch = tmp_path / "shm"
+    monkeypatch.setenv(SCRATCH_DIR_ENV_VAR, str(scratch))
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+
+    seen: list[Path] = []
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        out = Path(cmd[cmd.index("-o") + 1])
+        seen.append(out.parent)
+        out.write_text("docx", encoding="utf-8")
+
+    def build(
+        keep_scratch: bool, runner: Callable[[list[str], Path], None] = run
+    ) -> PipelineResult:
+        return run_pipeline(
+            pipeline_name="docx",
+            source_dir=repo / "text_demo",
+            output_path=repo / "artifacts" / "demo.docx",
+            run=runner,
+            use_cache=False,
+            keep_scratch=keep_scratch,
+        )
+
+    assert build(keep_scratch=False).scratch_dir is None
+    assert seen[0].parent == scratch.resolve()
+    assert not seen[0].exists()
+
+    assert build(keep_scratch=True).scratch_dir == seen[1]
+    assert (seen[1] / "output.docx").is_file()
+
+    def fail(cmd: list[str], cwd: Path) -> None:
+        seen.append(Path(cmd[cmd.index("-o") + 1]).parent)
+        raise RuntimeError("pandoc failed")
+
+    with pytest.raises(RuntimeError) as excinfo:
+        build(keep_scratch=True, runner=fail)
+    assert excinfo.value.__notes__ == [f"Kept scratch directory: {seen[2]}"]
+    assert seen[2].is_dir()
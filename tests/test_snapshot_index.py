@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services import snapshot_index as index_mod
+from mcodex.services.build import resolve_ref_patterns
+from mcodex.services.snapshot import (
+    available_stages,
+    normalize_snapshot_label,
+    snapshot_create,
+)
+from mcodex.services.snapshot_index import INDEX_NAME, load_snapshot_index
+
+
+def _git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), *args], text=True, capture_output=True, check=True
+    ).stdout
+
+
+@pytest.fixture
+def text_dir(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.name", "Test")
+    _git(repo, "config", "user.email", "test@example.com")
+    (repo / ".mcodex").mkdir()
+    (repo / ".mcodex" / "config.yaml").write_text("{}\n", encoding="utf-8")
+    tdir = repo / "text_t"
+    tdir.mkdir()
+    (tdir / "text.md").write_text("hello", encoding="utf-8")
+    (tdir / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": "x", "title": "T", "slug": "t"}),
+        encoding="utf-8",
+    )
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-q", "-m", "init")
+    return tdir
+
+
+def _fake_snapshot(text_dir: Path, label: str) -> None:
+    snap = text_dir / ".snapshot" / label
+    snap.mkdir(parents=True)
+    (snap / "snapshot.yaml").write_text(
+        yaml.safe_dump({"label": label, "created_at": "2026-01-01T00:00:00+00:00"}),
+        encoding="utf-8",
+    )
+
+
+def test_snapshot_create_records_its_entry(text_dir: Path) -> None:
+    snapshot_create(text_dir=text_dir, label="draft", note="first")
+    snapshot_create(text_dir=text_dir, label="draft", note=None)
+    snapshot_create(text_dir=text_dir, label="rc", note=None)
+
+    data = yaml.safe_load((text_dir / ".snapshot" / INDEX_NAME).read_text("utf-8"))
+    first = data["snapshots"][0]
+    assert first["label"] == "draft-1"
+    assert first["stage"] == "draft"
+    assert first["number"] == 1
+    assert first["note"] == "first"
+    assert first["git_tag"] == "mcodex/t/draft-1"
+    assert first["created_at"]
+
+    index = load_snapshot_index(text_dir)
+    assert index.labels == ["draft-1", "draft-2", "rc-1"]
+    assert index.latest_of_stage("draft") == "draft-2"
+    assert index.next_number("rc") == 2
+    assert index.latest == "rc-1"
+    assert available_stages(text_dir=text_dir) == ["rc", "final", "published"]
+    # The index is a local cache and never shows up in Git.
+    assert not _git(text_dir.parent, "status", "--porcelain", "--", "text_t")
+
+
+def test_missing_or_stale_index_is_rebuilt(text_dir: Path) -> None:
+    _fake_snapshot(text_dir, "draft-1")
+    _fake_snapshot(text_dir, "draft-10")
+    assert normalize_snapshot_label(text_dir=text_dir, label_or_stage="draft") == (
+        "draft-11"
+    )
+    index_file = text_dir / ".snapshot" / INDEX_NAME
+    assert index_file.is_file()
+
+    # Another branch checked out, a snapshot removed by hand, a broken file.
+    _fake_snapshot(text_dir, "final-1")
+    (text_dir / ".snapshot" / "draft-10" / "snapshot.yaml").unlink()
+    (text_dir / ".snapshot" / "draft-10").rmdir()
+    assert resolve_ref_patterns(text_dir=text_dir, patterns="draft,final") == [
+        "draft-1",
+        "final-1",
+    ]
+
+    index_mod._loaded.clear()
+    index_file.write_text("snapshots: [", encoding="utf-8")
+    assert load_snapshot_index(text_dir).labels == ["draft-1", "final-1"]
+    assert "final-1" in index_file.read_text(encoding="utf-8")
+
+
+def test_unchanged_snapshot_dir_is_not_scanned_again(
+    text_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    _fake_snapshot(text_dir, "draft-1")
+    scans: list[Path] = []
+    real_scan = index_mod._snapshot_dir_names
+
+    def counting_scan(root: Path) -> set[str]:
+        scans.append(root)
+        return real_scan(root)
+
+    monkeypatch.setattr(index_mod, "_snapshot_dir_names", counting_scan)
+    for _ in range(3):
+        assert load_snapshot_index(text_dir).latest_of_stage("draft") == "draft-1"
+    assert len(scans) == 1
@@ -0,0 +1,117 @@
+from __future__ import annotations
+
+import subprocess
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services import snapshot as snapshot_mod
+from mcodex.services.snapshot import snapshot_create, snapshot_create_many
+from mcodex.services.snapshot_index import load_snapshot_index
+
+
+def _git(repo: Path, *args: str) -> str:
+    return subprocess.run(
+        ["git", "-C", str(repo), *args], text=True, capture_output=True, check=True
+    ).stdout
+
+
+def _write_text(tdir: Path, slug: str) -> None:
+    tdir.mkdir()
+    (tdir / "text.md").write_text(f"text {slug}", encoding="utf-8")
+    (tdir / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": slug, "title": "T", "slug": slug}),
+        encoding="utf-8",
+    )
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git(repo, "init", "-q")
+    _git(repo, "config", "user.name", "Test")
+    _git(repo, "config", "user.email", "test@example.com")
+    (repo / ".mcodex").mkdir()
+    (repo / ".mcodex" / "config.yaml").write_text("{}\n", encoding="utf-8")
+    for slug in ("a", "b", "c"):
+        _write_text(repo / f"text_{slug}", slug)
+    _git(repo, "add", ".")
+    _git(repo, "commit", "-q", "-m", "init")
+    return repo
+
+
+def _text_dirs(repo: Path) -> list[Path]:
+    return [repo / f"text_{slug}" for slug in ("a", "b", "c")]
+
+
+def test_one_commit_and_all_tags(repo: Path) -> None:
+    snapshot_create(text_dir=repo / "text_a", label="rc", note=None)
+    (repo / "text_a" / "text.md").write_text("changed", encoding="utf-8")
+
+    snap_dirs = snapshot_create_many(
+        text_dirs=_text_dirs(repo), label="rc", note="issue 12", jobs=2
+    )
+
+    assert [p.relative_to(repo).as_posix() for p in snap_dirs] == [
+        "text_a/.snapshot/rc-2",
+        "text_b/.snapshot/rc-1",
+        "text_c/.snapshot/rc-1",
+    ]
+    assert _git(repo, "rev-list", "--count", "HEAD").strip() == "3"
+    head = _git(repo, "rev-parse", "HEAD")
+    for tag in ("mcodex/a/rc-2", "mcodex/b/rc-1", "mcodex/c/rc-1"):
+        assert _git(repo, "rev-parse", tag) == head
+    message = _git(repo, "log", "-1", "--format=%B")
+    assert message.startswith("Snapshot: 3 texts / rc\n\n")
+    assert "Snapshot: b / rc-1 — issue 12" in message
+    assert _git(repo, "show", "HEAD:text_a/.snapshot/rc-2/text.md") == "changed"
+    assert _git(repo, "show", "HEAD:text_c/.snapshot/rc-1/text.md") == "text c"
+    assert not _git(repo, "status", "--porcelain", "--", "*/.snapshot")
+    assert load_snapshot_index(repo / "text_b").latest_of_stage("rc") == "rc-1"
+
+
+def test_existing_tag_rolls_everything_back(repo: Path) -> None:
+    _git(repo, "tag", "mcodex/c/final-1")
+    head = _git(repo, "rev-parse", "HEAD")
+
+    with pytest.raises(RuntimeError, match="update-ref"):
+        snapshot_create_many(text_dirs=_text_dirs(repo), label="final", note=None)
+
+    assert _git(repo, "rev-parse", "HEAD") == head
+    assert _git(repo, "tag", "-l", "mcodex/a/*") == ""
+    assert _git(repo, "diff", "--cached", "--name-only") == ""
+    for tdir in _text_dirs(repo):
+        assert not (tdir / ".snapshot" / "final-1").exists()
+        assert load_snapshot_index(tdir).labels == []
+
+
+def test_failed_copy_removes_the_other_copies(
+    repo: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    real_copy = snapshot_mod._copy_text_dir
+
+    def copy_failing_for_b(*, src: Path, **kwargs: object) -> list[str]:
+        if src.name == "text_b":
+            raise OSError("disk full")
+        return real_copy(src=src, **kwargs)  # type: ignore[arg-type]
+
+    monkeypatch.setattr(snapshot_mod, "_copy_text_dir", copy_failing_for_b)
+    head = _git(repo, "rev-parse", "HEAD")
+
+    with pytest.raises(OSError, match="disk full"):
+        snapshot_create_many(text_dirs=_text_dirs(repo), label="draft", note=None)
+
+    assert _git(repo, "rev-parse", "HEAD") == head
+    for tdir in _text_dirs(repo):
+        assert not (tdir / ".snapshot" / "draft-1").exists()
+
+
+def test_texts_are_checked_before_anything_is_copied(repo: Path) -> None:
+    snapshot_create(text_dir=repo / "text_b", label="draft-1", note=None)
+
+    with pytest.raises(FileExistsError, match="draft-1"):
+        snapshot_create_many(text_dirs=_text_dirs(repo), label="draft-1", note=None)
+
+    assert not (repo / "text_a" / ".snapshot").exists()
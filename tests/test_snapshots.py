@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+import os
 import subprocess
 from pathlib import Path
 
@@ -85,3 +86,66 @@ def test_snapshot_does_not_copy_snapshot_dir_or_git_dir(tmp_path: Path) -> None:
 
     assert not (snap / ".snapshot").exists()
     assert not (snap / ".git").exists()
+
+
+def test_snapshot_shares_files_unchanged_since_previous_snapshot(
+    tmp_path: Path,
+) -> None:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git_init(repo)
+
+    tdir = repo / "text"
+    _write_min_text_dir(tdir)
+    (tdir / "img").mkdir()
+    (tdir / "img" / "cover.png").write_bytes(b"\x89PNG" * 1000)
+
+    first = snapshot_create(text_dir=tdir, label="draft-1", note=None)
+    (tdir / "text.md").write_text("hello, edited", encoding="utf-8")
+    # Same content, new mtime: still shared.
+    (tdir / "metadata.yaml").write_bytes((tdir / "metadata.yaml").read_bytes())
+    second = snapshot_create(text_dir=tdir, label="draft-2", note=None)
+
+    def inode(p: Path) -> int:
+        return p.stat().st_ino
+
+    assert inode(second / "img" / "cover.png") == inode(first / "img" / "cover.png")
+    assert inode(second / "metadata.yaml") == inode(first / "metadata.yaml")
+    assert inode(second / "text.md") != inode(first / "text.md")
+    assert inode(second / "snapshot.yaml") != inode(first / "snapshot.yaml")
+    assert (first / "text.md").read_text(encoding="utf-8") == "hello"
+    assert (second / "text.md").read_text(encoding="utf-8") == "hello, edited"
+
+    shown = subprocess.run(
+        ["git", "-C", str(repo), "show", "HEAD:text/.snapshot/draft-2/img/cover.png"],
+        capture_output=True,
+        check=True,
+    )
+    assert shown.stdout == b"\x89PNG" * 1000
+
+
+def test_snapshot_does_not_share_edited_file_with_restored_mtime(
+    tmp_path: Path,
+) -> None:
+    repo = tmp_path / "repo"
+    repo.mkdir()
+    _git_init(repo)
+
+    tdir = repo / "text"
+    _write_min_text_dir(tdir)
+    first = snapshot_create(text_dir=tdir, label="draft-1", note=None)
+
+    # Same size, mode and mtime, different content (as after `touch -r`).
+    st = (tdir / "text.md").stat()
+    (tdir / "text.md").write_text("HELLO", encoding="utf-8")
+    os.utime(tdir / "text.md", ns=(st.st_atime_ns, st.st_mtime_ns))
+    second = snapshot_create(text_dir=tdir, label="draft-2", note=None)
+
+    assert (second / "text.md").stat().st_ino != (first / "text.md").stat().st_ino
+    assert (second / "text.md").read_text(encoding="utf-8") == "HELLO"
+    shown = subprocess.run(
+        ["git", "-C", str(repo), "show", "HEAD:text/.snapshot/draft-2/text.md"],
+        capture_output=True,
+        check=True,
+    )
+    assert shown.stdout == b"HELLO"
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services.pipeline import run_pipeline
+from mcodex.services.timings import format_timings, write_timings_json
+
+
+def _write_min_text_dir(text_dir: Path) -> None:
+    text_dir.mkdir(parents=True, exist_ok=True)
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    (text_dir / "metadata.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "metadata_version": 1,
+                "id": "x",
+                "title": "T",
+                "slug": "story",
+                "created_at": "2026-01-03T00:00:00+01:00",
+                "authors": [],
+            },
+            sort_keys=False,
+        ),
+        encoding="utf-8",
+    )
+
+
+def test_steps_record_wall_cpu_and_rss(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tdir = tmp_path / "story"
+    _write_min_text_dir(tdir)
+    monkeypatch.setattr("shutil.which", lambda name: f"/bin/{name}")
+
+    def run(cmd: list[str], cwd: Path) -> None:
+        # A real child process, so RUSAGE_CHILDREN has something to measure.
+        out = Path(cmd[cmd.index("-o") + 1])
+        subprocess.run(
+            [sys.executable, "-c", f"open({str(out)!r}, 'w').write('x')"],
+            check=True,
+        )
+
+    result = run_pipeline(
+        pipeline_name="docx",
+        source_dir=tdir,
+        output_path=tmp_path / "out.docx",
+        run=run,
+    )
+
+    (step,) = result.steps
+    assert result.pipeline == "docx"
+    assert step.wall > 0
+    assert step.cpu > 0
+    assert step.max_rss_kb > 0
+    assert result.wall >= step.wall
+
+    table = format_timings([result])
+    assert table.splitlines()[0].split() == [
+        "PIPELINE",
+        "STEP",
+        "KIND",
+        "WALL",
+        "CPU",
+        "MAX",
+        "RSS",
+    ]
+    assert "docx      total" in table
+
+    target = tmp_path / "reports" / "timings.json"
+    write_timings_json(target, [result])
+    payload = json.loads(target.read_text(encoding="utf-8"))
+    assert payload[0]["pipeline"] == "docx"
+    assert payload[0]["steps"][0]["kind"] == "pandoc"
+    assert payload[0]["steps"][0]["cpu"] == step.cpu
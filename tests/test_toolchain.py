@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.services import toolchain as toolchain_mod
+from mcodex.services.doctor import doctor
+from mcodex.services.pipeline import run_pipeline
+from mcodex.services.toolchain import load_toolchain
+
+
+@pytest.fixture
+def bin_dir(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(toolchain_mod, "_toolchains", {})
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    monkeypatch.setenv("PATH", str(bin_dir))
+    return bin_dir
+
+
+def _install(bin_dir: Path, name: str, version: str) -> Path:
+    """A fake tool that logs every `--version` probe and writes its `-o`."""
+
+    tool = bin_dir / name
+    log = bin_dir.parent / "probes.log"
+    tool.write_text(
+        "#!/bin/sh\n"
+        'if [ "$1" = --version ]; then\n'
+        f'  echo {name} >> "{log}"; echo "{name} {version}"; exit 0\n'
+        "fi\n"
+        'while [ $# -gt 0 ]; do [ "$1" = -o ] && out="$2"; shift; done\n'
+        f'echo "{version}" > "$out"\n',
+        encoding="utf-8",
+    )
+    tool.chmod(0o755)
+    return tool
+
+
+def _probes(bin_dir: Path) -> list[str]:
+    log = bin_dir.parent / "probes.log"
+    return log.read_text(encoding="utf-8").split() if log.exists() else []
+
+
+@pytest.fixture
+def repo(tmp_path: Path) -> Path:
+    repo_root = tmp_path / "repo"
+    (repo_root / ".mcodex").mkdir(parents=True)
+    (repo_root / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "pipelines": {
+                    "docx": {
+                        "steps": [{"kind": "pandoc", "from": "markdown", "to": "docx"}]
+                    }
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    text_dir = repo_root / "text_s"
+    text_dir.mkdir()
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    (text_dir / "metadata.yaml").write_text(
+        yaml.safe_dump({"metadata_version": 1, "id": "x", "title": "T", "slug": "s"}),
+        encoding="utf-8",
+    )
+    return repo_root
+
+
+def test_tools_are_probed_once_and_the_manifest_is_reused(
+    bin_dir: Path, repo: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    _install(bin_dir, "pandoc", "3.1")
+
+    tool = load_toolchain(repo).get("pandoc")
+    assert tool.version == "pandoc 3.1"
+    assert load_toolchain(repo).get("pandoc") == tool
+
+    manifest = repo / ".mcodex" / "cache" / "toolchain.json"
+    assert json.loads(manifest.read_text(encoding="utf-8"))["tools"]["pandoc"][
+        "path"
+    ] == str(bin_dir / "pandoc")
+
+    # A new process starts from the manifest.
+    monkeypatch.setattr(toolchain_mod, "_toolchains", {})
+    assert load_toolchain(repo).get("pandoc") == tool
+    assert _probes(bin_dir) == ["pandoc"]
+
+
+def test_changed_binary_or_path_is_probed_again(
+    bin_dir: Path, repo: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    tool = _install(bin_dir, "pandoc", "3.1")
+    before = load_toolchain(repo).fingerprints([{"kind": "pandoc"}])
+
+    _install(bin_dir, "pandoc", "3.2.1")
+    os.utime(tool, ns=(1, 1))
+    upgraded = load_toolchain(repo).get("pandoc")
+    assert upgraded.version == "pandoc 3.2.1"
+    assert load_toolchain(repo).fingerprints([{"kind": "pandoc"}]) != before
+
+    other = bin_dir.parent / "other"
+    other.mkdir()
+    _install(other, "pandoc", "9")
+    monkeypatch.setenv("PATH", f"{other}{os.pathsep}{bin_dir}")
+    assert load_toolchain(repo).get("pandoc").path == str(other / "pandoc")
+    assert _probes(bin_dir) == ["pandoc"] * 3
+
+
+def test_missing_tool_is_not_remembered(bin_dir: Path) -> None:
+    toolchain = load_toolchain(None)
+    with pytest.raises(RuntimeError, match="Required executable not found: vlna"):
+        toolchain.require("vlna")
+
+    _install(bin_dir, "vlna", "1.5")
+    assert load_toolchain(None).require("vlna") == str(bin_dir / "vlna")
+
+
+def test_artifacts_record_tool_versions(bin_dir: Path, repo: Path) -> None:
+    _install(bin_dir, "pandoc", "3.1")
+    result = run_pipeline(
+        pipeline_name="docx",
+        source_dir=repo / "text_s",
+        output_path=repo / "artifacts" / "s.docx",
+    )
+
+    assert result.tools == {"pandoc": "pandoc 3.1"}
+    (record,) = (repo / ".mcodex" / "cache" / "builds").rglob("*.tools.json")
+    assert json.loads(record.read_text(encoding="utf-8")) == {"pandoc": "pandoc 3.1"}
+
+    _install(bin_dir, "pandoc", "3.2")
+    os.utime(bin_dir / "pandoc", ns=(1, 1))
+    again = run_pipeline(
+        pipeline_name="docx",
+        source_dir=repo / "text_s",
+        output_path=repo / "artifacts" / "s.docx",
+    )
+    assert not again.cached
+    assert again.tools == {"pandoc": "pandoc 3.2"}
+
+
+def test_doctor_lists_tools_and_reports_missing_ones(
+    bin_dir: Path, repo: Path, capsys: pytest.CaptureFixture[str]
+) -> None:
+    _install(bin_dir, "pandoc", "3.1")
+    assert doctor(start=repo)
+    out = capsys.readouterr().out
+    assert "pandoc  docx       " in out
+    assert "pandoc 3.1" in out
+    assert "toolchain.json" in out
+
+    (bin_dir / "pandoc").unlink()
+    assert not doctor(start=repo, refresh=True)
+    assert "missing" in capsys.readouterr().out
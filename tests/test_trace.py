@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+from pathlib import Path
+
+import pytest
+
+from mcodex import trace
+from mcodex.cli import _pop_trace_option
+
+
+def _worker_span() -> None:
+    with trace.span("in worker", "test"):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _clean_env(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv(trace.ENV_VAR, raising=False)
+    monkeypatch.delenv("MCODEX_TRACE_OWNER", raising=False)
+
+
+def test_spans_are_noops_when_disabled(tmp_path: Path) -> None:
+    with trace.span("ignored"):
+        pass
+    assert not trace.enabled()
+    assert trace.finish() is None
+
+
+def test_nested_and_worker_spans_end_up_in_one_trace(tmp_path: Path) -> None:
+    out = tmp_path / "trace.json"
+    trace.start(out)
+    with trace.span("outer", "test", label="x"):
+        with trace.span("inner", "test"):
+            pass
+        proc = multiprocessing.get_context("fork").Process(target=_worker_span)
+        proc.start()
+        proc.join()
+
+    assert trace.finish() == out
+    assert not trace.enabled()
+
+    events = json.loads(out.read_text(encoding="utf-8"))["traceEvents"]
+    by_name = {e["name"]: e for e in events}
+    assert set(by_name) == {"outer", "inner", "in worker"}
+    outer, inner = by_name["outer"], by_name["inner"]
+    assert outer["ph"] == "X"
+    assert outer["args"] == {"label": "x"}
+    assert outer["ts"] <= inner["ts"]
+    assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+    assert by_name["in worker"]["pid"] != outer["pid"]
+    assert list(tmp_path.glob("*.part")) == []
+
+
+def test_pop_trace_option() -> None:
+    argv = ["build", "--trace=t.json", "story"]
+    assert _pop_trace_option(argv) == "t.json"
+    assert argv == ["build", "story"]
+
+    argv = ["snapshot", "--trace", "t.json", "draft"]
+    assert _pop_trace_option(argv) == "t.json"
+    assert argv == ["snapshot", "draft"]
+
+    assert _pop_trace_option(["status"]) is None
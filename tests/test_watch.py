@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import yaml
+
+from mcodex.config import SCRATCH_DIR_ENV_VAR
+from mcodex.services.watch import InotifyWatcher, PollingWatcher, watch, watch_roots
+
+
+def _make_repo(tmp_path: Path) -> tuple[Path, Path]:
+    repo = tmp_path / "repo"
+    (repo / ".mcodex" / "templates" / "latex").mkdir(parents=True)
+    (repo / ".mcodex" / "config.yaml").write_text("{}\n", encoding="utf-8")
+    text_dir = repo / "text_story"
+    (text_dir / ".snapshot").mkdir(parents=True)
+    (text_dir / "text.md").write_text("hello", encoding="utf-8")
+    return repo, text_dir
+
+
+def test_watch_roots_include_templates_inside_repo(tmp_path: Path) -> None:
+    repo, text_dir = _make_repo(tmp_path)
+
+    assert watch_roots(text_dir) == [
+        (text_dir, False),
+        (repo / ".mcodex" / "templates", True),
+    ]
+
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    assert watch_roots(outside) == [(outside, False)]
+
+
+def test_polling_watcher_sees_changes_but_ignores_hidden(tmp_path: Path) -> None:
+    repo, text_dir = _make_repo(tmp_path)
+    watcher = PollingWatcher(watch_roots(text_dir), interval=0.01)
+
+    assert watcher.wait(0.05) is False
+
+    (text_dir / ".snapshot" / "draft-1").mkdir()
+    (text_dir / ".text.md.swp").write_text("x", encoding="utf-8")
+    assert watcher.wait(0.05) is False
+
+    (repo / ".mcodex" / "templates" / "latex" / "main.tex").write_text(
+        "x", encoding="utf-8"
+    )
+    assert watcher.wait(0.5) is True
+    assert watcher.wait(0.05) is False
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux")
+def test_inotify_watcher_follows_new_template_dirs(tmp_path: Path) -> None:
+    repo, text_dir = _make_repo(tmp_path)
+    watcher = InotifyWatcher(watch_roots(text_dir))
+    try:
+        assert watcher.wait(0.05) is False
+
+        (text_dir / "text.md").write_text("changed", encoding="utf-8")
+        assert watcher.wait(1.0) is True
+
+        fonts = repo / ".mcodex" / "templates" / "latex" / "fonts"
+        fonts.mkdir()
+        assert watcher.wait(1.0) is True
+        while watcher.wait(0.05):
+            pass
+
+        (fonts / "a.otf").write_bytes(b"font")
+        assert watcher.wait(1.0) is True
+    finally:
+        watcher.close()
+
+
+class _Stop(Exception):
+    pass
+
+
+class _StopOnceToolRuns:
+    """Reports no change until the fake tool has started, then stops `watch`."""
+
+    def __init__(self, pid_file: Path) -> None:
+        self._pid_file = pid_file
+
+    def wait(self, timeout: float | None) -> bool:
+        deadline = time.monotonic() + 10
+        while not self._pid_file.is_file() or not self._pid_file.read_text():
+            if time.monotonic() > deadline:
+                raise AssertionError("the tool did not start")
+            time.sleep(0.02)
+        raise _Stop
+
+    def close(self) -> None:
+        return None
+
+
+def _alive(pid: int) -> bool:
+    try:
+        stat = Path(f"/proc/{pid}/stat").read_text(encoding="utf-8")
+    except FileNotFoundError:
+        return False
+    return stat.rsplit(")", 1)[1].split()[0] != "Z"
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="uses /proc")
+def test_cancelled_watch_build_kills_its_tools_and_cleans_up(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    repo, text_dir = _make_repo(tmp_path)
+    (repo / ".mcodex" / "config.yaml").write_text(
+        yaml.safe_dump(
+            {
+                "pipelines": {
+                    "docx": {
+                        "steps": [{"kind": "pandoc", "from": "markdown", "to": "docx"}]
+                    }
+                }
+            }
+        ),
+        encoding="utf-8",
+    )
+    (text_dir / "metadata.yaml").write_text(
+        "metadata_version: 1\nid: x\ntitle: T\nslug: story\nauthors: []\n",
+        encoding="utf-8",
+    )
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    pid_file = tmp_path / "tool.pid"
+    (bin_dir / "pandoc").write_text(
+        "#!/bin/sh\n"
+        'if [ "$1" = --version ]; then echo "pandoc 3.1"; exit 0; fi\n'
+        f'echo $$ > "{pid_file}"; exec sleep 30\n',
+        encoding="utf-8",
+    )
+    (bin_dir / "pandoc").chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    scratch = tmp_path / "scratch"
+    monkeypatch.setenv(SCRATCH_DIR_ENV_VAR, str(scratch))
+
+    with pytest.raises(_Stop):
+        watch(
+            text_dir=text_dir,
+            pipelines=["docx"],
+            use_cache=False,
+            watcher=_StopOnceToolRuns(pid_file),
+            log=lambda _: None,
+        )
+
+    pid = int(pid_file.read_text(encoding="utf-8"))
+    deadline = time.monotonic() + 5
+    while _alive(pid) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not _alive(pid)
+    assert not list(scratch.glob("mcodex-build-*"))